@@ -0,0 +1,140 @@
+#!/usr/bin/env python3
+"""
+Admission control - rejects or queues expensive PDFs before any parsing or rendering
+
+Everything here comes from the upload size and the document header: the page
+tree, the encryption dictionary and the fonts and image dimensions in each
+page's resources. No content stream is parsed and no page is rendered, and
+Streamlit uploads are read from their in-memory buffer, so admission
+writes nothing to disk; the one spool file per upload is made at extraction.
+"""
+
+import os
+
+import fitz  # PyMuPDF
+
+from ocr_utils import DEFAULT_ZOOM
+from upload_spool import UploadQuotaExceeded, spool_upload
+
+MAX_PAGES = int(os.getenv("ADMISSION_MAX_PAGES", "300"))
+# Estimated OCR work in megapixels: above QUEUE_MEGAPIXELS a file waits until
+# the cheap files are done, above MAX_MEGAPIXELS it is rejected
+QUEUE_MEGAPIXELS = float(os.getenv("ADMISSION_QUEUE_MEGAPIXELS", "300"))
+MAX_MEGAPIXELS = float(os.getenv("ADMISSION_MAX_MEGAPIXELS", "1500"))
+
+ADMIT = "admit"
+QUEUE = "queue"
+REJECT = "reject"
+
+
+def check_file_size(size, max_file_size_mb):
+    """Rejection reason for an oversized upload, or None; needs no read at all"""
+    if max_file_size_mb and size > max_file_size_mb * 1024 * 1024:
+        return f"{size / 1024 / 1024:.1f} MB is over the {max_file_size_mb} MB limit"
+    return None
+
+
+def estimate_megapixels(pdf_document, ocr_text_pages=False):
+    """Pixels OCR would have to process, from the fonts and image dimensions in the page resources
+
+    Pages that use a font have a text layer and cost nothing when the caller
+    reads text layers without OCR; pass `ocr_text_pages=True` for callers
+    that OCR every page, and they are costed at the page size rendered at
+    DEFAULT_ZOOM. Other pages with embedded images are costed at their
+    largest image, and pages with neither at the rendered page size.
+    """
+    total = 0
+    for page in pdf_document:
+        rendered = page.rect.width * page.rect.height * DEFAULT_ZOOM * DEFAULT_ZOOM
+        if page.get_fonts(full=False):
+            if ocr_text_pages:
+                total += rendered
+            continue
+        images = page.get_images(full=False)
+        if images:
+            total += max(image[2] * image[3] for image in images)
+        else:
+            total += rendered
+    return total / 1e6
+
+
+def admit_pdf(pdf_source, size, max_file_size_mb=None, max_pages=MAX_PAGES,
+              queue_megapixels=QUEUE_MEGAPIXELS, max_megapixels=MAX_MEGAPIXELS, ocr_text_pages=False):
+    """Decide whether a PDF (a path or an in-memory buffer) is processed now, queued behind cheaper files, or rejected
+
+    Returns a dict with the `decision` (ADMIT, QUEUE or REJECT), a readable
+    `reason`, and the `pages`, `encrypted` and `megapixels` that were checked.
+    `ocr_text_pages` is the caller's OCR policy (see estimate_megapixels).
+    """
+    result = {"decision": ADMIT, "reason": "", "pages": None, "encrypted": False, "megapixels": None}
+
+    size_error = check_file_size(size, max_file_size_mb)
+    if size_error:
+        result.update(decision=REJECT, reason=size_error)
+        return result
+
+    try:
+        if isinstance(pdf_source, str):
+            pdf_document = fitz.open(pdf_source)
+        else:
+            pdf_document = fitz.open(stream=pdf_source, filetype="pdf")
+    except Exception:
+        result.update(decision=REJECT, reason="not a readable PDF")
+        return result
+
+    try:
+        result["encrypted"] = bool(pdf_document.is_encrypted)
+        if pdf_document.needs_pass:
+            result.update(decision=REJECT, reason="password-protected")
+            return result
+
+        result["pages"] = pdf_document.page_count
+        if not result["pages"]:
+            result.update(decision=REJECT, reason="no pages")
+            return result
+        if max_pages and result["pages"] > max_pages:
+            result.update(decision=REJECT, reason=f"{result['pages']} pages is over the {max_pages} page limit")
+            return result
+
+        result["megapixels"] = round(estimate_megapixels(pdf_document, ocr_text_pages), 1)
+    finally:
+        pdf_document.close()
+
+    if max_megapixels and result["megapixels"] > max_megapixels:
+        result.update(decision=REJECT, reason=f"estimated {result['megapixels']:.0f} MP of OCR is over the {max_megapixels:.0f} MP limit")
+    elif queue_megapixels and result["megapixels"] > queue_megapixels:
+        result.update(decision=QUEUE, reason=f"estimated {result['megapixels']:.0f} MP of OCR")
+    return result
+
+
+def admit_uploads(uploaded_files, max_file_size_mb=None, quota=None, **limits):
+    """Run admission control over a batch of uploads
+
+    Returns (files_to_process, decisions): admitted files first, queued files
+    after them, and an (uploaded_file, result) pair for every upload.
+    """
+    admitted, queued, decisions = [], [], []
+    for uploaded_file in uploaded_files:
+        size_error = check_file_size(uploaded_file.size, max_file_size_mb)
+        if size_error:
+            result = {"decision": REJECT, "reason": size_error, "pages": None, "encrypted": False, "megapixels": None}
+        elif hasattr(uploaded_file, "getbuffer"):
+            # Streamlit uploads are already in memory: read them in place instead of spooling twice
+            buffer = uploaded_file.getbuffer()
+            try:
+                result = admit_pdf(buffer, uploaded_file.size, max_file_size_mb, **limits)
+            finally:
+                buffer.release()
+        else:
+            try:
+                with spool_upload(uploaded_file, quota) as spooled:
+                    result = admit_pdf(spooled.path, spooled.size, max_file_size_mb, **limits)
+            except UploadQuotaExceeded as e:
+                result = {"decision": REJECT, "reason": str(e), "pages": None, "encrypted": False, "megapixels": None}
+
+        decisions.append((uploaded_file, result))
+        if result["decision"] == ADMIT:
+            admitted.append(uploaded_file)
+        elif result["decision"] == QUEUE:
+            queued.append(uploaded_file)
+    return admitted + queued, decisions
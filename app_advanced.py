@@ -18,10 +18,38 @@ import traceback
 import base64
 import subprocess
 import shutil
+import threading
+import time
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from streamlit.runtime.scriptrunner import add_script_run_ctx, get_script_run_ctx
 
-# Load environment variables
+# Load environment variables before the local modules read their settings
 load_dotenv()
 
+from ocr_cache import page_cache_key, get_cached_text, store_text
+from budgets import BudgetExceeded, DocumentBudget, OCRWorker, ocr_page_within_budget, MODE_FULL, PAGE_SECONDS
+from text_cleanup import PAGE_BREAK, strip_boilerplate, strip_page_break
+from pdf_layout import WordLayout
+from pdf_type_detector import classify_pdf, should_skip_text_layer, PAGE_SCANNED
+from text_quality import is_low_quality, score_text
+from invoice_records import records_frame
+from invoice_segmenter import segment_invoices
+from admission import admit_uploads, check_file_size, QUEUE, REJECT
+from hedging import DEFAULT_DEADLINE_SECONDS, Hedger
+from model_router import (CHEAP_MODEL, STRONG_MODEL, ModelRouter, completion_limit, parse_extraction,
+                          validate_extraction)
+from request_packing import (COMPLETION_TOKENS_PER_DOC, DEFAULT_PACK_SIZE, MAX_PACK_DOC_TOKENS, PackingStats,
+                             build_packed_text, plan_packs, unpack_results)
+from batch_mode import (batch_rows, collect_results, list_runs, load_manifest, prepare_batch,
+                        refresh_batch, submit_batch)
+from prompt_templates import PROMPT_VERSION, build_messages, cached_tokens
+from rate_limiter import AIMDLimiter, MAX_REQUEUES
+from llm_backend import LLM_BASE_URL, LLM_MAX_RETRIES, LLM_TIMEOUT_SECONDS, create_client, needs_api_key
+from near_duplicates import DuplicateIndex
+from results_store import ResultsStore
+from supplier_templates import TemplateStore, read_layout
+from upload_spool import InFlightQuota, SESSION_INFLIGHT_MB, UploadQuotaExceeded, spool_upload
+
 # Configure page
 st.set_page_config(
     page_title="Invoice Data Extractor",
@@ -30,61 +58,154 @@ st.set_page_config(
     initial_sidebar_state="expanded"
 )
 
-# Initialize OpenAI
-def initialize_openai():
-    api_key = os.getenv("OPENAI_API_KEY")
-    if not api_key or api_key == "your_openai_api_key_here":
+# Initialize an OpenAI client for the configured backend (api.openai.com, a gateway or the local mock)
+def initialize_openai(base_url=None, timeout=LLM_TIMEOUT_SECONDS, max_retries=LLM_MAX_RETRIES):
+    try:
+        return create_client(os.getenv("OPENAI_API_KEY"), base_url, timeout, max_retries=max_retries)
+    except ValueError:
         st.error("Please set your OPENAI_API_KEY in the .env file")
         st.stop()
-    openai.api_key = api_key
-    return openai
+
+# OCR configurations tried in order, each on one render at a zoom chosen from the page's text height
+OCR_CONFIGS = [
+    '--psm 6 -c tessedit_char_whitelist=0123456789ABCDEFGHIJKLMNOPQRSTUVWXYZabcdefghijklmnopqrstuvwxyz.,-/:',
+    '--psm 3 -c tessedit_char_whitelist=0123456789ABCDEFGHIJKLMNOPQRSTUVWXYZabcdefghijklmnopqrstuvwxyz.,-/:',
+    '--psm 4 -c tessedit_char_whitelist=0123456789ABCDEFGHIJKLMNOPQRSTUVWXYZabcdefghijklmnopqrstuvwxyz.,-/:',
+    '--psm 1',
+    '--psm 12',
+    '--psm 8',
+    '--psm 13'
+]
+
+# OCR a single page, serving repeated page images from the OCR cache
+# The configurations run in a killable worker process under the page and document budgets
+def ocr_single_page(page, worker, document_budget, budget_events):
+    cache_key = page_cache_key(page, "advanced:adaptive")
+    cached_text = get_cached_text(cache_key)
+    if cached_text is not None:
+        return cached_text, True
+    
+    page_text, _ = ocr_page_within_budget(worker, page.number, MODE_FULL, document_budget, events=budget_events)
+    if page_text and page_text.strip():
+        store_text(cache_key, page_text)
+    return page_text, False
 
 # Advanced PDF text extraction with multiple strategies
-def extract_text_from_pdf_advanced(pdf_file):
+def extract_text_from_pdf_advanced(pdf_file, budget_events=None):
     text = ""
     methods_used = []
+    ocr_worker = None
     
     try:
         # Strategy 1: Direct memory processing
-        pdf_file.seek(0)
-        pdf_bytes = pdf_file.read()
+        # The upload is spooled to disk once; every backend opens it by path
+        pdf_path = pdf_file.path
         
-        if not pdf_bytes:
+        if not pdf_file.size:
             st.error("PDF file is empty or corrupted")
             return ""
         
-        st.info(f"📁 Processing PDF: {len(pdf_bytes):,} bytes")
+        st.info(f"📁 Processing PDF: {pdf_file.size:,} bytes")
         
-        # Strategy 2: Try pdfplumber with different approaches
+        # OCR of any page goes through one worker per document, started on first use
+        ocr_worker = OCRWorker(pdf_path, OCR_CONFIGS)
+        document_budget = DocumentBudget()
+        # Budget overruns are reported back to the caller's processing log
+        budget_events = budget_events if budget_events is not None else []
+        
+        # Route by a cheap structural probe: scanned files go straight to OCR
+        skip_text_layer = False
+        scanned_pages = []
         try:
-            # Approach 2a: Direct bytes
-            pdf_file.seek(0)
-            with pdfplumber.open(pdf_file) as pdf:
-                for page_num, page in enumerate(pdf.pages):
-                    # Try different extraction methods
-                    page_text = page.extract_text()
-                    if not page_text:
-                        # Try extracting tables and convert to text
-                        tables = page.extract_tables()
-                        if tables:
-                            for table in tables:
-                                for row in table:
-                                    if row:
-                                        page_text += ' '.join([str(cell) for cell in row if cell]) + '\n'
-                    
-                    if page_text and page_text.strip():
-                        text += page_text + "\n"
-                
-                if text.strip():
-                    methods_used.append("pdfplumber (enhanced)")
+            classification = classify_pdf(pdf_path)
+            st.caption(
+                f"🔎 Detected {classification['kind']} PDF "
+                f"(confidence {classification['confidence']:.0%}, {classification['elapsed_ms']:.0f} ms)"
+            )
+            skip_text_layer = should_skip_text_layer(classification, pdf_path)
+            scanned_pages = [p["page"] for p in classification["pages"] if p["kind"] == PAGE_SCANNED]
         except Exception as e:
-            st.warning(f"pdfplumber enhanced failed: {str(e)}")
+            st.warning(f"PDF classification failed: {str(e)}")
+        
+        # Strategy 2: Try pdfplumber with different approaches
+        if not skip_text_layer:
+            try:
+                # Approach 2a: Direct bytes
+                with pdfplumber.open(pdf_path) as pdf:
+                    page_texts = []
+                    for page_num, page in enumerate(pdf.pages):
+                        # Try different extraction methods
+                        page_text = page.extract_text() or ""
+                        if not page_text:
+                            # Try extracting tables and convert to text
+                            tables = page.extract_tables()
+                            if tables:
+                                for table in tables:
+                                    for row in table:
+                                        if row:
+                                            page_text += ' '.join([str(cell) for cell in row if cell]) + '\n'
+                        page_texts.append(page_text)
+                    
+                    if any(t.strip() for t in page_texts):
+                        methods_used.append("pdfplumber (enhanced)")
+                        
+                        # Image-only pages of mixed PDFs and pages with a garbage text layer
+                        # (CID fonts without ToUnicode, ligature soup) go to OCR, in page order
+                        low_quality_pages = [
+                            i for i, t in enumerate(page_texts) if t.strip() and is_low_quality(t)
+                        ]
+                        if low_quality_pages:
+                            st.warning(
+                                f"⚠️ Unreadable text layer on page(s) "
+                                f"{', '.join(str(i + 1) for i in low_quality_pages)} - sending to OCR"
+                            )
+                        ocr_pages = sorted(
+                            {i for i in scanned_pages if i < len(page_texts) and not page_texts[i].strip()}
+                            | set(low_quality_pages)
+                        )
+                        if ocr_pages:
+                            try:
+                                import pytesseract
+                                pdf_document = fitz.open(pdf_path)
+                                for page_num in ocr_pages:
+                                    try:
+                                        ocr_text, _ = ocr_single_page(
+                                            pdf_document[page_num], ocr_worker, document_budget, budget_events
+                                        )
+                                    except BudgetExceeded as e:
+                                        budget_events.append(f"stopped at page {page_num + 1}: {e}")
+                                        break
+                                    # Keep the text layer unless OCR actually reads better
+                                    if ocr_text.strip() and (
+                                        not page_texts[page_num].strip()
+                                        or score_text(ocr_text)["score"] > score_text(page_texts[page_num])["score"]
+                                    ):
+                                        page_texts[page_num] = ocr_text
+                                pdf_document.close()
+                                methods_used.append(f"OCR ({len(ocr_pages)} page(s))")
+                            except ImportError:
+                                st.info("🔍 OCR not available locally - image pages skipped")
+                            except Exception as e:
+                                st.warning(f"OCR of image pages failed: {str(e)}")
+                        
+                        # A page OCR could not improve keeps its text layer rather than being dropped
+                        still_low = [i for i in low_quality_pages if is_low_quality(page_texts[i])]
+                        if still_low:
+                            st.warning(
+                                f"⚠️ Page(s) {', '.join(str(i + 1) for i in still_low)} still read poorly "
+                                f"after OCR - kept as extracted"
+                            )
+                    
+                    # One entry per PDF page, empty or not, so page numbers stay the file's
+                    for page_text in page_texts:
+                        text += page_text + "\n" + PAGE_BREAK
+            except Exception as e:
+                st.warning(f"pdfplumber enhanced failed: {str(e)}")
         
         # Strategy 3: PyPDF2 with enhanced processing
-        if not text.strip():
+        if not text.strip() and not skip_text_layer:
             try:
-                pdf_file.seek(0)
-                pdf_reader = PyPDF2.PdfReader(pdf_file)
+                pdf_reader = PyPDF2.PdfReader(pdf_path)
                 
                 for page_num, page in enumerate(pdf_reader.pages):
                     # Try different text extraction methods
@@ -96,112 +217,66 @@ def extract_text_from_pdf_advanced(pdf_file):
                         except:
                             pass
                     
-                    if page_text and page_text.strip():
-                        text += page_text + "\n"
+                    text += (page_text or "") + "\n" + PAGE_BREAK
                 
                 if text.strip():
                     methods_used.append("PyPDF2 (enhanced)")
             except Exception as e:
                 st.warning(f"PyPDF2 enhanced failed: {str(e)}")
         
-        # Strategy 4: PyMuPDF with multiple approaches
-        if not text.strip():
+        # Strategy 4: PyMuPDF layout-aware extraction (keeps word positions)
+        if not text.strip() and not skip_text_layer:
             try:
-                pdf_document = fitz.open(stream=pdf_bytes, filetype="pdf")
+                pdf_document = fitz.open(pdf_path)
                 
-                for page_num in range(pdf_document.page_count):
-                    page = pdf_document[page_num]
-                    
-                    # Try different text extraction methods
-                    text_methods = [
-                        lambda p: p.get_text(),
-                        lambda p: p.get_text("text"),
-                        lambda p: p.get_text("words"),
-                        lambda p: p.get_text("blocks"),
-                        lambda p: p.get_text("dict")
-                    ]
+                # Rebuild rows and table cells from word coordinates
+                layout = WordLayout.from_document(pdf_document)
+                if len(layout):
+                    table_rows = layout.table_rows()
+                    text = layout.to_text(page_break="\n" + PAGE_BREAK, pages=table_rows) + "\n" + PAGE_BREAK
                     
-                    for method in text_methods:
-                        try:
-                            result = method(page)
-                            if isinstance(result, str) and result.strip():
-                                text += result + "\n"
-                                break
-                            elif isinstance(result, list):
-                                # Handle word/block lists
-                                words = []
-                                for item in result:
-                                    if isinstance(item, dict) and 'text' in item:
-                                        words.append(item['text'])
-                                    elif isinstance(item, str):
-                                        words.append(item)
-                                if words:
-                                    text += ' '.join(words) + "\n"
-                                    break
-                            elif isinstance(result, dict):
-                                # Handle dict format
-                                if 'blocks' in result:
-                                    for block in result['blocks']:
-                                        if 'lines' in block:
-                                            for line in block['lines']:
-                                                if 'spans' in line:
-                                                    for span in line['spans']:
-                                                        if 'text' in span:
-                                                            text += span['text'] + ' '
-                                    text += '\n'
-                                    break
-                        except:
-                            continue
+                    key_values = layout.key_values(table_rows)
+                    if key_values:
+                        with st.expander("🔑 Detected label/value pairs"):
+                            for label, value in key_values:
+                                st.text(f"{label}: {value}")
+                else:
+                    # No word boxes - fall back to plain text per page
+                    for page_num in range(pdf_document.page_count):
+                        page_text = pdf_document[page_num].get_text()
+                        text += (page_text or "") + "\n" + PAGE_BREAK
                 
                 pdf_document.close()
                 if text.strip():
-                    methods_used.append("PyMuPDF (multi-method)")
+                    methods_used.append("PyMuPDF (layout)")
             except Exception as e:
-                st.warning(f"PyMuPDF multi-method failed: {str(e)}")
+                st.warning(f"PyMuPDF layout extraction failed: {str(e)}")
         
         # Strategy 5: Advanced OCR with multiple configurations
         if not text.strip():
             try:
                 import pytesseract
-                pdf_document = fitz.open(stream=pdf_bytes, filetype="pdf")
+                pdf_document = fitz.open(pdf_path)
+                cache_hits = 0
                 
                 for page_num in range(pdf_document.page_count):
                     page = pdf_document[page_num]
                     
-                    # Try different image processing approaches
-                    for zoom in [1.0, 1.5, 2.0, 3.0]:
-                        try:
-                            mat = fitz.Matrix(zoom, zoom)
-                            pix = page.get_pixmap(matrix=mat)
-                            img_data = pix.tobytes("png")
-                            image = Image.open(io.BytesIO(img_data))
-                            
-                            # Try different OCR configurations
-                            ocr_configs = [
-                                '--psm 6 -c tessedit_char_whitelist=0123456789ABCDEFGHIJKLMNOPQRSTUVWXYZabcdefghijklmnopqrstuvwxyz.,-/:',
-                                '--psm 3 -c tessedit_char_whitelist=0123456789ABCDEFGHIJKLMNOPQRSTUVWXYZabcdefghijklmnopqrstuvwxyz.,-/:',
-                                '--psm 4 -c tessedit_char_whitelist=0123456789ABCDEFGHIJKLMNOPQRSTUVWXYZabcdefghijklmnopqrstuvwxyz.,-/:',
-                                '--psm 1',
-                                '--psm 12',
-                                '--psm 8',
-                                '--psm 13'
-                            ]
-                            
-                            for config in ocr_configs:
-                                try:
-                                    page_text = pytesseract.image_to_string(image, config=config)
-                                    if page_text and page_text.strip():
-                                        text += page_text + "\n"
-                                        break
-                                except:
-                                    continue
-                            
-                            if page_text and page_text.strip():
-                                break
-                        except:
-                            continue
+                    try:
+                        page_text, from_cache = ocr_single_page(page, ocr_worker, document_budget, budget_events)
+                    except BudgetExceeded as e:
+                        # Out of document budget: keep the pages read so far
+                        budget_events.append(f"stopped at page {page_num + 1}: {e}")
+                        break
+                    except:
+                        page_text, from_cache = "", False
+                    if from_cache:
+                        cache_hits += 1
+                    text += (page_text or "") + "\n" + PAGE_BREAK
                 
                 pdf_document.close()
+                if cache_hits:
+                    st.info(f"♻️ {cache_hits} page(s) served from the OCR cache")
                 if text.strip():
                     methods_used.append("OCR (advanced)")
             except ImportError:
@@ -212,7 +287,7 @@ def extract_text_from_pdf_advanced(pdf_file):
         # Strategy 6: Try to extract from images if available
         if not text.strip():
             try:
-                pdf_document = fitz.open(stream=pdf_bytes, filetype="pdf")
+                pdf_document = fitz.open(pdf_path)
                 
                 for page_num in range(pdf_document.page_count):
                     page = pdf_document[page_num]
@@ -234,14 +309,20 @@ def extract_text_from_pdf_advanced(pdf_file):
                             '--psm 12 -l eng'
                         ]
                         
+                        page_text = ""
                         for config in ocr_configs:
                             try:
-                                page_text = pytesseract.image_to_string(image, config=config)
+                                document_budget.check()
+                                page_text = strip_page_break(
+                                    pytesseract.image_to_string(image, config=config, timeout=PAGE_SECONDS)
+                                )
                                 if page_text and page_text.strip():
-                                    text += page_text + "\n"
                                     break
+                            except BudgetExceeded:
+                                break
                             except:
                                 continue
+                        text += (page_text or "") + "\n" + PAGE_BREAK
                     except ImportError:
                         st.info("🔍 OCR not available for image extraction")
                 
@@ -251,6 +332,9 @@ def extract_text_from_pdf_advanced(pdf_file):
             except Exception as e:
                 st.warning(f"Image OCR failed: {str(e)}")
         
+        if budget_events:
+            st.warning(f"⏱️ OCR budget limits hit ({len(budget_events)} event(s)) - output may be partial")
+        
         if text.strip():
             st.success(f"✅ Text extracted using: {', '.join(methods_used)}")
             st.info(f"📊 Extracted text length: {len(text)} characters")
@@ -271,11 +355,23 @@ def extract_text_from_pdf_advanced(pdf_file):
         st.error(f"❌ Error extracting text from PDF: {str(e)}")
         st.error(f"Traceback: {traceback.format_exc()}")
         return ""
+    finally:
+        if ocr_worker is not None:
+            ocr_worker.close()
     
     return text
 
-# Enhanced data extraction with better prompt engineering
-def extract_invoice_data(text, openai_client, file_name=""):
+# Enhanced data extraction with better prompt engineering; returns None if the text is too short
+def build_extraction_request(text, model=CHEAP_MODEL, fields=None, packed_ids=None):
+    # Drop headers/footers repeated on every page and known supplier boilerplate
+    # (packed requests were stripped per document before packing)
+    text, boilerplate_stats = strip_boilerplate(text) if not packed_ids else (text, {"removed_lines": 0})
+    if boilerplate_stats["removed_lines"]:
+        st.caption(
+            f"✂️ Removed {boilerplate_stats['removed_lines']} boilerplate line(s) "
+            f"(~{boilerplate_stats['tokens_saved']:,} tokens saved)"
+        )
+    
     # Clean and preprocess text
     text = re.sub(r'\s+', ' ', text)  # Normalize whitespace
     text = text.strip()
@@ -284,61 +380,73 @@ def extract_invoice_data(text, openai_client, file_name=""):
         st.warning(f"Text too short for reliable extraction: {len(text)} characters")
         return None
     
-    prompt = f"""
-    You are an expert at extracting structured data from invoices. Extract the following information from the provided invoice text and return it in JSON format.
-    If any information is not found, use "N/A" as the value.
-    
-    IMPORTANT: Look for these fields with various possible names/abbreviations:
-    - PO Number (could be: PO No, Purchase Order, P.O. Number, Order No, etc.)
-    - Item Code (could be: Item No, Product Code, SKU, Part Number, Product ID, etc.)
-    - Description (could be: Product Description, Item Description, Product Name, etc.)
-    - UOM (could be: Unit of Measure, Unit, U/M, Unit Type, etc.)
-    - Quantity (could be: Qty, Amount, Qty Ordered, etc.)
-    - Lot Number (could be: Lot No, Batch Number, Batch No, Lot ID, etc.)
-    - Expiry Date (could be: Exp Date, Expiration Date, Use By Date, etc.)
-    - Mfg Date (could be: Manufacturing Date, Mfg Date, Production Date, Made Date, etc.)
-    - Invoice No (could be: Invoice Number, Inv No, Invoice ID, etc.)
-    - Unit Price (could be: Price per Unit, Unit Cost, Price, Rate, etc.)
-    - Total Price (could be: Line Total, Item Total, Amount, etc.)
-    - Country (could be: Origin Country, Country of Origin, Made In, etc.)
-    - HS Code (could be: HSN Code, Tariff Code, Customs Code, etc.)
-    - Date of Invoice (could be: Invoice Date, Date, Issue Date, etc.)
-    - Customer No (could be: Customer Number, Customer ID, Client No, Account No, etc.)
-    - Payer Name (could be: Payer, Bill To, Billing Name, etc.)
-    - Currency (could be: Curr, Currency Code, etc.)
-    - Supplier Name (could be: Vendor Name, Supplier, Company Name, Seller, etc.)
-    - Total Amount of the Invoice (could be: Grand Total, Total Amount, Invoice Total, Net Total, etc.)
-    - Total VAT or Tax (could be: VAT, Tax, Tax Amount, VAT Amount, Tax Total, etc.)
-    
-    Instructions:
-    1. Look carefully through the entire text
-    2. Extract numerical values as numbers (not strings) when possible
-    3. Extract dates in a consistent format (YYYY-MM-DD if possible)
-    4. Be flexible with field names and variations
-    5. If multiple items are present, extract the first/main item or aggregate data
-    
-    Invoice text:
-    {text}
+    # Fixed instruction prefix first and the document last, so the provider can cache the prefix
+    return dict(
+        model=model,
+        messages=build_messages(text, fields=fields, packed_ids=packed_ids),
+        temperature=0.1,
+        max_tokens=min(completion_limit(model), max(2000, COMPLETION_TOKENS_PER_DOC * len(packed_ids or [])))
+    )
+
+# Send one extraction request, under the concurrency limiter and hedger when given
+def extract_invoice_data(text, openai_client, file_name="", limiter=None, hedger=None,
+                         model=CHEAP_MODEL, fields=None, usage_log=None, packed_ids=None):
+    request = build_extraction_request(text, model=model, fields=fields, packed_ids=packed_ids)
+    if request is None:
+        return None
     
-    Return only valid JSON format with the above fields as keys. Use the exact field names provided above.
-    """
+    def send(timeout=None, cancelled=None):
+        options = {"timeout": timeout} if timeout else {}
+        if limiter is None:
+            return openai_client.chat.completions.create(**request, **options)
+        # Hold a concurrency slot for the call and feed its headers back to the limiter
+        with limiter:
+            if cancelled is not None and cancelled.is_set():
+                return None
+            start = time.monotonic()
+            raw_response = openai_client.chat.completions.with_raw_response.create(**request, **options)
+            latency = time.monotonic() - start
+        limiter.on_success(latency, raw_response.headers)
+        return raw_response.parse()
     
     try:
-        response = openai_client.chat.completions.create(
-            model="gpt-3.5-turbo",
-            messages=[
-                {"role": "system", "content": "You are an expert at extracting structured data from invoices. Always return valid JSON format with the exact field names provided. Be thorough and accurate."},
-                {"role": "user", "content": prompt}
-            ],
-            temperature=0.1,
-            max_tokens=2000
-        )
+        # The hedger enforces the deadline and duplicates calls slower than p95
+        call_start = time.monotonic()
+        response = send() if hedger is None else hedger.call(send)
+        if usage_log is not None and getattr(response, "usage", None):
+            usage_log.append({
+                "model": model,
+                "prompt_tokens": response.usage.prompt_tokens,
+                "completion_tokens": response.usage.completion_tokens,
+                "cached_tokens": cached_tokens(response.usage),
+                "latency": time.monotonic() - call_start,
+            })
         
         return response.choices[0].message.content
+    except openai.RateLimitError as e:
+        # Throttled requests go back to the caller to be requeued; an exhausted quota will not recover
+        if limiter is not None and getattr(e, "code", None) != "insufficient_quota":
+            limiter.on_throttle(e.response.headers)
+            raise
+        st.error(f"Error calling OpenAI API: {str(e)}")
+        return None
     except Exception as e:
         st.error(f"Error calling OpenAI API: {str(e)}")
         return None
 
+# Worker threads need the Streamlit script context to write to the page
+def add_script_run_ctx_to_worker(ctx):
+    if ctx is not None:
+        add_script_run_ctx(threading.current_thread(), ctx)
+
+# Warn about rows flagged as possible double bookings
+def warn_double_bookings(rows):
+    for row in rows:
+        st.warning(
+            f"⚠️ Invoice {row.get('Invoice No')} from {row.get('Supplier Name', 'N/A')} "
+            f"({row.get('Source File', '?')}) may already be booked: {row['Possible Double Booking']}"
+        )
+
 # Enhanced Excel file creation with better formatting
 def create_excel_file(data_list, filename="extracted_invoice_data.xlsx"):
     wb = openpyxl.Workbook()
@@ -352,6 +460,9 @@ def create_excel_file(data_list, filename="extracted_invoice_data.xlsx"):
         "Country", "HS Code", "Date of Invoice", "Customer No", "Payer Name",
         "Currency", "Supplier Name", "Total Amount of the Invoice", "Total VAT or Tax"
     ]
+    for flag in ("Duplicate Of", "Possible Double Booking"):
+        if any(flag in data for data in data_list):
+            headers.append(flag)
     
     # Add headers with enhanced formatting
     header_fill = PatternFill(start_color="366092", end_color="366092", fill_type="solid")
@@ -415,9 +526,60 @@ def main():
         api_key = st.text_input("OpenAI API Key", type="password", value=os.getenv("OPENAI_API_KEY", ""))
         if api_key:
             os.environ["OPENAI_API_KEY"] = api_key
+        base_url = st.text_input(
+            "API Base URL",
+            value=LLM_BASE_URL,
+            help="Any OpenAI-compatible endpoint; empty for api.openai.com. Start mock_openai_server.py for an offline backend"
+        )
+        request_timeout = st.number_input("Request timeout (s)", 5, 600, int(LLM_TIMEOUT_SECONDS))
         
         st.markdown("### Processing Options")
         max_file_size = st.slider("Max File Size (MB)", 1, 50, 10)
+        split_invoices = st.checkbox(
+            "Split multi-invoice PDFs",
+            value=True,
+            help="Detect invoice boundaries (new invoice number, 'Page 1 of N', letterhead change) and extract each invoice separately"
+        )
+        max_parallel_requests = st.slider(
+            "Max parallel OpenAI requests", 1, 16, 8,
+            help="Upper bound; concurrency adapts below it to the OpenAI rate-limit headers and latency"
+        )
+        request_deadline = st.number_input("OpenAI request deadline (s)", 10, 600, int(DEFAULT_DEADLINE_SECONDS))
+        hedge_requests = st.checkbox(
+            "Hedge slow OpenAI requests",
+            value=False,
+            help="Send a duplicate request when one runs past the p95 latency and use whichever answers first"
+        )
+        
+        st.markdown("### Model Routing")
+        cheap_model = st.text_input("Extraction model", value=CHEAP_MODEL)
+        escalate_models = st.checkbox(
+            "Escalate failed extractions",
+            value=True,
+            help="Redo invoices (or only their failing fields) that fail schema, arithmetic or required-field checks on a stronger model"
+        )
+        strong_model = st.text_input("Escalation model", value=STRONG_MODEL, disabled=not escalate_models)
+        learn_templates = st.checkbox(
+            "Supplier templates",
+            value=True,
+            help="Learn repeat suppliers' layouts from validated extractions and extract matching invoices without the LLM"
+        )
+        duplicate_handling = st.selectbox(
+            "Near-duplicate invoices",
+            ["Reuse earlier result", "Leave out", "Process again"],
+            help="Invoices whose text matches one already processed (a second upload or a re-scan, in this or an earlier run) skip the LLM"
+        )
+        pack_requests = st.checkbox(
+            "Pack short invoices into one request",
+            value=False,
+            help=f"Invoices under ~{MAX_PACK_DOC_TOKENS:,} tokens share a request; any that fail validation are redone individually"
+        )
+        pack_size = st.slider("Invoices per packed request", 2, 10, DEFAULT_PACK_SIZE, disabled=not pack_requests)
+        batch_mode = st.checkbox(
+            "Batch mode (OpenAI Batch API)",
+            value=False,
+            help="Submit the invoices as one offline batch at batch pricing; results arrive within 24h under Batch Runs"
+        )
         
         # Show OCR status
         st.markdown("### OCR Status")
@@ -434,11 +596,13 @@ def main():
         st.info("💡 **Searchable PDFs**: Work locally\n🔍 **Scanned PDFs**: Work on Streamlit Cloud")
     
     # Initialize OpenAI
-    if not api_key:
+    if not api_key and needs_api_key(base_url):
         st.error("Please enter your OpenAI API key in the sidebar")
         st.stop()
     
-    openai_client = initialize_openai()
+    openai_client = initialize_openai(base_url, request_timeout)
+    # The AIMD limiter handles 429s itself, so its calls go out without SDK retries
+    limited_client = initialize_openai(base_url, request_timeout, max_retries=0)
     
     # File upload
     uploaded_files = st.file_uploader(
@@ -449,10 +613,10 @@ def main():
     )
     
     if uploaded_files:
-        # Check file sizes
-        large_files = [f for f in uploaded_files if f.size > max_file_size * 1024 * 1024]
+        # Check file sizes; oversized files are rejected before anything is read
+        large_files = [f for f in uploaded_files if check_file_size(f.size, max_file_size)]
         if large_files:
-            st.warning(f"Some files are larger than {max_file_size}MB: {[f.name for f in large_files]}")
+            st.warning(f"Some files are larger than {max_file_size}MB and will be skipped: {[f.name for f in large_files]}")
         
         st.success(f"Uploaded {len(uploaded_files)} file(s)")
         
@@ -463,41 +627,289 @@ def main():
             
             all_extracted_data = []
             processing_log = []
+            work_items = []
+            upload_quota = st.session_state.setdefault("upload_quota", InFlightQuota(SESSION_INFLIGHT_MB))
+            
+            # Admission control from size and PDF header: reject oversized or encrypted
+            # files and queue expensive ones behind the cheap ones, before any parsing
+            admitted_files, decisions = admit_uploads(uploaded_files, max_file_size, upload_quota)
+            for uploaded_file, admission in decisions:
+                if admission["decision"] == REJECT:
+                    st.warning(f"Skipped {uploaded_file.name}: {admission['reason']}")
+                    processing_log.append(f"❌ {uploaded_file.name}: Rejected - {admission['reason']}")
+                elif admission["decision"] == QUEUE:
+                    st.info(f"⏳ {uploaded_file.name} queued after cheaper files: {admission['reason']}")
+                    processing_log.append(f"⏳ {uploaded_file.name}: Queued - {admission['reason']}")
             
-            for i, uploaded_file in enumerate(uploaded_files):
+            # Stage 1: text extraction and invoice segmentation, one file at a time
+            for i, uploaded_file in enumerate(admitted_files):
                 status_text.text(f"Processing {uploaded_file.name}...")
                 
                 try:
-                    # Extract text from PDF using advanced method
-                    text = extract_text_from_pdf_advanced(uploaded_file)
+                    # Spool the upload to disk; the spool file is released once text is extracted
+                    budget_events = []
+                    with spool_upload(uploaded_file, upload_quota) as spooled:
+                        text = extract_text_from_pdf_advanced(spooled, budget_events=budget_events)
+                        layout = read_layout(spooled.path) if learn_templates else None
+                    for event in budget_events:
+                        processing_log.append(f"⏱️ {uploaded_file.name}: {event}")
                     
                     if text.strip():
-                        # Extract data using OpenAI
-                        extracted_data = extract_invoice_data(text, openai_client, uploaded_file.name)
-                        
-                        if extracted_data:
-                            try:
-                                # Parse JSON response
-                                data_dict = json.loads(extracted_data)
-                                data_dict['Source File'] = uploaded_file.name
-                                data_dict['Processing Time'] = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
-                                all_extracted_data.append(data_dict)
-                                processing_log.append(f"✅ {uploaded_file.name}: Success")
-                            except json.JSONDecodeError as e:
-                                st.warning(f"Could not parse data from {uploaded_file.name}: {str(e)}")
-                                processing_log.append(f"❌ {uploaded_file.name}: JSON Parse Error")
+                        segments = segment_invoices(text) if split_invoices else []
+                        if len(segments) > 1:
+                            st.info(f"🧾 {uploaded_file.name}: found {len(segments)} invoices")
                         else:
-                            st.warning(f"Could not extract data from {uploaded_file.name}")
-                            processing_log.append(f"❌ {uploaded_file.name}: No Data Extracted")
+                            segments = [{"pages": None, "invoice_no": None, "text": text}]
+                        
+                        for segment in segments:
+                            label = uploaded_file.name
+                            if segment["pages"] is not None:
+                                first, last = segment["pages"]
+                                label += f" (pages {first + 1}-{last + 1})" if last > first else f" (page {first + 1})"
+                            work_items.append({
+                                "file_name": uploaded_file.name,
+                                "label": label,
+                                "pages": segment["pages"],
+                                "text": segment["text"],
+                                "layout": layout.select_pages(*segment["pages"]) if layout and segment["pages"] else layout,
+                            })
                     else:
                         st.warning(f"No text could be extracted from {uploaded_file.name}")
                         processing_log.append(f"❌ {uploaded_file.name}: No Text Extracted")
                 
+                except UploadQuotaExceeded as e:
+                    st.warning(f"Skipped {uploaded_file.name}: {str(e)}")
+                    processing_log.append(f"❌ {uploaded_file.name}: Upload Limit - {str(e)}")
+                
                 except Exception as e:
                     st.error(f"Error processing {uploaded_file.name}: {str(e)}")
                     processing_log.append(f"❌ {uploaded_file.name}: Error - {str(e)}")
                 
-                progress_bar.progress((i + 1) / len(uploaded_files))
+                progress_bar.progress((i + 1) / len(admitted_files) * 0.5)
+            
+            # Batch mode: submit the requests as an offline batch instead of calling the API now
+            batch_run_id = None
+            if work_items and batch_mode:
+                entries = []
+                for index, item in enumerate(work_items):
+                    request = build_extraction_request(item["text"], model=cheap_model)
+                    if request is None:
+                        processing_log.append(f"❌ {item['label']}: Text Too Short")
+                        continue
+                    entries.append({
+                        "custom_id": f"item-{index}",
+                        "request": request,
+                        "meta": {"file_name": item["file_name"], "label": item["label"], "pages": item["pages"]},
+                    })
+                
+                if entries:
+                    batch_run_id = prepare_batch(entries)
+                    try:
+                        manifest = submit_batch(openai_client, batch_run_id)
+                        st.success(f"📨 Submitted batch run {batch_run_id} with {len(entries)} request(s)")
+                        processing_log.append(f"📨 Batch run {batch_run_id}: {len(entries)} request(s) submitted as {manifest['batch_id']}")
+                    except Exception as e:
+                        st.warning(f"Batch run {batch_run_id} was saved but not submitted: {str(e)}")
+                        processing_log.append(f"⚠️ Batch run {batch_run_id}: Not Submitted - {str(e)}")
+            
+            # Stage 2: each invoice is an independent OpenAI request, run concurrently
+            elif work_items:
+                status_text.text(f"Extracting data from {len(work_items)} invoice(s)...")
+                results = [None] * len(work_items)
+                ctx = get_script_run_ctx()
+                limiter = AIMDLimiter(max_parallel_requests)
+                hedger = Hedger(deadline=request_deadline, hedge=hedge_requests, max_workers=2 * max_parallel_requests)
+                router = ModelRouter(cheap_model, strong_model, escalate=escalate_models)
+                requeues = [0] * len(work_items)
+                templates = TemplateStore() if learn_templates else None
+                dedup_index = DuplicateIndex() if duplicate_handling != "Process again" else None
+                duplicates = {}
+                indexed = {}
+                
+                def run_work_item(index):
+                    item = work_items[index]
+                    
+                    def extract(model, fields, usage_log):
+                        return extract_invoice_data(
+                            item["text"], limited_client, item["file_name"], limiter=limiter, hedger=hedger,
+                            model=model, fields=fields, usage_log=usage_log
+                        )
+                    
+                    content = router.extract(extract, item["text"])
+                    if templates and item["layout"]:
+                        templates.learn(item["layout"], parse_extraction(content), item["text"])
+                    return index, content
+                
+                # Results for a group plus the documents in it that were throttled, to be requeued alone
+                def run_group(group):
+                    if len(group) == 1:
+                        return [run_work_item(group[0])], []
+                    
+                    # One request for the whole pack, then validate each document's result
+                    documents = [(str(n + 1), work_items[index]["text"]) for n, index in enumerate(group)]
+                    doc_ids = [doc_id for doc_id, _ in documents]
+                    content = extract_invoice_data(
+                        build_packed_text(documents), limited_client, "packed request",
+                        limiter=limiter, hedger=hedger, model=cheap_model, packed_ids=doc_ids
+                    )
+                    unpacked = unpack_results(content, doc_ids)
+                    
+                    group_results = []
+                    throttled = []
+                    fallbacks = 0
+                    for (doc_id, text), index in zip(documents, group):
+                        data = unpacked.get(doc_id)
+                        if data is not None and validate_extraction(data, text)["valid"]:
+                            group_results.append((index, json.dumps(data)))
+                            if templates and work_items[index]["layout"]:
+                                templates.learn(work_items[index]["layout"], data, work_items[index]["text"])
+                        else:
+                            # Missing or failing documents go through the normal single-document route
+                            try:
+                                group_results.append(run_work_item(index))
+                            except openai.RateLimitError as e:
+                                throttled.append((index, e))
+                            fallbacks += 1
+                    packing_stats.record(len(group), fallbacks)
+                    return group_results, throttled
+                
+                # Near-duplicates of an invoice processed before, or earlier in this run, skip the LLM
+                if dedup_index is not None:
+                    for index, item in enumerate(work_items):
+                        match = dedup_index.find(item["text"])
+                        if match is not None and (match["result"] is not None or match["doc_id"] in indexed.values()):
+                            duplicates[index] = match
+                            results[index] = match["result"]
+                        else:
+                            indexed[index] = dedup_index.add(item["text"], item["label"])
+                
+                # Supplier templates: invoices in a learned layout are extracted without the LLM
+                llm_indices = []
+                for index, item in enumerate(work_items):
+                    if index in duplicates:
+                        continue
+                    data = templates.extract(item["layout"], item["text"]) if templates and item["layout"] else None
+                    if data is not None:
+                        results[index] = json.dumps(data)
+                    else:
+                        llm_indices.append(index)
+                
+                texts = [work_items[index]["text"] for index in llm_indices]
+                # No more documents per pack than the cheap model's reply can hold
+                pack_size = min(pack_size, completion_limit(cheap_model) // COMPLETION_TOKENS_PER_DOC)
+                groups = (
+                    [[llm_indices[i] for i in group] for group in plan_packs(texts, pack_size)]
+                    if pack_requests else [[index] for index in llm_indices]
+                )
+                packing_stats = PackingStats()
+                
+                with ThreadPoolExecutor(
+                    max_workers=max_parallel_requests,
+                    initializer=add_script_run_ctx_to_worker,
+                    initargs=(ctx,)
+                ) as executor:
+                    pending = {executor.submit(run_group, group): group for group in groups}
+                    done = len(work_items) - len(llm_indices)
+                    while pending:
+                        finished, _ = wait(pending, return_when=FIRST_COMPLETED)
+                        for future in finished:
+                            group = pending.pop(future)
+                            group_results, throttled = [], []
+                            try:
+                                group_results, throttled = future.result()
+                            except openai.RateLimitError as e:
+                                if requeues[group[0]] < MAX_REQUEUES:
+                                    # The group's own request was throttled; the limiter has already backed off
+                                    requeues[group[0]] += 1
+                                    pending[executor.submit(run_group, group)] = group
+                                    continue
+                                st.error(f"Rate limited on {work_items[group[0]]['label']}: {str(e)}")
+                            except Exception as e:
+                                st.error(f"Error calling OpenAI API: {str(e)}")
+                            for index, extracted_data in group_results:
+                                results[index] = extracted_data
+                            finished_count = len(group)
+                            for index, e in throttled:
+                                if requeues[index] < MAX_REQUEUES:
+                                    # Only the throttled document goes back, on its own
+                                    requeues[index] += 1
+                                    pending[executor.submit(run_group, [index])] = [index]
+                                    finished_count -= 1
+                                else:
+                                    st.error(f"Rate limited on {work_items[index]['label']}: {str(e)}")
+                            done += finished_count
+                            progress_bar.progress(0.5 + done / len(work_items) * 0.5)
+                
+                hedger.close()
+                
+                limiter_stats = limiter.stats()
+                st.caption(
+                    f"🚦 OpenAI concurrency ended at {limiter_stats['limit']} (peak {limiter_stats['peak']}), "
+                    f"{sum(requeues)} throttled request(s) requeued"
+                )
+                processing_log.append(f"🔀 {router.summary()} [prompt v{PROMPT_VERSION}]")
+                if packing_stats.packs:
+                    processing_log.append(f"📦 {packing_stats.summary()}")
+                if templates:
+                    try:
+                        templates.save()
+                    except OSError as e:
+                        processing_log.append(f"⚠️ Supplier templates not saved - {str(e)}")
+                    processing_log.append(f"🧩 {templates.summary(len(work_items))}")
+                if dedup_index is not None:
+                    # Keep what this run extracted for later duplicates; forget the documents that failed
+                    indexed_index = {doc_id: index for index, doc_id in indexed.items()}
+                    for index, doc_id in indexed.items():
+                        if parse_extraction(results[index]) is not None:
+                            dedup_index.set_result(doc_id, results[index])
+                        else:
+                            dedup_index.remove(doc_id)
+                    for index, match in duplicates.items():
+                        if results[index] is None and match["doc_id"] in indexed_index:
+                            results[index] = results[indexed_index[match["doc_id"]]]
+                    processing_log.append(
+                        f"♻️ Near-duplicates: {len(duplicates)}/{len(work_items)} invoice(s) matched an already "
+                        f"processed document ({len(dedup_index):,} indexed)"
+                    )
+                    dedup_index.close()
+                hedge_stats = hedger.stats()
+                if hedge_stats["p50"] is not None:
+                    st.caption(
+                        f"⏱️ OpenAI latency p50 {hedge_stats['p50']:.1f}s / p95 {hedge_stats['p95']:.1f}s / "
+                        f"p99 {hedge_stats['p99']:.1f}s; {hedge_stats['hedges']} hedged "
+                        f"({hedge_stats['hedge_wins']} won), {hedge_stats['deadline_misses']} past the deadline"
+                    )
+                
+                # Report in upload order, whatever order the requests finished in
+                for index, (item, extracted_data) in enumerate(zip(work_items, results)):
+                    duplicate = duplicates.get(index)
+                    if duplicate is not None and duplicate_handling == "Leave out":
+                        processing_log.append(f"♻️ {item['label']}: Left Out - duplicate of {duplicate['label']}")
+                        continue
+                    if extracted_data:
+                        try:
+                            # Parse JSON response
+                            data_dict = json.loads(extracted_data)
+                            data_dict['Source File'] = item["file_name"]
+                            if item["pages"] is not None:
+                                first, last = item["pages"]
+                                data_dict['Source Pages'] = f"{first + 1}-{last + 1}"
+                            data_dict['Processing Time'] = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+                            if duplicate is not None:
+                                data_dict['Duplicate Of'] = f"{duplicate['label']} ({duplicate['similarity']:.0%} similar)"
+                            all_extracted_data.append(data_dict)
+                            processing_log.append(
+                                f"♻️ {item['label']}: Duplicate of {duplicate['label']}" if duplicate is not None
+                                else f"✅ {item['label']}: Success"
+                            )
+                        except json.JSONDecodeError as e:
+                            st.warning(f"Could not parse data from {item['label']}: {str(e)}")
+                            processing_log.append(f"❌ {item['label']}: JSON Parse Error")
+                    else:
+                        st.warning(f"Could not extract data from {item['label']}")
+                        processing_log.append(f"❌ {item['label']}: No Data Extracted")
+            
+            progress_bar.progress(1.0)
             
             # Display results
             st.markdown("---")
@@ -509,16 +921,23 @@ def main():
                     st.text(log_entry)
             
             if all_extracted_data:
-                # Create DataFrame
-                df = pd.DataFrame(all_extracted_data)
+                # Flag invoices already booked (same supplier, invoice number and total)
+                results_store = ResultsStore()
+                double_bookings = results_store.flag_double_bookings(all_extracted_data)
+                
+                # Create DataFrame with numeric, date and categorical columns
+                df = records_frame(all_extracted_data)
                 
                 # Display extracted data
                 st.success(f"Successfully extracted data from {len(all_extracted_data)} file(s)!")
+                warn_double_bookings(double_bookings)
                 st.dataframe(df, use_container_width=True)
                 
-                # Create and download Excel file
-                excel_filename = f"extracted_invoice_data_{datetime.now().strftime('%Y%m%d_%H%M%S')}.xlsx"
-                create_excel_file(all_extracted_data, excel_filename)
+                # Keep the run in the results store; the Excel file is generated from it
+                results_run_id = results_store.save_results(all_extracted_data)
+                excel_filename = f"extracted_invoice_data_{results_run_id}.xlsx"
+                create_excel_file(results_store.query(run_id=results_run_id, newest_first=False), excel_filename)
+                results_store.close()
                 
                 with open(excel_filename, "rb") as file:
                     st.download_button(
@@ -533,9 +952,127 @@ def main():
                     os.remove(excel_filename)
                 except:
                     pass
+            elif batch_run_id:
+                st.info("📨 Results will be available under Batch Runs once the batch completes")
             else:
                 st.error("No data could be extracted from any of the files")
                 st.info("💡 **Tips:**\n- Try uploading searchable PDFs for local processing\n- Scanned PDFs will work on Streamlit Cloud\n- Check if the files contain readable text")
+    
+    # Offline batch runs are kept on disk, so they can be resumed after a restart
+    batch_runs = list_runs()
+    if batch_runs:
+        st.markdown("---")
+        st.subheader("Batch Runs")
+        run_ids = [manifest["run_id"] for manifest in batch_runs]
+        run_id = st.selectbox(
+            "Batch run",
+            run_ids,
+            format_func=lambda rid: f"{rid} ({len(batch_runs[run_ids.index(rid)]['items'])} invoice(s))"
+        )
+        manifest = load_manifest(run_id)
+        
+        if st.button("Check status"):
+            try:
+                # Submits the run first if it never got that far
+                manifest = refresh_batch(openai_client, run_id)
+            except Exception as e:
+                st.error(f"Could not refresh batch run {run_id}: {str(e)}")
+        
+        counts = manifest.get("request_counts") or {}
+        st.info(
+            f"Status: **{manifest['status']}**"
+            + (f" - {counts.get('completed', 0)}/{counts.get('total', 0)} completed, {counts.get('failed', 0)} failed" if counts else "")
+        )
+        
+        if manifest["status"] == "completed":
+            try:
+                rows, failures = batch_rows(manifest, collect_results(openai_client, run_id))
+            except Exception as e:
+                st.error(f"Could not collect results for batch run {run_id}: {str(e)}")
+                rows, failures = [], []
+            
+            for label, reason in failures:
+                st.warning(f"Could not extract data from {label}: {reason}")
+            
+            if rows:
+                results_store = ResultsStore()
+                if not results_store.has_run(run_id):
+                    warn_double_bookings(results_store.flag_double_bookings(rows))
+                    results_store.save_results(rows, run_id=run_id, source="batch")
+                # Shown from the store, so the double-booking flags stay on later visits
+                stored_rows = results_store.query(run_id=run_id, newest_first=False)
+                st.dataframe(records_frame(stored_rows), use_container_width=True)
+                excel_filename = f"extracted_invoice_data_{run_id}.xlsx"
+                create_excel_file(stored_rows, excel_filename)
+                results_store.close()
+                
+                with open(excel_filename, "rb") as file:
+                    st.download_button(
+                        label="📥 Download Excel File",
+                        data=file.read(),
+                        file_name=excel_filename,
+                        mime="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet",
+                        key="batch_download"
+                    )
+                
+                try:
+                    os.remove(excel_filename)
+                except:
+                    pass
+    
+    # Every run is kept in the results store, searchable and exportable at any time
+    results_store = ResultsStore()
+    stored_runs = results_store.runs()
+    if stored_runs:
+        st.markdown("---")
+        st.subheader("Stored Results")
+        col1, col2, col3, col4 = st.columns(4)
+        with col1:
+            invoice_no = st.text_input("Invoice No", key="store_invoice_no")
+        with col2:
+            po_number = st.text_input("PO Number", key="store_po_number")
+        with col3:
+            supplier = st.text_input("Supplier Name", key="store_supplier", help="End with * to match a prefix")
+        with col4:
+            lot_number = st.text_input("Lot Number", key="store_lot_number")
+        col1, col2, col3 = st.columns(3)
+        with col1:
+            date_from = st.date_input("Invoice date from", value=None, key="store_date_from")
+        with col2:
+            date_to = st.date_input("Invoice date to", value=None, key="store_date_to")
+        with col3:
+            run_ids = [run["run_id"] for run in stored_runs]
+            store_run = st.selectbox(
+                "Run",
+                ["All runs"] + run_ids,
+                key="store_run",
+                format_func=lambda rid: rid if rid == "All runs" else f"{rid} ({stored_runs[run_ids.index(rid)]['row_count']} row(s))"
+            )
+        
+        if invoice_no or po_number or supplier or lot_number or date_from or date_to or store_run != "All runs":
+            rows = results_store.query(
+                invoice_no=invoice_no, po_number=po_number, supplier=supplier, lot_number=lot_number,
+                date_from=date_from, date_to=date_to, run_id=None if store_run == "All runs" else store_run
+            )
+            st.caption(f"{len(rows)} stored row(s) match")
+            if rows:
+                st.dataframe(records_frame(rows[:1000]), use_container_width=True)
+                if st.button("📄 Export to Excel", key="store_export"):
+                    excel_filename = f"invoice_results_{datetime.now().strftime('%Y%m%d_%H%M%S')}.xlsx"
+                    create_excel_file(rows, excel_filename)
+                    with open(excel_filename, "rb") as file:
+                        st.download_button(
+                            label="📥 Download Excel File",
+                            data=file.read(),
+                            file_name=excel_filename,
+                            mime="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet",
+                            key="store_download"
+                        )
+                    try:
+                        os.remove(excel_filename)
+                    except:
+                        pass
+    results_store.close()
 
 if __name__ == "__main__":
     main()
@@ -17,9 +17,12 @@ import tempfile
 import traceback
 import base64
 
-# Load environment variables
+# Load environment variables before the local modules read their settings
 load_dotenv()
 
+from llm_backend import LLM_BASE_URL, LLM_TIMEOUT_SECONDS, create_client, needs_api_key
+from upload_spool import InFlightQuota, SESSION_INFLIGHT_MB, UploadQuotaExceeded, spool_upload
+
 # Configure page
 st.set_page_config(
     page_title="Invoice Data Extractor",
@@ -28,14 +31,13 @@ st.set_page_config(
     initial_sidebar_state="expanded"
 )
 
-# Initialize OpenAI
-def initialize_openai():
-    api_key = os.getenv("OPENAI_API_KEY")
-    if not api_key or api_key == "your_openai_api_key_here":
+# Initialize an OpenAI client for the configured backend (api.openai.com, a gateway or the local mock)
+def initialize_openai(base_url=None, timeout=LLM_TIMEOUT_SECONDS):
+    try:
+        return create_client(os.getenv("OPENAI_API_KEY"), base_url, timeout)
+    except ValueError:
         st.error("Please set your OPENAI_API_KEY in the .env file")
         st.stop()
-    openai.api_key = api_key
-    return openai
 
 # Alternative PDF text extraction method
 def extract_text_from_pdf_alternative(pdf_file):
@@ -43,66 +45,56 @@ def extract_text_from_pdf_alternative(pdf_file):
     methods_used = []
     
     try:
-        # Method 1: Save to temporary file and process
-        with tempfile.NamedTemporaryFile(delete=False, suffix='.pdf') as temp_file:
-            pdf_file.seek(0)
-            temp_file.write(pdf_file.read())
-            temp_file.flush()
-            
-            # Try pdfplumber with file path
+        # Method 1: Open the spooled upload by path
+        pdf_path = pdf_file.path
+        
+        # Try pdfplumber with file path
+        try:
+            with pdfplumber.open(pdf_path) as pdf:
+                for page_num, page in enumerate(pdf.pages):
+                    page_text = page.extract_text()
+                    if page_text and page_text.strip():
+                        text += page_text + "\n"
+                if text.strip():
+                    methods_used.append("pdfplumber (file path)")
+        except Exception as e:
+            st.warning(f"pdfplumber (file path) failed: {str(e)}")
+        
+        # Try PyPDF2 with file path
+        if not text.strip():
             try:
-                with pdfplumber.open(temp_file.name) as pdf:
-                    for page_num, page in enumerate(pdf.pages):
+                with open(pdf_path, 'rb') as file:
+                    pdf_reader = PyPDF2.PdfReader(file)
+                    for page_num, page in enumerate(pdf_reader.pages):
                         page_text = page.extract_text()
                         if page_text and page_text.strip():
                             text += page_text + "\n"
                     if text.strip():
-                        methods_used.append("pdfplumber (file path)")
+                        methods_used.append("PyPDF2 (file path)")
             except Exception as e:
-                st.warning(f"pdfplumber (file path) failed: {str(e)}")
-            
-            # Try PyPDF2 with file path
-            if not text.strip():
-                try:
-                    with open(temp_file.name, 'rb') as file:
-                        pdf_reader = PyPDF2.PdfReader(file)
-                        for page_num, page in enumerate(pdf_reader.pages):
-                            page_text = page.extract_text()
-                            if page_text and page_text.strip():
-                                text += page_text + "\n"
-                        if text.strip():
-                            methods_used.append("PyPDF2 (file path)")
-                except Exception as e:
-                    st.warning(f"PyPDF2 (file path) failed: {str(e)}")
-            
-            # Try PyMuPDF with file path
-            if not text.strip():
-                try:
-                    pdf_document = fitz.open(temp_file.name)
-                    for page_num in range(pdf_document.page_count):
-                        page = pdf_document[page_num]
-                        page_text = page.get_text()
-                        if page_text and page_text.strip():
-                            text += page_text + "\n"
-                    pdf_document.close()
-                    if text.strip():
-                        methods_used.append("PyMuPDF (file path)")
-                except Exception as e:
-                    st.warning(f"PyMuPDF (file path) failed: {str(e)}")
-            
-            # Clean up temp file
+                st.warning(f"PyPDF2 (file path) failed: {str(e)}")
+        
+        # Try PyMuPDF with file path
+        if not text.strip():
             try:
-                os.unlink(temp_file.name)
-            except:
-                pass
+                pdf_document = fitz.open(pdf_path)
+                for page_num in range(pdf_document.page_count):
+                    page = pdf_document[page_num]
+                    page_text = page.get_text()
+                    if page_text and page_text.strip():
+                        text += page_text + "\n"
+                pdf_document.close()
+                if text.strip():
+                    methods_used.append("PyMuPDF (file path)")
+            except Exception as e:
+                st.warning(f"PyMuPDF (file path) failed: {str(e)}")
+        
         
         # Method 2: Try OCR with different approach
         if not text.strip():
             try:
                 import pytesseract
-                pdf_file.seek(0)
-                pdf_bytes = pdf_file.read()
-                pdf_document = fitz.open(stream=pdf_bytes, filetype="pdf")
+                pdf_document = fitz.open(pdf_path)
                 
                 for page_num in range(pdf_document.page_count):
                     page = pdf_document[page_num]
@@ -149,9 +141,7 @@ def extract_text_from_pdf_alternative(pdf_file):
         # Method 3: Try alternative text extraction
         if not text.strip():
             try:
-                pdf_file.seek(0)
-                pdf_bytes = pdf_file.read()
-                pdf_document = fitz.open(stream=pdf_bytes, filetype="pdf")
+                pdf_document = fitz.open(pdf_path)
                 
                 for page_num in range(pdf_document.page_count):
                     page = pdf_document[page_num]
@@ -345,6 +335,12 @@ def main():
         api_key = st.text_input("OpenAI API Key", type="password", value=os.getenv("OPENAI_API_KEY", ""))
         if api_key:
             os.environ["OPENAI_API_KEY"] = api_key
+        base_url = st.text_input(
+            "API Base URL",
+            value=LLM_BASE_URL,
+            help="Any OpenAI-compatible endpoint; empty for api.openai.com. Start mock_openai_server.py for an offline backend"
+        )
+        request_timeout = st.number_input("Request timeout (s)", 5, 600, int(LLM_TIMEOUT_SECONDS))
         
         st.markdown("### Processing Options")
         max_file_size = st.slider("Max File Size (MB)", 1, 50, 10)
@@ -364,11 +360,11 @@ def main():
         st.info("💡 **Searchable PDFs**: Work locally\n🔍 **Scanned PDFs**: Work on Streamlit Cloud")
     
     # Initialize OpenAI
-    if not api_key:
+    if not api_key and needs_api_key(base_url):
         st.error("Please enter your OpenAI API key in the sidebar")
         st.stop()
     
-    openai_client = initialize_openai()
+    openai_client = initialize_openai(base_url, request_timeout)
     
     # File upload
     uploaded_files = st.file_uploader(
@@ -393,13 +389,15 @@ def main():
             
             all_extracted_data = []
             processing_log = []
+            upload_quota = st.session_state.setdefault("upload_quota", InFlightQuota(SESSION_INFLIGHT_MB))
             
             for i, uploaded_file in enumerate(uploaded_files):
                 status_text.text(f"Processing {uploaded_file.name}...")
                 
                 try:
                     # Extract text from PDF using alternative method
-                    text = extract_text_from_pdf_alternative(uploaded_file)
+                    with spool_upload(uploaded_file, upload_quota) as spooled:
+                        text = extract_text_from_pdf_alternative(spooled)
                     
                     if text.strip():
                         # Extract data using OpenAI
@@ -423,6 +421,10 @@ def main():
                         st.warning(f"No text could be extracted from {uploaded_file.name}")
                         processing_log.append(f"❌ {uploaded_file.name}: No Text Extracted")
                 
+                except UploadQuotaExceeded as e:
+                    st.warning(f"Skipped {uploaded_file.name}: {str(e)}")
+                    processing_log.append(f"❌ {uploaded_file.name}: Upload Limit - {str(e)}")
+                
                 except Exception as e:
                     st.error(f"Error processing {uploaded_file.name}: {str(e)}")
                     processing_log.append(f"❌ {uploaded_file.name}: Error - {str(e)}")
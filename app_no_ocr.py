@@ -15,6 +15,7 @@ import openpyxl
 from openpyxl.styles import Font, PatternFill, Alignment
 import tempfile
 import traceback
+from upload_spool import InFlightQuota, SESSION_INFLIGHT_MB, UploadQuotaExceeded, spool_upload
 
 # Load environment variables
 load_dotenv()
@@ -42,12 +43,12 @@ def extract_text_from_pdf(pdf_file):
     methods_used = []
     
     try:
-        # Reset file pointer
-        pdf_file.seek(0)
+        # The upload is spooled to disk once; every backend opens it by path
+        pdf_path = pdf_file.path
         
         # Method 1: Try pdfplumber (best for searchable PDFs)
         try:
-            with pdfplumber.open(pdf_file) as pdf:
+            with pdfplumber.open(pdf_path) as pdf:
                 for page_num, page in enumerate(pdf.pages):
                     page_text = page.extract_text()
                     if page_text and page_text.strip():
@@ -60,8 +61,7 @@ def extract_text_from_pdf(pdf_file):
         # Method 2: Try PyPDF2 as fallback
         if not text.strip():
             try:
-                pdf_file.seek(0)
-                pdf_reader = PyPDF2.PdfReader(pdf_file)
+                pdf_reader = PyPDF2.PdfReader(pdf_path)
                 for page_num, page in enumerate(pdf_reader.pages):
                     page_text = page.extract_text()
                     if page_text and page_text.strip():
@@ -75,8 +75,7 @@ def extract_text_from_pdf(pdf_file):
         if not text.strip():
             try:
                 import pytesseract
-                pdf_file.seek(0)
-                pdf_document = fitz.open(stream=pdf_file.read(), filetype="pdf")
+                pdf_document = fitz.open(pdf_path)
                 for page_num in range(pdf_document.page_count):
                     page = pdf_document[page_num]
                     # Convert page to image with higher resolution
@@ -305,13 +304,15 @@ def main():
             
             all_extracted_data = []
             processing_log = []
+            upload_quota = st.session_state.setdefault("upload_quota", InFlightQuota(SESSION_INFLIGHT_MB))
             
             for i, uploaded_file in enumerate(uploaded_files):
                 status_text.text(f"Processing {uploaded_file.name}...")
                 
                 try:
                     # Extract text from PDF
-                    text = extract_text_from_pdf(uploaded_file)
+                    with spool_upload(uploaded_file, upload_quota) as spooled:
+                        text = extract_text_from_pdf(spooled)
                     
                     if text.strip():
                         # Extract data using OpenAI
@@ -335,6 +336,10 @@ def main():
                         st.warning(f"No text could be extracted from {uploaded_file.name}")
                         processing_log.append(f"❌ {uploaded_file.name}: No Text Extracted")
                 
+                except UploadQuotaExceeded as e:
+                    st.warning(f"Skipped {uploaded_file.name}: {str(e)}")
+                    processing_log.append(f"❌ {uploaded_file.name}: Upload Limit - {str(e)}")
+                
                 except Exception as e:
                     st.error(f"Error processing {uploaded_file.name}: {str(e)}")
                     processing_log.append(f"❌ {uploaded_file.name}: Error - {str(e)}")
@@ -16,10 +16,23 @@ from openpyxl.styles import Font, PatternFill, Alignment
 import tempfile
 import traceback
 import base64
+import time
 
-# Load environment variables
+# Load environment variables before the local modules read their settings
 load_dotenv()
 
+from ocr_cache import page_cache_key, get_cached_text, store_text
+from text_cleanup import PAGE_BREAK, strip_boilerplate
+from lazy_pages import lazy_extract_pages
+from budgets import (BudgetExceeded, DocumentBudget, OCRWorker, ocr_page_within_budget,
+                     MODE_FULL, MODE_TIERED, PAGE_SECONDS, DOCUMENT_SECONDS, PAGE_RSS_MB)
+from admission import admit_uploads, check_file_size, QUEUE, REJECT
+from hedging import DEFAULT_DEADLINE_SECONDS, Hedger
+from model_router import CHEAP_MODEL, STRONG_MODEL, ModelRouter
+from prompt_templates import build_messages, cached_tokens
+from llm_backend import LLM_BASE_URL, LLM_TIMEOUT_SECONDS, create_client, needs_api_key
+from upload_spool import InFlightQuota, SESSION_INFLIGHT_MB, UploadQuotaExceeded, spool_upload
+
 # Configure page
 st.set_page_config(
     page_title="Invoice Data Extractor",
@@ -28,83 +41,115 @@ st.set_page_config(
     initial_sidebar_state="expanded"
 )
 
-# Initialize OpenAI
-def initialize_openai():
-    api_key = os.getenv("OPENAI_API_KEY")
-    if not api_key or api_key == "your_openai_api_key_here":
+# Initialize an OpenAI client for the configured backend (api.openai.com, a gateway or the local mock)
+def initialize_openai(base_url=None, timeout=LLM_TIMEOUT_SECONDS):
+    try:
+        return create_client(os.getenv("OPENAI_API_KEY"), base_url, timeout)
+    except ValueError:
         st.error("Please set your OPENAI_API_KEY in the .env file")
         st.stop()
-    openai.api_key = api_key
-    return openai
 
 # Specialized OCR extraction for scanned PDFs
-def extract_text_from_scanned_pdf(pdf_file):
+def extract_text_from_scanned_pdf(pdf_file, tiered_ocr=False, lazy_pages=False, budget=None, budget_events=None):
     text = ""
     methods_used = []
     
     try:
-        # Get file content as bytes
-        pdf_file.seek(0)
-        pdf_bytes = pdf_file.read()
+        # The upload is spooled to disk once; every backend opens it by path
+        pdf_path = pdf_file.path
         
-        if not pdf_bytes:
+        if not pdf_file.size:
             st.error("PDF file is empty or corrupted")
             return ""
         
-        st.info(f"📁 Processing PDF: {len(pdf_bytes):,} bytes")
+        st.info(f"📁 Processing PDF: {pdf_file.size:,} bytes")
         
         # Method 1: Try OCR with PyMuPDF (best for scanned PDFs)
         try:
             import pytesseract
-            pdf_document = fitz.open(stream=pdf_bytes, filetype="pdf")
+            pdf_document = fitz.open(pdf_path)
+            tier_stats = {"fast_time": 0.0, "reocr_time": 0.0, "reocr_area": 0.0, "page_area": 0.0}
+            ocr_settings = "scanned:tiered" if tiered_ocr else "scanned:adaptive"
+            cache_hits = 0
+            
+            # Try different OCR configurations optimized for invoices
+            ocr_configs = [
+                '--psm 6 -c tessedit_char_whitelist=0123456789ABCDEFGHIJKLMNOPQRSTUVWXYZabcdefghijklmnopqrstuvwxyz.,-/:() ',
+                '--psm 3 -c tessedit_char_whitelist=0123456789ABCDEFGHIJKLMNOPQRSTUVWXYZabcdefghijklmnopqrstuvwxyz.,-/:() ',
+                '--psm 4 -c tessedit_char_whitelist=0123456789ABCDEFGHIJKLMNOPQRSTUVWXYZabcdefghijklmnopqrstuvwxyz.,-/:() ',
+                '--psm 1',
+                '--psm 12',
+                '--psm 8'
+            ]
             
-            for page_num in range(pdf_document.page_count):
+            # OCR runs in a killable worker process under page and document budgets
+            budget = budget or {}
+            budget_events = budget_events if budget_events is not None else []
+            worker = OCRWorker(pdf_path, ocr_configs, page_rss_mb=budget.get("page_rss_mb", PAGE_RSS_MB))
+            document_budget = DocumentBudget(seconds=budget.get("document_seconds", DOCUMENT_SECONDS))
+            document_exhausted = False
+            
+            def ocr_page(page_num):
+                nonlocal cache_hits, document_exhausted
+                if document_exhausted:
+                    return ""
                 page = pdf_document[page_num]
                 
-                # Convert page to high-resolution image
-                mat = fitz.Matrix(3.0, 3.0)  # 3x zoom for better OCR
-                pix = page.get_pixmap(matrix=mat)
-                img_data = pix.tobytes("png")
-                image = Image.open(io.BytesIO(img_data))
-                
-                # Try different OCR configurations optimized for invoices
-                ocr_configs = [
-                    '--psm 6 -c tessedit_char_whitelist=0123456789ABCDEFGHIJKLMNOPQRSTUVWXYZabcdefghijklmnopqrstuvwxyz.,-/:() ',
-                    '--psm 3 -c tessedit_char_whitelist=0123456789ABCDEFGHIJKLMNOPQRSTUVWXYZabcdefghijklmnopqrstuvwxyz.,-/:() ',
-                    '--psm 4 -c tessedit_char_whitelist=0123456789ABCDEFGHIJKLMNOPQRSTUVWXYZabcdefghijklmnopqrstuvwxyz.,-/:() ',
-                    '--psm 1',
-                    '--psm 12',
-                    '--psm 8'
-                ]
+                # Boilerplate pages (T&Cs, certificates) are often identical across invoices
+                cache_key = page_cache_key(page, ocr_settings)
+                cached_text = get_cached_text(cache_key)
+                if cached_text is not None:
+                    cache_hits += 1
+                    return cached_text
                 
-                page_text = ""
-                for config in ocr_configs:
-                    try:
-                        page_text = pytesseract.image_to_string(image, config=config)
-                        if page_text and page_text.strip():
-                            text += page_text + "\n"
-                            break
-                    except:
-                        continue
+                # Full or tiered OCR, falling back to cheaper modes when the page overruns
+                try:
+                    page_text, stats = ocr_page_within_budget(
+                        worker, page_num, MODE_TIERED if tiered_ocr else MODE_FULL, document_budget,
+                        page_seconds=budget.get("page_seconds", PAGE_SECONDS), events=budget_events
+                    )
+                except BudgetExceeded as e:
+                    # Out of document budget: keep what we have and stop OCRing
+                    document_exhausted = True
+                    budget_events.append(f"stopped at page {page_num + 1}: {e}")
+                    return ""
+                except Exception as e:
+                    st.warning(f"OCR failed on page {page_num + 1}: {str(e)}")
+                    return ""
                 
-                # If no text found, try with different image processing
-                if not page_text or not page_text.strip():
-                    # Try with different zoom levels
-                    for zoom in [2.0, 4.0, 5.0]:
-                        try:
-                            mat = fitz.Matrix(zoom, zoom)
-                            pix = page.get_pixmap(matrix=mat)
-                            img_data = pix.tobytes("png")
-                            image = Image.open(io.BytesIO(img_data))
-                            
-                            page_text = pytesseract.image_to_string(image, config='--psm 6')
-                            if page_text and page_text.strip():
-                                text += page_text + "\n"
-                                break
-                        except:
-                            continue
+                for key in tier_stats:
+                    tier_stats[key] += stats.get(key, 0.0)
+                if page_text and page_text.strip():
+                    store_text(cache_key, page_text)
+                return page_text
+            
+            # Lazy mode: first and last page, then inwards only while required fields are missing
+            if lazy_pages:
+                page_texts, skipped_pages = lazy_extract_pages(pdf_document.page_count, ocr_page)
+                if skipped_pages:
+                    st.info(
+                        f"⏭️ Lazy loading: skipped {len(skipped_pages)} of {pdf_document.page_count} page(s) "
+                        f"- required fields were found without them"
+                    )
+            else:
+                page_texts = [ocr_page(page_num) for page_num in range(pdf_document.page_count)]
+            
+            for page_text in page_texts:
+                if page_text and page_text.strip():
+                    text += page_text + "\n" + PAGE_BREAK
             
+            worker.close()
             pdf_document.close()
+            if budget_events:
+                st.warning(f"⏱️ Budget limits hit ({len(budget_events)} event(s)) - output may be partial")
+            if cache_hits:
+                st.info(f"♻️ {cache_hits} page(s) served from the OCR cache")
+            if tiered_ocr and tier_stats["page_area"]:
+                st.info(
+                    f"⏱️ Tiered OCR: fast pass {tier_stats['fast_time']:.1f}s, "
+                    f"re-OCR {tier_stats['reocr_time']:.1f}s, "
+                    f"{tier_stats['reocr_area'] / tier_stats['page_area']:.0%} of page area re-processed"
+                )
             if text.strip():
                 methods_used.append("OCR (PyMuPDF + Tesseract)")
         except ImportError:
@@ -115,7 +160,7 @@ def extract_text_from_scanned_pdf(pdf_file):
         # Method 2: Try alternative text extraction methods
         if not text.strip():
             try:
-                pdf_document = fitz.open(stream=pdf_bytes, filetype="pdf")
+                pdf_document = fitz.open(pdf_path)
                 
                 for page_num in range(pdf_document.page_count):
                     page = pdf_document[page_num]
@@ -132,7 +177,7 @@ def extract_text_from_scanned_pdf(pdf_file):
                         try:
                             result = method(page)
                             if isinstance(result, str) and result.strip():
-                                text += result + "\n"
+                                text += result + "\n" + PAGE_BREAK
                                 break
                             elif isinstance(result, list):
                                 # Handle word/block lists
@@ -143,7 +188,7 @@ def extract_text_from_scanned_pdf(pdf_file):
                                     elif isinstance(item, str):
                                         words.append(item)
                                 if words:
-                                    text += ' '.join(words) + "\n"
+                                    text += ' '.join(words) + "\n" + PAGE_BREAK
                                     break
                         except:
                             continue
@@ -157,12 +202,11 @@ def extract_text_from_scanned_pdf(pdf_file):
         # Method 3: Try pdfplumber as fallback
         if not text.strip():
             try:
-                pdf_file.seek(0)
-                with pdfplumber.open(pdf_file) as pdf:
+                with pdfplumber.open(pdf_path) as pdf:
                     for page_num, page in enumerate(pdf.pages):
                         page_text = page.extract_text()
                         if page_text and page_text.strip():
-                            text += page_text + "\n"
+                            text += page_text + "\n" + PAGE_BREAK
                     if text.strip():
                         methods_used.append("pdfplumber")
             except Exception as e:
@@ -171,12 +215,11 @@ def extract_text_from_scanned_pdf(pdf_file):
         # Method 4: Try PyPDF2 as last resort
         if not text.strip():
             try:
-                pdf_file.seek(0)
-                pdf_reader = PyPDF2.PdfReader(pdf_file)
+                pdf_reader = PyPDF2.PdfReader(pdf_path)
                 for page_num, page in enumerate(pdf_reader.pages):
                     page_text = page.extract_text()
                     if page_text and page_text.strip():
-                        text += page_text + "\n"
+                        text += page_text + "\n" + PAGE_BREAK
                 if text.strip():
                     methods_used.append("PyPDF2")
             except Exception as e:
@@ -204,7 +247,15 @@ def extract_text_from_scanned_pdf(pdf_file):
     return text
 
 # Enhanced data extraction with better prompt engineering
-def extract_invoice_data(text, openai_client, file_name=""):
+def extract_invoice_data(text, openai_client, file_name="", hedger=None, model=CHEAP_MODEL, fields=None, usage_log=None):
+    # Drop headers/footers repeated on every page and known supplier boilerplate
+    text, boilerplate_stats = strip_boilerplate(text)
+    if boilerplate_stats["removed_lines"]:
+        st.caption(
+            f"✂️ Removed {boilerplate_stats['removed_lines']} boilerplate line(s) "
+            f"(~{boilerplate_stats['tokens_saved']:,} tokens saved)"
+        )
+    
     # Clean and preprocess text
     text = re.sub(r'\s+', ' ', text)  # Normalize whitespace
     text = text.strip()
@@ -213,55 +264,31 @@ def extract_invoice_data(text, openai_client, file_name=""):
         st.warning(f"Text too short for reliable extraction: {len(text)} characters")
         return None
     
-    prompt = f"""
-    You are an expert at extracting structured data from invoices. Extract the following information from the provided invoice text and return it in JSON format.
-    If any information is not found, use "N/A" as the value.
-    
-    IMPORTANT: Look for these fields with various possible names/abbreviations:
-    - PO Number (could be: PO No, Purchase Order, P.O. Number, Order No, etc.)
-    - Item Code (could be: Item No, Product Code, SKU, Part Number, Product ID, etc.)
-    - Description (could be: Product Description, Item Description, Product Name, etc.)
-    - UOM (could be: Unit of Measure, Unit, U/M, Unit Type, etc.)
-    - Quantity (could be: Qty, Amount, Qty Ordered, etc.)
-    - Lot Number (could be: Lot No, Batch Number, Batch No, Lot ID, etc.)
-    - Expiry Date (could be: Exp Date, Expiration Date, Use By Date, etc.)
-    - Mfg Date (could be: Manufacturing Date, Mfg Date, Production Date, Made Date, etc.)
-    - Invoice No (could be: Invoice Number, Inv No, Invoice ID, etc.)
-    - Unit Price (could be: Price per Unit, Unit Cost, Price, Rate, etc.)
-    - Total Price (could be: Line Total, Item Total, Amount, etc.)
-    - Country (could be: Origin Country, Country of Origin, Made In, etc.)
-    - HS Code (could be: HSN Code, Tariff Code, Customs Code, etc.)
-    - Date of Invoice (could be: Invoice Date, Date, Issue Date, etc.)
-    - Customer No (could be: Customer Number, Customer ID, Client No, Account No, etc.)
-    - Payer Name (could be: Payer, Bill To, Billing Name, etc.)
-    - Currency (could be: Curr, Currency Code, etc.)
-    - Supplier Name (could be: Vendor Name, Supplier, Company Name, Seller, etc.)
-    - Total Amount of the Invoice (could be: Grand Total, Total Amount, Invoice Total, Net Total, etc.)
-    - Total VAT or Tax (could be: VAT, Tax, Tax Amount, VAT Amount, Tax Total, etc.)
-    
-    Instructions:
-    1. Look carefully through the entire text
-    2. Extract numerical values as numbers (not strings) when possible
-    3. Extract dates in a consistent format (YYYY-MM-DD if possible)
-    4. Be flexible with field names and variations
-    5. If multiple items are present, extract the first/main item or aggregate data
-    
-    Invoice text:
-    {text}
-    
-    Return only valid JSON format with the above fields as keys. Use the exact field names provided above.
-    """
-    
-    try:
-        response = openai_client.chat.completions.create(
-            model="gpt-3.5-turbo",
-            messages=[
-                {"role": "system", "content": "You are an expert at extracting structured data from invoices. Always return valid JSON format with the exact field names provided. Be thorough and accurate."},
-                {"role": "user", "content": prompt}
-            ],
+    def send(timeout=None, cancelled=None):
+        if cancelled is not None and cancelled.is_set():
+            return None
+        options = {"timeout": timeout} if timeout else {}
+        return openai_client.chat.completions.create(
+            model=model,
+            # Fixed instruction prefix first and the document last, so the provider can cache the prefix
+            messages=build_messages(text, fields=fields),
             temperature=0.1,
-            max_tokens=2000
+            max_tokens=2000,
+            **options
         )
+    
+    try:
+        # The hedger enforces the deadline and duplicates calls slower than p95
+        call_start = time.monotonic()
+        response = send() if hedger is None else hedger.call(send)
+        if usage_log is not None and getattr(response, "usage", None):
+            usage_log.append({
+                "model": model,
+                "prompt_tokens": response.usage.prompt_tokens,
+                "completion_tokens": response.usage.completion_tokens,
+                "cached_tokens": cached_tokens(response.usage),
+                "latency": time.monotonic() - call_start,
+            })
         
         return response.choices[0].message.content
     except Exception as e:
@@ -344,9 +371,48 @@ def main():
         api_key = st.text_input("OpenAI API Key", type="password", value=os.getenv("OPENAI_API_KEY", ""))
         if api_key:
             os.environ["OPENAI_API_KEY"] = api_key
+        base_url = st.text_input(
+            "API Base URL",
+            value=LLM_BASE_URL,
+            help="Any OpenAI-compatible endpoint; empty for api.openai.com. Start mock_openai_server.py for an offline backend"
+        )
+        request_timeout = st.number_input("Request timeout (s)", 5, 600, int(LLM_TIMEOUT_SECONDS))
         
         st.markdown("### Processing Options")
         max_file_size = st.slider("Max File Size (MB)", 1, 50, 10)
+        tiered_ocr = st.checkbox(
+            "Tiered OCR",
+            value=False,
+            help="Fast low-resolution OCR pass, then re-OCR only low-confidence lines at high resolution"
+        )
+        lazy_pages = st.checkbox(
+            "Lazy page loading",
+            value=False,
+            help="OCR the first and last pages first and only read more pages while required fields are still missing"
+        )
+        
+        request_deadline = st.number_input("OpenAI request deadline (s)", 10, 600, int(DEFAULT_DEADLINE_SECONDS))
+        hedge_requests = st.checkbox(
+            "Hedge slow OpenAI requests",
+            value=False,
+            help="Send a duplicate request when one runs past the p95 latency and use whichever answers first"
+        )
+        
+        st.markdown("### Model Routing")
+        cheap_model = st.text_input("Extraction model", value=CHEAP_MODEL)
+        escalate_models = st.checkbox(
+            "Escalate failed extractions",
+            value=True,
+            help="Redo invoices (or only their failing fields) that fail schema, arithmetic or required-field checks on a stronger model"
+        )
+        strong_model = st.text_input("Escalation model", value=STRONG_MODEL, disabled=not escalate_models)
+        
+        st.markdown("### Processing Budgets")
+        budget = {
+            "page_seconds": st.number_input("Time per page (s)", 5, 600, int(PAGE_SECONDS)),
+            "document_seconds": st.number_input("Time per document (s)", 30, 3600, int(DOCUMENT_SECONDS)),
+            "page_rss_mb": st.number_input("OCR worker memory (MB)", 256, 8192, int(PAGE_RSS_MB)),
+        }
         
         # Show OCR status
         st.markdown("### OCR Status")
@@ -363,11 +429,11 @@ def main():
         st.info("💡 **Searchable PDFs**: Work locally\n🔍 **Scanned PDFs**: Work on Streamlit Cloud")
     
     # Initialize OpenAI
-    if not api_key:
+    if not api_key and needs_api_key(base_url):
         st.error("Please enter your OpenAI API key in the sidebar")
         st.stop()
     
-    openai_client = initialize_openai()
+    openai_client = initialize_openai(base_url, request_timeout)
     
     # File upload
     uploaded_files = st.file_uploader(
@@ -378,10 +444,10 @@ def main():
     )
     
     if uploaded_files:
-        # Check file sizes
-        large_files = [f for f in uploaded_files if f.size > max_file_size * 1024 * 1024]
+        # Check file sizes; oversized files are rejected before anything is read
+        large_files = [f for f in uploaded_files if check_file_size(f.size, max_file_size)]
         if large_files:
-            st.warning(f"Some files are larger than {max_file_size}MB: {[f.name for f in large_files]}")
+            st.warning(f"Some files are larger than {max_file_size}MB and will be skipped: {[f.name for f in large_files]}")
         
         st.success(f"Uploaded {len(uploaded_files)} file(s)")
         
@@ -392,17 +458,45 @@ def main():
             
             all_extracted_data = []
             processing_log = []
+            upload_quota = st.session_state.setdefault("upload_quota", InFlightQuota(SESSION_INFLIGHT_MB))
+            hedger = Hedger(deadline=request_deadline, hedge=hedge_requests)
+            router = ModelRouter(cheap_model, strong_model, escalate=escalate_models)
             
-            for i, uploaded_file in enumerate(uploaded_files):
+            # Admission control from size and PDF header: reject oversized or encrypted
+            # files and queue expensive ones behind the cheap ones, before any parsing.
+            # This app OCRs every page, text layer or not, so every page is costed
+            admitted_files, decisions = admit_uploads(uploaded_files, max_file_size, upload_quota, ocr_text_pages=True)
+            for uploaded_file, admission in decisions:
+                if admission["decision"] == REJECT:
+                    st.warning(f"Skipped {uploaded_file.name}: {admission['reason']}")
+                    processing_log.append(f"❌ {uploaded_file.name}: Rejected - {admission['reason']}")
+                elif admission["decision"] == QUEUE:
+                    st.info(f"⏳ {uploaded_file.name} queued after cheaper files: {admission['reason']}")
+                    processing_log.append(f"⏳ {uploaded_file.name}: Queued - {admission['reason']}")
+            
+            for i, uploaded_file in enumerate(admitted_files):
                 status_text.text(f"Processing {uploaded_file.name}...")
                 
                 try:
                     # Extract text from PDF using OCR-optimized method
-                    text = extract_text_from_scanned_pdf(uploaded_file)
+                    budget_events = []
+                    with spool_upload(uploaded_file, upload_quota) as spooled:
+                        text = extract_text_from_scanned_pdf(
+                            spooled, tiered_ocr=tiered_ocr, lazy_pages=lazy_pages,
+                            budget=budget, budget_events=budget_events
+                        )
+                    for event in budget_events:
+                        processing_log.append(f"⏱️ {uploaded_file.name}: {event}")
                     
                     if text.strip():
                         # Extract data using OpenAI
-                        extracted_data = extract_invoice_data(text, openai_client, uploaded_file.name)
+                        def extract(model, fields, usage_log):
+                            return extract_invoice_data(
+                                text, openai_client, uploaded_file.name, hedger=hedger,
+                                model=model, fields=fields, usage_log=usage_log
+                            )
+                        
+                        extracted_data = router.extract(extract, text)
                         
                         if extracted_data:
                             try:
@@ -422,11 +516,25 @@ def main():
                         st.warning(f"No text could be extracted from {uploaded_file.name}")
                         processing_log.append(f"❌ {uploaded_file.name}: No Text Extracted")
                 
+                except UploadQuotaExceeded as e:
+                    st.warning(f"Skipped {uploaded_file.name}: {str(e)}")
+                    processing_log.append(f"❌ {uploaded_file.name}: Upload Limit - {str(e)}")
+                
                 except Exception as e:
                     st.error(f"Error processing {uploaded_file.name}: {str(e)}")
                     processing_log.append(f"❌ {uploaded_file.name}: Error - {str(e)}")
                 
-                progress_bar.progress((i + 1) / len(uploaded_files))
+                progress_bar.progress((i + 1) / len(admitted_files))
+            
+            hedger.close()
+            processing_log.append(f"🔀 {router.summary()}")
+            hedge_stats = hedger.stats()
+            if hedge_stats["p50"] is not None:
+                st.caption(
+                    f"⏱️ OpenAI latency p50 {hedge_stats['p50']:.1f}s / p95 {hedge_stats['p95']:.1f}s / "
+                    f"p99 {hedge_stats['p99']:.1f}s; {hedge_stats['hedges']} hedged "
+                    f"({hedge_stats['hedge_wins']} won), {hedge_stats['deadline_misses']} past the deadline"
+                )
             
             # Display results
             st.markdown("---")
@@ -0,0 +1,228 @@
+#!/usr/bin/env python3
+"""
+Offline batch mode - extraction requests through the OpenAI Batch API
+
+For backfills that can wait up to a day: requests are written to a JSONL
+file, uploaded and submitted as one batch at batch pricing and outside the
+synchronous RPM limits. Every step records its result in the run's manifest,
+so an interrupted run resumes where it stopped instead of resubmitting.
+Point OPENAI_BASE_URL at mock_openai_server.py to exercise it locally.
+"""
+
+import json
+import os
+import tempfile
+import time
+import uuid
+from datetime import datetime
+
+from model_router import parse_extraction
+
+BATCH_DIR = os.getenv("BATCH_DIR", "batch_runs")
+BATCH_ENDPOINT = "/v1/chat/completions"
+COMPLETION_WINDOW = "24h"
+POLL_SECONDS = 60
+
+STATUS_PREPARED = "prepared"
+# Saved just before the batch is created: a run found in this state may already have a batch
+STATUS_SUBMITTING = "submitting"
+TERMINAL_STATUSES = {"completed", "failed", "expired", "cancelled"}
+
+
+def _run_path(run_id, name=""):
+    return os.path.join(BATCH_DIR, run_id, name)
+
+
+def load_manifest(run_id):
+    with open(_run_path(run_id, "manifest.json"), encoding="utf-8") as f:
+        return json.load(f)
+
+
+def save_manifest(manifest):
+    # Write-then-rename so a crash never leaves a half-written manifest, through a
+    # private temp file so two processes resuming the same run never share one
+    path = _run_path(manifest["run_id"], "manifest.json")
+    fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path), suffix=".tmp")
+    try:
+        with os.fdopen(fd, "w", encoding="utf-8") as f:
+            json.dump(manifest, f, indent=2)
+        os.replace(tmp_path, path)
+    except Exception:
+        os.remove(tmp_path)
+        raise
+
+
+def list_runs():
+    """Manifests of all batch runs, newest first"""
+    if not os.path.isdir(BATCH_DIR):
+        return []
+    runs = []
+    for run_id in os.listdir(BATCH_DIR):
+        try:
+            runs.append(load_manifest(run_id))
+        except (OSError, ValueError):
+            continue
+    return sorted(runs, key=lambda manifest: manifest["created"], reverse=True)
+
+
+def prepare_batch(entries, run_id=None):
+    """Write a run's requests.jsonl and manifest; returns the run id
+
+    `entries` are dicts with a unique `custom_id`, the chat completion
+    `request` body and `meta` (source file, pages) to map results back.
+    """
+    run_id = run_id or f"{datetime.now().strftime('%Y%m%d_%H%M%S')}_{uuid.uuid4().hex[:6]}"
+    os.makedirs(_run_path(run_id), exist_ok=True)
+
+    with open(_run_path(run_id, "requests.jsonl"), "w", encoding="utf-8") as f:
+        for entry in entries:
+            f.write(json.dumps({
+                "custom_id": entry["custom_id"],
+                "method": "POST",
+                "url": BATCH_ENDPOINT,
+                "body": entry["request"],
+            }) + "\n")
+
+    save_manifest({
+        "run_id": run_id,
+        "created": datetime.now().isoformat(timespec="seconds"),
+        "status": STATUS_PREPARED,
+        "input_file_id": None,
+        "batch_id": None,
+        "submitting_since": None,
+        "output_file_id": None,
+        "error_file_id": None,
+        "request_counts": {},
+        "items": {entry["custom_id"]: entry.get("meta", {}) for entry in entries},
+    })
+    return run_id
+
+
+def find_batch(client, run_id, since=0):
+    """The batch created for a run (tagged with its run_id in the metadata), or None
+
+    Batches are listed newest first, so the scan stops at the first one
+    created more than a minute before `since`.
+    """
+    for batch in client.batches.list(limit=100):
+        if batch.created_at and batch.created_at < since - 60:
+            break
+        if (batch.metadata or {}).get("run_id") == run_id:
+            return batch
+    return None
+
+
+def submit_batch(client, run_id):
+    """Upload the requests and create the batch, skipping whichever step already succeeded"""
+    manifest = load_manifest(run_id)
+    if manifest["batch_id"]:
+        return manifest
+
+    if not manifest["input_file_id"]:
+        with open(_run_path(run_id, "requests.jsonl"), "rb") as f:
+            manifest["input_file_id"] = client.files.create(file=f, purpose="batch").id
+        save_manifest(manifest)
+
+    # An earlier attempt may have created the batch and crashed before recording it
+    batch = None
+    if manifest["status"] == STATUS_SUBMITTING:
+        batch = find_batch(client, run_id, manifest.get("submitting_since") or 0)
+    if batch is None:
+        manifest["status"] = STATUS_SUBMITTING
+        manifest["submitting_since"] = int(time.time())
+        save_manifest(manifest)
+        batch = client.batches.create(
+            input_file_id=manifest["input_file_id"],
+            endpoint=BATCH_ENDPOINT,
+            completion_window=COMPLETION_WINDOW,
+            metadata={"run_id": run_id}
+        )
+    manifest["batch_id"] = batch.id
+    manifest["status"] = batch.status
+    save_manifest(manifest)
+    return manifest
+
+
+def refresh_batch(client, run_id):
+    """Fetch the batch status once (submitting first if the run never got that far)"""
+    manifest = submit_batch(client, run_id)
+    if manifest["status"] in TERMINAL_STATUSES:
+        return manifest
+
+    batch = client.batches.retrieve(manifest["batch_id"])
+    manifest["status"] = batch.status
+    manifest["output_file_id"] = batch.output_file_id
+    manifest["error_file_id"] = batch.error_file_id
+    counts = batch.request_counts
+    if counts is not None:
+        manifest["request_counts"] = {"total": counts.total, "completed": counts.completed, "failed": counts.failed}
+    save_manifest(manifest)
+    return manifest
+
+
+def poll_batch(client, run_id, interval=POLL_SECONDS, timeout=None):
+    """Block until the batch reaches a terminal status or `timeout` seconds pass"""
+    start = time.monotonic()
+    while True:
+        manifest = refresh_batch(client, run_id)
+        if manifest["status"] in TERMINAL_STATUSES:
+            return manifest
+        if timeout is not None and time.monotonic() - start + interval > timeout:
+            return manifest
+        time.sleep(interval)
+
+
+def _read_output_lines(client, file_id):
+    if not file_id:
+        return []
+    return [json.loads(line) for line in client.files.content(file_id).text.splitlines() if line.strip()]
+
+
+def collect_results(client, run_id):
+    """Download the batch output once and return {custom_id: {"content", "error"}}"""
+    results_path = _run_path(run_id, "results.json")
+    if os.path.exists(results_path):
+        with open(results_path, encoding="utf-8") as f:
+            return json.load(f)
+
+    manifest = load_manifest(run_id)
+    if manifest["status"] != "completed":
+        raise RuntimeError(f"batch {run_id} is {manifest['status']}, not completed")
+
+    results = {}
+    for line in _read_output_lines(client, manifest["output_file_id"]) + _read_output_lines(client, manifest["error_file_id"]):
+        response = line.get("response") or {}
+        body = response.get("body") or {}
+        error = line.get("error")
+        content = None
+        if response.get("status_code") == 200 and body.get("choices"):
+            content = body["choices"][0]["message"]["content"]
+        elif not error:
+            error = body.get("error") or f"HTTP {response.get('status_code')}"
+        results[line["custom_id"]] = {"content": content, "error": error}
+
+    with open(results_path, "w", encoding="utf-8") as f:
+        json.dump(results, f, indent=2)
+    return results
+
+
+def batch_rows(manifest, results):
+    """Extracted rows with their source file/pages, plus (label, reason) for every item that failed"""
+    rows, failures = [], []
+    for custom_id, meta in manifest["items"].items():
+        label = meta.get("label", custom_id)
+        result = results.get(custom_id)
+        if result is None:
+            failures.append((label, "no result in batch output"))
+            continue
+        data = parse_extraction(result["content"])
+        if data is None:
+            failures.append((label, str(result["error"] or "reply is not a JSON object")))
+            continue
+        data["Source File"] = meta.get("file_name", "")
+        if meta.get("pages"):
+            first, last = meta["pages"]
+            data["Source Pages"] = f"{first + 1}-{last + 1}"
+        data["Processing Time"] = manifest["created"].replace("T", " ")
+        rows.append(data)
+    return rows, failures
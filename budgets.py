@@ -0,0 +1,275 @@
+#!/usr/bin/env python3
+"""
+Processing budgets - wall-clock and memory limits for OCR, enforced with killable workers
+
+OCR runs in a separate process so a page that hangs Tesseract or balloons in
+memory can be killed without taking the Streamlit session down. The worker
+leads its own process group, so the tesseract processes pytesseract starts
+are measured with it and killed with it. When a page overruns we retry it
+with a cheaper strategy; when the document runs out of time we stop and
+return what we have.
+"""
+
+import multiprocessing
+import os
+import queue
+import signal
+import time
+
+PAGE_SECONDS = float(os.getenv("OCR_PAGE_SECONDS", "60"))
+DOCUMENT_SECONDS = float(os.getenv("OCR_DOCUMENT_SECONDS", "600"))
+PAGE_RSS_MB = float(os.getenv("OCR_PAGE_RSS_MB", "1024"))
+
+# OCR strategies, most to least expensive
+MODE_FULL = "full"
+MODE_TIERED = "tiered"
+MODE_FAST = "fast"
+
+# Cheaper strategies to fall back to when a page overruns
+DEGRADATION = {
+    MODE_FULL: [MODE_FULL, MODE_TIERED, MODE_FAST],
+    MODE_TIERED: [MODE_TIERED, MODE_FAST],
+    MODE_FAST: [MODE_FAST],
+}
+
+_POLL_SECONDS = 0.1
+
+
+class BudgetExceeded(Exception):
+    """Raised when a page or document runs over its time or memory budget"""
+
+    def __init__(self, kind, limit, used):
+        self.kind = kind
+        self.limit = limit
+        self.used = used
+        super().__init__(f"{kind} budget exceeded ({used:.1f} > {limit:.1f})")
+
+
+def process_rss_mb(pid=None):
+    """Resident set size of a process in MB, or None if it cannot be measured"""
+    pid = os.getpid() if pid is None else pid
+    try:
+        with open(f"/proc/{pid}/statm") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE") / (1024 * 1024)
+    except (OSError, ValueError, IndexError):
+        pass
+    try:
+        import psutil
+        return psutil.Process(pid).memory_info().rss / (1024 * 1024)
+    except Exception:
+        return None
+
+
+def process_group_rss_mb(pgid):
+    """Summed resident set size in MB of every process in a process group, or None if it cannot be measured"""
+    page_size = os.sysconf("SC_PAGE_SIZE")
+    total = 0
+    found = False
+    try:
+        entries = os.listdir("/proc")
+    except OSError:
+        entries = None
+    if entries is not None:
+        for entry in entries:
+            if not entry.isdigit():
+                continue
+            try:
+                with open(f"/proc/{entry}/stat") as f:
+                    # Fields after the parenthesised command name: state, ppid, pgrp, ...
+                    fields = f.read().rsplit(")", 1)[1].split()
+                if int(fields[2]) != pgid:
+                    continue
+                with open(f"/proc/{entry}/statm") as f:
+                    total += int(f.read().split()[1]) * page_size
+                found = True
+            except (OSError, ValueError, IndexError):
+                continue
+        if found:
+            return total / (1024 * 1024)
+    try:
+        import psutil
+        process = psutil.Process(pgid)
+        return sum(p.memory_info().rss for p in [process] + process.children(recursive=True)) / (1024 * 1024)
+    except Exception:
+        return None
+
+
+def _ocr_in_worker(page, mode, configs, timeout=0):
+    """Run one OCR strategy on a page inside the worker process; `timeout` bounds each Tesseract call"""
+    import pytesseract
+    from ocr_utils import (FAST_ZOOM, choose_ocr_zoom, ocr_page_text, render_page_image,
+                           tiered_ocr_page)
+    from text_cleanup import strip_page_break
+
+    if mode == MODE_FAST:
+        # Single low-resolution pass, no probing or re-OCR
+        image = render_page_image(page, FAST_ZOOM)
+        return strip_page_break(pytesseract.image_to_string(image, config='--psm 6', timeout=timeout)), {}
+
+    if mode == MODE_TIERED:
+        return tiered_ocr_page(page, timeout=timeout)
+
+    zoom = choose_ocr_zoom(page)
+    image = render_page_image(page, zoom)
+    for config in configs:
+        try:
+            page_text = ocr_page_text(page, config=config, zoom=zoom, image=image, timeout=timeout)
+            if page_text and page_text.strip():
+                return page_text, {}
+        except Exception:
+            continue
+    return "", {}
+
+
+def _worker_main(pdf_source, configs, memory_limit_mb, requests, results):
+    """Worker loop: open the document once, then OCR pages as they are requested"""
+    if hasattr(os, "setpgrp"):
+        # Lead a process group, so tesseract children are killed with the worker
+        os.setpgrp()
+    if memory_limit_mb:
+        try:
+            import resource
+            # Hard address-space cap as a backstop; the parent watches RSS more tightly
+            limit = int(memory_limit_mb * 2 * 1024 * 1024)
+            resource.setrlimit(resource.RLIMIT_AS, (limit, limit))
+        except Exception:
+            pass
+
+    import fitz  # PyMuPDF
+    if isinstance(pdf_source, (bytes, bytearray)):
+        pdf_document = fitz.open(stream=pdf_source, filetype="pdf")
+    else:
+        pdf_document = fitz.open(pdf_source)
+
+    while True:
+        request = requests.get()
+        if request is None:
+            break
+        page_num, mode, timeout = request
+        try:
+            page_text, stats = _ocr_in_worker(pdf_document[page_num], mode, configs, timeout)
+            results.put((page_num, page_text, stats, None))
+        except Exception as e:
+            results.put((page_num, "", {}, str(e)))
+
+    pdf_document.close()
+
+
+class OCRWorker:
+    """A child process that OCRs pages of one document and is killed when a page overruns"""
+
+    def __init__(self, pdf_source, configs, page_rss_mb=PAGE_RSS_MB):
+        self._pdf_source = pdf_source
+        self._configs = configs
+        self._page_rss_mb = page_rss_mb
+        self._context = multiprocessing.get_context("spawn")
+        self._process = None
+
+    def _start(self):
+        self._requests = self._context.Queue()
+        self._results = self._context.Queue()
+        self._process = self._context.Process(
+            target=_worker_main,
+            args=(self._pdf_source, self._configs, self._page_rss_mb, self._requests, self._results),
+            daemon=True
+        )
+        self._process.start()
+
+    def kill(self):
+        if self._process is not None:
+            if hasattr(os, "killpg"):
+                try:
+                    os.killpg(self._process.pid, signal.SIGKILL)
+                except OSError:
+                    # Not a group leader yet (or already gone)
+                    pass
+            self._process.kill()
+            self._process.join(timeout=5)
+            self._process = None
+
+    def close(self):
+        if self._process is not None:
+            try:
+                self._requests.put(None)
+                self._process.join(timeout=2)
+            finally:
+                self.kill()
+
+    def rss_mb(self):
+        """Memory of the worker and the tesseract processes it started"""
+        if self._process is None:
+            return 0.0
+        return process_group_rss_mb(self._process.pid) or process_rss_mb(self._process.pid) or 0.0
+
+    def ocr(self, page_num, mode, timeout):
+        """OCR one page, killing the worker if it runs past `timeout` seconds or the RSS budget"""
+        if self._process is None or not self._process.is_alive():
+            self._start()
+
+        # Tesseract is told the deadline too, so it stops on its own where it can
+        self._requests.put((page_num, mode, max(1, int(timeout))))
+        start = time.monotonic()
+        while True:
+            try:
+                result_page, page_text, stats, error = self._results.get(timeout=_POLL_SECONDS)
+            except queue.Empty:
+                elapsed = time.monotonic() - start
+                if elapsed > timeout:
+                    self.kill()
+                    raise BudgetExceeded("page time (s)", timeout, elapsed)
+                rss = self.rss_mb()
+                if self._page_rss_mb and rss > self._page_rss_mb:
+                    self.kill()
+                    raise BudgetExceeded("page memory (MB)", self._page_rss_mb, rss)
+                if not self._process.is_alive():
+                    self._process = None
+                    raise RuntimeError(f"OCR worker died on page {page_num + 1}")
+                continue
+            if result_page != page_num:
+                continue
+            if error:
+                raise RuntimeError(error)
+            return page_text, stats
+
+
+class DocumentBudget:
+    """Tracks a document's wall-clock time across pages
+
+    Memory is budgeted per page only: the document's pages run one at a
+    time in one worker, which is killed as soon as it passes the page limit.
+    """
+
+    def __init__(self, seconds=DOCUMENT_SECONDS):
+        self.seconds = seconds
+        self.start = time.monotonic()
+
+    def elapsed(self):
+        return time.monotonic() - self.start
+
+    def remaining(self):
+        return self.seconds - self.elapsed()
+
+    def check(self):
+        """Raise BudgetExceeded if the document is over its time budget"""
+        elapsed = self.elapsed()
+        if elapsed > self.seconds:
+            raise BudgetExceeded("document time (s)", self.seconds, elapsed)
+
+
+def ocr_page_within_budget(worker, page_num, mode, document_budget, page_seconds=PAGE_SECONDS, events=None):
+    """OCR a page under page and document budgets, degrading to cheaper modes on overrun
+
+    Returns (text, stats). Budget events are appended to `events` as strings.
+    Raises BudgetExceeded when the document budget is exhausted.
+    """
+    for attempt_mode in DEGRADATION[mode]:
+        document_budget.check()
+        timeout = min(page_seconds, document_budget.remaining())
+        try:
+            return worker.ocr(page_num, attempt_mode, timeout)
+        except BudgetExceeded as e:
+            if events is not None:
+                events.append(f"page {page_num + 1}: {e} in {attempt_mode} mode")
+    if events is not None:
+        events.append(f"page {page_num + 1}: skipped after exhausting cheaper OCR modes")
+    return "", {}
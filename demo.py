@@ -1,6 +1,9 @@
 #!/usr/bin/env python3
 """
 Demo script to test the invoice data extraction functionality
+
+Set LLM_CASSETTE_MODE=record once to save the API responses, then
+LLM_CASSETTE_MODE=replay to rerun the same checks offline.
 """
 
 import os
@@ -13,11 +16,12 @@ load_dotenv()
 def test_openai_connection():
     """Test OpenAI API connection"""
     try:
-        import openai
-        openai.api_key = os.getenv("OPENAI_API_KEY")
+        from llm_backend import create_client
+        # Honors OPENAI_BASE_URL and LLM_CASSETTE_MODE, so this can run against the mock or a recording
+        client = create_client(os.getenv("OPENAI_API_KEY"))
         
         # Test with a simple prompt
-        response = openai.chat.completions.create(
+        response = client.chat.completions.create(
             model="gpt-3.5-turbo",
             messages=[
                 {"role": "user", "content": "Hello, this is a test. Please respond with 'API connection successful'."}
@@ -82,8 +86,9 @@ def test_excel_creation():
 def test_data_extraction():
     """Test data extraction with sample text"""
     try:
-        import openai
-        openai.api_key = os.getenv("OPENAI_API_KEY")
+        from llm_backend import create_client
+        # Honors OPENAI_BASE_URL and LLM_CASSETTE_MODE, so this can run against the mock or a recording
+        client = create_client(os.getenv("OPENAI_API_KEY"))
         
         # Sample invoice text
         sample_text = """
@@ -137,7 +142,7 @@ def test_data_extraction():
         Return only valid JSON format with the above fields as keys.
         """
         
-        response = openai.chat.completions.create(
+        response = client.chat.completions.create(
             model="gpt-3.5-turbo",
             messages=[
                 {"role": "system", "content": "You are an expert at extracting structured data from invoices. Return only valid JSON."},
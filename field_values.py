@@ -0,0 +1,51 @@
+#!/usr/bin/env python3
+"""
+Field values - reading the model's free-text field values
+
+The model returns every field as text: amounts as "$1,234.50" or
+"1.234,50 EUR", and "N/A" for anything it could not find. Validation,
+routing, supplier templates, the results store and the typed record frames
+all read values through these functions, so they agree on what a value is.
+"""
+
+import re
+
+# Values the model writes for a field it could not find
+MISSING_VALUES = {"", "n/a", "na", "none", "null", "not found", "-"}
+
+# 1.234,50 / 12,5: a comma followed by one or two digits at the end is the decimal mark
+_DECIMAL_COMMA = re.compile(r'^-?\d{1,3}(?:\.\d{3})*,\d{1,2}$|^-?\d+,\d{1,2}$')
+# Spaces grouping thousands ("1 234,50") are part of the number
+_THOUSANDS_SPACE = re.compile(r'(?<=\d)\s(?=\d{3}(?!\d))')
+
+
+def is_missing(value):
+    return value is None or (isinstance(value, str) and value.strip().lower() in MISSING_VALUES)
+
+
+def parse_amount(value):
+    """Float from a number or a printed amount such as 'USD 1,234.50', '1.234,50' or '(12.00)', or None
+
+    Text holding more than one number, such as "10, 20", is not an amount.
+    """
+    if isinstance(value, bool):
+        return None
+    if isinstance(value, (int, float)):
+        return float(value)
+    if not isinstance(value, str) or is_missing(value):
+        return None
+    text = re.sub(r'[^\d.,()\-\s]', '', value)
+    text = _THOUSANDS_SPACE.sub('', text).strip()
+    negative = text.startswith("(") and text.endswith(")")
+    text = re.sub(r'^-\s+', '-', text.strip("()").strip())
+    if re.search(r'\s', text):
+        return None
+    if _DECIMAL_COMMA.match(text):
+        text = text.replace(".", "").replace(",", ".")
+    else:
+        text = text.replace(",", "")
+    try:
+        amount = float(text)
+    except ValueError:
+        return None
+    return -amount if negative else amount
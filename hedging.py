@@ -0,0 +1,135 @@
+#!/usr/bin/env python3
+"""
+Request deadlines and hedging - bounds the tail latency of LLM calls
+
+Every call gets a hard deadline. With hedging on, a call still running after
+the observed p95 latency gets a duplicate; whichever answers first wins and
+the other is abandoned (a duplicate that has not been sent yet is dropped).
+"""
+
+import math
+import threading
+import time
+from collections import deque
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+
+DEFAULT_DEADLINE_SECONDS = 90.0
+HEDGE_PERCENTILE = 95
+# Observed latencies needed before the hedge delay is trusted
+MIN_HEDGE_SAMPLES = 10
+LATENCY_WINDOW = 200
+
+
+class DeadlineExceeded(TimeoutError):
+    """Raised when no attempt of a call finished within its deadline"""
+
+
+def percentile(values, pct):
+    """Nearest-rank percentile of a list of numbers, or None when empty"""
+    if not values:
+        return None
+    ordered = sorted(values)
+    rank = min(len(ordered), max(1, math.ceil(pct / 100 * len(ordered))))
+    return ordered[rank - 1]
+
+
+class Hedger:
+    """Runs calls under a deadline, hedging the slow ones, and records latencies"""
+
+    def __init__(self, deadline=DEFAULT_DEADLINE_SECONDS, hedge=False, hedge_percentile=HEDGE_PERCENTILE,
+                 max_workers=16):
+        self.deadline = deadline
+        self.hedge = hedge
+        self.hedge_percentile = hedge_percentile
+        # Per-attempt latencies set the hedge delay; per-call latencies are what callers saw
+        self.attempt_latencies = deque(maxlen=LATENCY_WINDOW)
+        self.call_latencies = []
+        self.calls = 0
+        self.hedges = 0
+        self.hedge_wins = 0
+        self.deadline_misses = 0
+        self._lock = threading.Lock()
+        self._pool = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="llm-hedge")
+
+    def hedge_delay(self):
+        """Seconds to wait before sending a duplicate, or None while there is too little history"""
+        with self._lock:
+            if len(self.attempt_latencies) < MIN_HEDGE_SAMPLES:
+                return None
+            return percentile(list(self.attempt_latencies), self.hedge_percentile)
+
+    def _attempt(self, fn, timeout, cancelled):
+        start = time.monotonic()
+        result = fn(timeout, cancelled)
+        with self._lock:
+            self.attempt_latencies.append(time.monotonic() - start)
+        return result
+
+    def call(self, fn):
+        """Run fn(timeout, cancelled) under the deadline, hedging it once if it is slow
+
+        `fn` receives the seconds left before the deadline and a threading.Event
+        that is set once another attempt has won; it should return without
+        sending its request if the event is already set.
+        """
+        start = time.monotonic()
+        cancelled = threading.Event()
+        attempts = {self._pool.submit(self._attempt, fn, self.deadline, cancelled): "primary"}
+        with self._lock:
+            self.calls += 1
+
+        try:
+            delay = self.hedge_delay() if self.hedge else None
+            if delay is not None and delay < self.deadline:
+                done, _ = wait(attempts, timeout=delay)
+                if not done:
+                    remaining = self.deadline - (time.monotonic() - start)
+                    attempts[self._pool.submit(self._attempt, fn, remaining, cancelled)] = "hedge"
+                    with self._lock:
+                        self.hedges += 1
+
+            error = None
+            while attempts:
+                remaining = self.deadline - (time.monotonic() - start)
+                if remaining <= 0:
+                    break
+                done, _ = wait(attempts, timeout=remaining, return_when=FIRST_COMPLETED)
+                for future in done:
+                    kind = attempts.pop(future)
+                    try:
+                        result = future.result()
+                    except Exception as e:
+                        # Let the other attempt finish before giving up
+                        error = e
+                        continue
+                    with self._lock:
+                        self.call_latencies.append(time.monotonic() - start)
+                        if kind == "hedge":
+                            self.hedge_wins += 1
+                    return result
+            if error is not None and not attempts:
+                raise error
+        finally:
+            cancelled.set()
+
+        with self._lock:
+            self.deadline_misses += 1
+            self.call_latencies.append(time.monotonic() - start)
+        raise DeadlineExceeded(f"no response within {self.deadline:g}s")
+
+    def stats(self):
+        with self._lock:
+            latencies = list(self.call_latencies)
+            return {
+                "calls": self.calls,
+                "hedges": self.hedges,
+                "hedge_wins": self.hedge_wins,
+                "deadline_misses": self.deadline_misses,
+                "p50": percentile(latencies, 50),
+                "p95": percentile(latencies, 95),
+                "p99": percentile(latencies, 99),
+            }
+
+    def close(self):
+        # Abandoned attempts are left to time out on their own
+        self._pool.shutdown(wait=False, cancel_futures=True)
@@ -0,0 +1,74 @@
+#!/usr/bin/env python3
+"""
+Invoice field definitions and a rule-based pre-extractor for the obvious header fields
+"""
+
+import re
+
+# Fields extracted for every invoice, in Excel column order
+INVOICE_FIELDS = [
+    "PO Number", "Item Code", "Description", "UOM", "Quantity", "Lot Number",
+    "Expiry Date", "Mfg Date", "Invoice No", "Unit Price", "Total Price",
+    "Country", "HS Code", "Date of Invoice", "Customer No", "Payer Name",
+    "Currency", "Supplier Name", "Total Amount of the Invoice", "Total VAT or Tax"
+]
+
+# Row keys added by the apps next to the invoice fields
+SOURCE_FIELDS = ["Source File", "Source Pages", "Processing Time", "Duplicate Of", "Possible Double Booking"]
+
+# Header/total fields the pre-extractor looks for
+REQUIRED_FIELDS = [
+    "Invoice No", "Date of Invoice", "PO Number", "Currency", "Total Amount of the Invoice"
+]
+# Fields every invoice has; many have no PO, and some only imply the currency.
+# Validation requires these, and lazy page loading stops once they are found
+COVERAGE_FIELDS = [field for field in REQUIRED_FIELDS if field not in ("PO Number", "Currency")]
+
+DATE_FIELDS = ["Expiry Date", "Mfg Date", "Date of Invoice"]
+# Printed date formats, tried in order (day-first before month-first)
+DATE_FORMATS = [
+    "%Y-%m-%d", "%Y/%m/%d", "%d/%m/%Y", "%m/%d/%Y", "%d.%m.%Y", "%d-%m-%Y", "%d/%m/%y",
+    "%d %b %Y", "%d-%b-%Y", "%d-%b-%y", "%d %B %Y", "%b %d, %Y", "%B %d, %Y",
+]
+
+_CODE = r'((?=[A-Z0-9\-/]*\d)[A-Z0-9][A-Z0-9\-/]{2,})'
+_AMOUNT = r'(\d{1,3}(?:[,\s]\d{3})*(?:\.\d{2})|\d+\.\d{2})'
+_DATE = r'(\d{1,4}[./-]\d{1,2}[./-]\d{1,4}|\d{1,2}[ \t-][A-Za-z]{3,9}[ \t,\-]*\d{2,4})'
+# A bare "Date" label that is not part of another date's label ("Expiry Date", "Mfg. date")
+_OTHER_DATE_LABELS = ("expiry", "expiration", "exp", "exp.", "mfg", "mfg.", "manufacturing", "production",
+                      "due", "delivery", "order", "ship", "shipping")
+_BARE_DATE = "".join(
+    rf'(?<!{re.escape(label)}[ \t])(?<!{re.escape(label)})' for label in _OTHER_DATE_LABELS
+) + r'date'
+
+# Label-anchored patterns; the first capture group is the value
+FIELD_PATTERNS = {
+    "Invoice No": re.compile(r'\binv(?:oice)?\.?[ \t]*(?:no|number|num|#)\.?[ \t]*[:#]?[ \t]*' + _CODE, re.IGNORECASE),
+    "Date of Invoice": re.compile(r'\b(?:invoice[ \t]*date|date[ \t]*of[ \t]*invoice|inv\.?[ \t]*date|' + _BARE_DATE + r')[ \t]*[:.]?[ \t]*' + _DATE, re.IGNORECASE),
+    "PO Number": re.compile(r'\b(?:p\.?[ \t]*o\.?|purchase[ \t]*order|order)[ \t]*(?:no|number|#)?\.?[ \t]*[:#]?[ \t]*' + _CODE, re.IGNORECASE),
+    "Customer No": re.compile(r'\b(?:customer|client|account)[ \t]*(?:no|number|id|#)\.?[ \t]*[:#]?[ \t]*' + _CODE, re.IGNORECASE),
+    "Currency": re.compile(r'\b(USD|EUR|GBP|AED|SAR|QAR|KWD|OMR|BHD|INR|CNY|JPY|CHF)\b'),
+    "Total Amount of the Invoice": re.compile(r'\b(?:grand[ \t]*total|total[ \t]*amount|invoice[ \t]*total|net[ \t]*total|amount[ \t]*due)[^\d\n]{0,25}' + _AMOUNT, re.IGNORECASE),
+    "Total VAT or Tax": re.compile(r'\b(?:vat|tax)(?:[ \t]*amount|[ \t]*total)?[^\d\n]{0,25}' + _AMOUNT, re.IGNORECASE),
+}
+
+
+def column_name(field):
+    """SQL column or attribute name for a row key, e.g. 'Total Amount of the Invoice' -> total_amount_of_the_invoice"""
+    return re.sub(r'[^a-z0-9]+', '_', field.lower()).strip("_")
+
+
+def pre_extract_fields(text):
+    """Cheap regex pass over the text for fields with well-known labels"""
+    found = {}
+    for field, pattern in FIELD_PATTERNS.items():
+        match = pattern.search(text)
+        if match:
+            found[field] = match.group(1).strip()
+    return found
+
+
+def missing_fields(text, required_fields=COVERAGE_FIELDS):
+    """Required fields the pre-extractor could not find in the text"""
+    found = pre_extract_fields(text)
+    return [field for field in required_fields if field not in found]
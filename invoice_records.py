@@ -0,0 +1,172 @@
+#!/usr/bin/env python3
+"""
+Typed invoice records - extracted rows as numeric, datetime and categorical columns
+
+The model returns every field as free text: amounts as "$1,234.50" or
+"1.234,50 EUR", dates in whatever format the invoice printed, and "N/A"
+for anything it could not find. The normalizers here work on whole pandas
+columns at once: amounts become float64, dates datetime64 (unparseable
+text becomes NaT rather than a guess), currencies ISO codes, and
+repetitive text such as units, countries and supplier names a category.
+Line items repeat their invoice's date, currency and supplier, so each
+distinct value in a column is parsed once and the result broadcast. The
+frame is a fraction of the size of the object-dtype one and can be
+summed, grouped and filtered without parsing strings again.
+
+InvoiceRecord is the row-at-a-time view of the same values, with one slot
+per field instead of a dict.
+"""
+
+import functools
+import re
+
+import numpy as np
+import pandas as pd
+
+from field_values import MISSING_VALUES, parse_amount
+from invoice_fields import DATE_FIELDS, DATE_FORMATS, INVOICE_FIELDS, SOURCE_FIELDS, column_name
+from model_router import NUMERIC_FIELDS
+
+RECORD_FIELDS = INVOICE_FIELDS + SOURCE_FIELDS
+
+# Month-only dates (usually expiry dates); read as the first of the month
+PERIOD_FORMATS = ["%m/%Y", "%m-%Y", "%Y-%m", "%b %Y", "%b-%Y", "%B %Y"]
+
+# Repetitive text kept as pandas categories
+CATEGORY_FIELDS = ["UOM", "Country", "Currency", "Supplier Name", "Payer Name", "Source File"]
+
+# Active ISO 4217 codes; other three-letter words ("DHS", "UAE") are not read as a currency
+ISO_CURRENCIES = set("""
+    AED AFN ALL AMD ANG AOA ARS AUD AWG AZN BAM BBD BDT BGN BHD BIF BMD BND BOB BRL BSD BTN BWP BYN
+    BZD CAD CDF CHF CLP CNY COP CRC CUP CVE CZK DJF DKK DOP DZD EGP ERN ETB EUR FJD FKP GBP GEL GHS
+    GIP GMD GNF GTQ GYD HKD HNL HTG HUF IDR ILS INR IQD IRR ISK JMD JOD JPY KES KGS KHR KMF KPW KRW
+    KWD KYD KZT LAK LBP LKR LRD LSL LYD MAD MDL MGA MKD MMK MNT MOP MRU MUR MVR MWK MXN MYR MZN NAD
+    NGN NIO NOK NPR NZD OMR PAB PEN PGK PHP PKR PLN PYG QAR RON RSD RUB RWF SAR SBD SCR SDG SEK SGD
+    SHP SLE SOS SRD SSP STN SVC SYP SZL THB TJS TMT TND TOP TRY TTD TWD TZS UAH UGX USD UYU UZS VES
+    VND VUV WST XAF XCD XOF XPF YER ZAR ZMW ZWL
+""".split())
+
+# Symbols and names the model writes instead of an ISO code, checked in order
+CURRENCY_ALIASES = [
+    ("US$", "USD"), ("$", "USD"), ("€", "EUR"), ("£", "GBP"), ("¥", "JPY"), ("₹", "INR"),
+    ("DOLLAR", "USD"), ("EURO", "EUR"), ("POUND", "GBP"), ("DIRHAM", "AED"), ("DHS", "AED"), ("RUPEE", "INR"),
+]
+
+
+def _per_value(normalize):
+    """Run a column normalizer on the column's distinct values only and broadcast the result"""
+    @functools.wraps(normalize)
+    def wrapper(series):
+        codes, uniques = pd.factorize(series)
+        # Missing cells (code -1) all map to one trailing None
+        values = normalize(pd.Series(list(uniques) + [None], dtype=object))
+        result = values.take(np.where(codes < 0, len(uniques), codes))
+        result.index = series.index
+        return result
+    return wrapper
+
+
+def _text(series):
+    """Stripped string column with the model's missing-value markers as NA"""
+    text = series.astype("string").str.strip()
+    return text.mask(text.str.lower().isin(MISSING_VALUES))
+
+
+@_per_value
+def normalize_amounts(series):
+    """float64 amounts from printed text such as 'USD 1,234.50', '1.234,50' or '(12.00)' (see parse_amount)"""
+    return series.map(parse_amount).astype("float64")
+
+
+@_per_value
+def normalize_dates(series):
+    """datetime64 dates from any of DATE_FORMATS or PERIOD_FORMATS; NaT when none fits"""
+    text = _text(series)
+    text = (
+        text.str.replace(r'\s+', ' ', regex=True)
+        .str.replace(r'(?<=\d)(?:st|nd|rd|th)\b', '', regex=True)
+        .str.replace(r'\bSept\b', 'Sep', regex=True)
+        # Drop a time of day after the date
+        .str.replace(r'[T ]\d{1,2}:\d{2}(?::\d{2}(?:\.\d+)?)?(?:Z|[+-]\d{2}:?\d{2})?$', '', regex=True)
+    )
+    dates = pd.Series(pd.NaT, index=series.index, dtype="datetime64[ns]")
+    for date_format in DATE_FORMATS + PERIOD_FORMATS:
+        pending = dates.isna() & text.notna()
+        if not pending.any():
+            break
+        parsed = pd.to_datetime(text[pending], format=date_format, errors="coerce")
+        dates[pending] = parsed.astype("datetime64[ns]")
+    return dates
+
+
+def _currency_code(text):
+    # A printed ISO code wins ("AUD $" is not USD); otherwise the first alias found
+    for word in re.findall(r'\b[A-Z]{3}\b', text):
+        if word in ISO_CURRENCIES:
+            return word
+    for alias, code in CURRENCY_ALIASES:
+        if alias in text:
+            return code
+    return None
+
+
+@_per_value
+def normalize_currency(series):
+    """Categorical ISO 4217 codes from codes, symbols or currency names"""
+    codes = _text(series).str.upper().astype(object).map(_currency_code, na_action="ignore")
+    return codes.astype("category")
+
+
+def normalize_frame(frame):
+    """A copy of a frame of extracted rows with each known column converted to its dtype"""
+    frame = frame.copy()
+    for field in frame.columns:
+        if field in NUMERIC_FIELDS:
+            frame[field] = normalize_amounts(frame[field])
+        elif field in DATE_FIELDS:
+            frame[field] = normalize_dates(frame[field])
+        elif field == "Currency":
+            frame[field] = normalize_currency(frame[field])
+        elif field in CATEGORY_FIELDS:
+            frame[field] = _per_value(_text)(frame[field]).astype("category")
+        elif field in RECORD_FIELDS:
+            frame[field] = _per_value(_text)(frame[field])
+    return frame
+
+
+def records_frame(rows):
+    """Typed DataFrame of extracted row dicts"""
+    return normalize_frame(pd.DataFrame(rows))
+
+
+class InvoiceRecord:
+    """One extracted row with typed values: floats, Timestamps, ISO currency codes; None when missing"""
+
+    __slots__ = tuple(column_name(field) for field in RECORD_FIELDS)
+
+    def __init__(self, **values):
+        for name in self.__slots__:
+            setattr(self, name, values.get(name))
+
+    @classmethod
+    def from_frame(cls, frame):
+        """Records for every row of a typed frame (see records_frame)"""
+        known = [field for field in frame.columns if field in RECORD_FIELDS]
+        values = frame[known].astype(object)
+        values = values.where(values.notna(), None).rename(columns=column_name)
+        return [cls(**row) for row in values.to_dict("records")]
+
+    @classmethod
+    def from_rows(cls, rows):
+        return cls.from_frame(records_frame(rows))
+
+    def to_dict(self):
+        """Field name -> value for the fields that were found"""
+        return {
+            field: getattr(self, name)
+            for field, name in zip(RECORD_FIELDS, self.__slots__)
+            if getattr(self, name) is not None
+        }
+
+    def __repr__(self):
+        return f"InvoiceRecord({self.to_dict()!r})"
@@ -0,0 +1,107 @@
+#!/usr/bin/env python3
+"""
+Invoice segmentation - splits a multi-invoice PDF into per-invoice page ranges
+
+A day's deliveries are often scanned into one PDF. Boundaries are detected
+from per-page signals: a new invoice number, a "Page 1 of N" counter, or a
+change of letterhead between consecutive pages.
+"""
+
+import re
+
+from invoice_fields import FIELD_PATTERNS
+from text_cleanup import PAGE_BREAK, split_pages
+
+# The pre-extractor's invoice number pattern, so both read the same numbers
+INVOICE_NO_RE = FIELD_PATTERNS["Invoice No"]
+PAGE_OF_RE = re.compile(r'page\s*(\d+)\s*(?:of|/)\s*(\d+)', re.IGNORECASE)
+INVOICE_TITLE_RE = re.compile(r'\binvoice\b', re.IGNORECASE)
+
+# Lines at the top of a page that make up the letterhead fingerprint
+HEADER_LINES = 3
+
+
+def _header_fingerprint(lines):
+    """Digit-insensitive fingerprint of the first lines of a page (dates and numbers vary)"""
+    header = [re.sub(r'\d+', '#', re.sub(r'\s+', ' ', l.lower())).strip() for l in lines[:HEADER_LINES]]
+    return "|".join(header)
+
+
+def page_signals(page_text):
+    """Boundary signals for one page: invoice number, (page, total) counter and letterhead"""
+    lines = [l for l in page_text.splitlines() if l.strip()]
+
+    invoice_match = INVOICE_NO_RE.search(page_text)
+    page_match = PAGE_OF_RE.search(page_text)
+
+    return {
+        "invoice_no": invoice_match.group(1).upper() if invoice_match else None,
+        "page_of": (int(page_match.group(1)), int(page_match.group(2))) if page_match else None,
+        "header": _header_fingerprint(lines) if lines else None,
+        # Continuation pages rarely repeat the "Invoice" title near the top
+        "invoice_title": bool(INVOICE_TITLE_RE.search(" ".join(lines[:HEADER_LINES * 2]))),
+    }
+
+
+def _starts_new_invoice(signals, segment):
+    """Decide whether a page opens a new invoice, given the segment built so far"""
+    page_of = signals["page_of"]
+    if page_of:
+        # An explicit counter wins: "Page 1 of N" starts, "Page 3 of N" continues
+        return page_of[0] == 1
+
+    invoice_no = signals["invoice_no"]
+    if invoice_no and segment["invoice_no"]:
+        return invoice_no != segment["invoice_no"]
+
+    # Different letterhead on a page that presents itself as an invoice
+    return bool(
+        signals["invoice_title"] and signals["header"] and segment["header"]
+        and signals["header"] != segment["header"]
+    )
+
+
+def segment_invoices(text):
+    """Split extracted document text into per-invoice segments
+
+    Returns a list of dicts with the 0-based `pages` range (first, last), the
+    detected `invoice_no` (or None) and the segment `text`, pages still joined
+    with PAGE_BREAK. Blank pages are attached to the segment they follow.
+    """
+    pages = split_pages(text)
+    # Extractors end each page with a break, so drop the empty tail
+    while pages and not pages[-1].strip():
+        pages.pop()
+
+    segments = []
+    for page_num, page_text in enumerate(pages):
+        if not page_text.strip():
+            if segments:
+                segments[-1]["page_texts"].append(page_text)
+                segments[-1]["pages"][1] = page_num
+            continue
+
+        signals = page_signals(page_text)
+        current = segments[-1] if segments else None
+        if current is None or _starts_new_invoice(signals, current):
+            current = {
+                "pages": [page_num, page_num],
+                "invoice_no": signals["invoice_no"],
+                "header": signals["header"],
+                "page_texts": [],
+            }
+            segments.append(current)
+
+        current["page_texts"].append(page_text)
+        current["pages"][1] = page_num
+        if current["invoice_no"] is None:
+            current["invoice_no"] = signals["invoice_no"]
+
+    return [
+        {
+            "pages": tuple(segment["pages"]),
+            "invoice_no": segment["invoice_no"],
+            "text": PAGE_BREAK.join(segment["page_texts"]) + PAGE_BREAK,
+        }
+        for segment in segments
+    ]
@@ -0,0 +1,44 @@
+#!/usr/bin/env python3
+"""
+Lazy page loading - extract only as many pages as it takes to find the required fields
+
+Header fields are usually on the first page and totals on the last, so pages
+are read from both ends inwards and reading stops once the rule-based
+pre-extractor has found every field all invoices have (COVERAGE_FIELDS, the
+same fields validation requires): an invoice without a PO number or a
+printed currency would otherwise be read to the last page.
+"""
+
+from invoice_fields import COVERAGE_FIELDS, missing_fields
+
+
+def lazy_page_order(page_count):
+    """Page numbers from both ends inwards: first, last, second, second to last, ..."""
+    low, high = 0, page_count - 1
+    while low <= high:
+        yield low
+        if high != low:
+            yield high
+        low += 1
+        high -= 1
+
+
+def lazy_extract_pages(page_count, extract_page, required_fields=COVERAGE_FIELDS):
+    """Call extract_page(page_num) lazily until required_fields are all present
+
+    Returns the extracted page texts in page order and the list of skipped
+    page numbers.
+    """
+    texts = {}
+    for page_num in lazy_page_order(page_count):
+        texts[page_num] = extract_page(page_num) or ""
+
+        # Always read both the first and the last page before deciding
+        if len(texts) < min(2, page_count):
+            continue
+        combined = "\n".join(texts[p] for p in sorted(texts))
+        if not missing_fields(combined, required_fields):
+            break
+
+    skipped_pages = [p for p in range(page_count) if p not in texts]
+    return [texts[p] for p in sorted(texts)], skipped_pages
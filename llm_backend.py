@@ -0,0 +1,53 @@
+#!/usr/bin/env python3
+"""
+LLM backend - one configured OpenAI-compatible client for the apps
+
+Base URL, timeouts and retries come from the environment (or the sidebar),
+so the same pipeline runs against api.openai.com, an Azure/vLLM/other
+OpenAI-compatible gateway, or the bundled mock_openai_server.py for offline
+throughput tests. A backend on a custom base URL may not need a real key.
+With LLM_CASSETTE_MODE set, chat completions are recorded to or replayed
+from disk (see llm_cassette.py); replaying needs neither key nor network.
+"""
+
+import os
+
+import openai
+
+from llm_cassette import CASSETTE_MODE, MODE_REPLAY, wrap_client
+
+LLM_BASE_URL = os.getenv("OPENAI_BASE_URL", "")
+LLM_TIMEOUT_SECONDS = float(os.getenv("OPENAI_TIMEOUT", "60"))
+LLM_CONNECT_TIMEOUT_SECONDS = float(os.getenv("OPENAI_CONNECT_TIMEOUT", "10"))
+LLM_MAX_RETRIES = int(os.getenv("OPENAI_MAX_RETRIES", "2"))
+
+# Sent when a custom backend needs no key; the client refuses an empty one
+PLACEHOLDER_API_KEY = "not-needed"
+
+
+def has_api_key(api_key):
+    return bool(api_key) and api_key != "your_openai_api_key_here"
+
+
+def needs_api_key(base_url=None, cassette_mode=CASSETTE_MODE):
+    """Only api.openai.com, and only when not replaying a cassette, requires a real key"""
+    base_url = base_url if base_url is not None else LLM_BASE_URL
+    return not base_url.strip() and cassette_mode != MODE_REPLAY
+
+
+def create_client(api_key=None, base_url=None, timeout=LLM_TIMEOUT_SECONDS,
+                  connect_timeout=LLM_CONNECT_TIMEOUT_SECONDS, max_retries=LLM_MAX_RETRIES,
+                  cassette_mode=CASSETTE_MODE):
+    """An OpenAI client for the given backend; raises ValueError without a key for api.openai.com"""
+    base_url = (base_url if base_url is not None else LLM_BASE_URL).strip() or None
+    if not has_api_key(api_key):
+        if needs_api_key(base_url or "", cassette_mode):
+            raise ValueError("OPENAI_API_KEY is not set")
+        api_key = PLACEHOLDER_API_KEY
+    client = openai.OpenAI(
+        api_key=api_key,
+        base_url=base_url,
+        timeout=openai.Timeout(timeout, connect=connect_timeout),
+        max_retries=max_retries,
+    )
+    return wrap_client(client, cassette_mode)
@@ -0,0 +1,173 @@
+#!/usr/bin/env python3
+"""
+Record/replay cassettes for chat completion calls
+
+In record mode every chat completion is passed to the real backend and the
+response, its headers and its latency are written to the cassette directory
+under a hash of the request. In replay mode the same request is answered
+from disk, after sleeping the recorded latency times LLM_REPLAY_LATENCY_SCALE
+(0 for instant), and a request that was never recorded raises CassetteMiss
+instead of reaching the network. Benchmarks and regression scripts then run
+the full pipeline offline and reproducibly.
+
+    LLM_CASSETTE_MODE=record python demo.py    # once, with a key
+    LLM_CASSETTE_MODE=replay python demo.py    # from then on, offline
+"""
+
+import hashlib
+import json
+import os
+import tempfile
+import threading
+import time
+from datetime import datetime
+
+from openai.types.chat import ChatCompletion
+
+CASSETTE_MODE = os.getenv("LLM_CASSETTE_MODE", "").strip().lower()
+CASSETTE_DIR = os.getenv("LLM_CASSETTE_DIR", "cassettes")
+REPLAY_LATENCY_SCALE = float(os.getenv("LLM_REPLAY_LATENCY_SCALE", "1.0"))
+
+MODE_RECORD = "record"
+MODE_REPLAY = "replay"
+
+# Per-call transport options that do not change the answer
+_UNHASHED_OPTIONS = {"timeout", "extra_headers", "extra_query"}
+
+
+class CassetteMiss(LookupError):
+    """A replayed request that was never recorded"""
+
+
+def request_key(request):
+    """Stable hash of a chat completion request, ignoring transport options"""
+    payload = {name: value for name, value in request.items() if name not in _UNHASHED_OPTIONS}
+    canonical = json.dumps(payload, sort_keys=True, ensure_ascii=False, default=str)
+    return hashlib.sha256(canonical.encode("utf-8")).hexdigest()
+
+
+class Cassette:
+    """On-disk store of recorded chat completions, one JSON file per request hash"""
+
+    def __init__(self, directory=CASSETTE_DIR, mode=MODE_REPLAY, latency_scale=REPLAY_LATENCY_SCALE):
+        if mode not in (MODE_RECORD, MODE_REPLAY):
+            raise ValueError(f"unknown cassette mode {mode!r}")
+        self.directory = directory
+        self.mode = mode
+        self.latency_scale = latency_scale
+        self.hits = 0
+        self.misses = 0
+        self.recorded = 0
+        self._lock = threading.Lock()
+
+    def _entry_path(self, key):
+        return os.path.join(self.directory, key[:2], key + ".json")
+
+    def load(self, request):
+        """The recorded entry for a request, or None"""
+        try:
+            with open(self._entry_path(request_key(request)), encoding="utf-8") as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return None
+
+    def save(self, request, response, headers, latency):
+        key = request_key(request)
+        path = self._entry_path(key)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        # A private temp file per writer: threads recording the same request must not share one
+        fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path), suffix=".tmp")
+        try:
+            with os.fdopen(fd, "w", encoding="utf-8") as f:
+                json.dump({
+                    "key": key,
+                    "recorded": datetime.now().isoformat(timespec="seconds"),
+                    "latency": latency,
+                    "request": {name: value for name, value in request.items() if name not in _UNHASHED_OPTIONS},
+                    "response": response.model_dump(exclude_unset=True),
+                    "headers": dict(headers or {}),
+                }, f, indent=2, ensure_ascii=False, default=str)
+            os.replace(tmp_path, path)
+        except Exception:
+            os.remove(tmp_path)
+            raise
+        with self._lock:
+            self.recorded += 1
+
+    def replay(self, request):
+        """(response, headers) for a recorded request, after its (scaled) latency"""
+        entry = self.load(request)
+        with self._lock:
+            if entry is None:
+                self.misses += 1
+            else:
+                self.hits += 1
+        if entry is None:
+            raise CassetteMiss(f"no recording for request {request_key(request)[:12]} in {self.directory}")
+        if self.latency_scale > 0:
+            time.sleep(entry.get("latency", 0) * self.latency_scale)
+        return ChatCompletion.model_validate(entry["response"]), entry.get("headers", {})
+
+    def summary(self):
+        with self._lock:
+            if self.mode == MODE_RECORD:
+                return f"Cassette: {self.recorded} call(s) recorded to {self.directory}"
+            return f"Cassette: {self.hits} call(s) replayed from {self.directory}, {self.misses} not recorded"
+
+
+class _ReplayedRawResponse:
+    """Stands in for the client's raw response: recorded headers plus parse()"""
+
+    def __init__(self, response, headers):
+        self.headers = headers
+        self._response = response
+
+    def parse(self):
+        return self._response
+
+
+class _CassetteCompletions:
+    def __init__(self, completions, cassette, raw=False):
+        self._completions = completions
+        self._cassette = cassette
+        self._raw = raw
+
+    @property
+    def with_raw_response(self):
+        return _CassetteCompletions(self._completions, self._cassette, raw=True)
+
+    def create(self, **request):
+        if self._cassette.mode == MODE_REPLAY:
+            response, headers = self._cassette.replay(request)
+            return _ReplayedRawResponse(response, headers) if self._raw else response
+
+        start = time.monotonic()
+        raw_response = self._completions.with_raw_response.create(**request)
+        latency = time.monotonic() - start
+        response = raw_response.parse()
+        self._cassette.save(request, response, raw_response.headers, latency)
+        return raw_response if self._raw else response
+
+
+class _CassetteChat:
+    def __init__(self, chat, cassette):
+        self.completions = _CassetteCompletions(chat.completions, cassette)
+
+
+class CassetteClient:
+    """Wraps an OpenAI client so chat completions are recorded or replayed; other endpoints pass through"""
+
+    def __init__(self, client, cassette):
+        self._client = client
+        self.cassette = cassette
+        self.chat = _CassetteChat(client.chat, cassette)
+
+    def __getattr__(self, name):
+        return getattr(self._client, name)
+
+
+def wrap_client(client, mode=CASSETTE_MODE, directory=CASSETTE_DIR, latency_scale=REPLAY_LATENCY_SCALE):
+    """The client itself when cassettes are off, otherwise a recording or replaying wrapper"""
+    if not mode:
+        return client
+    return CassetteClient(client, Cassette(directory, mode, latency_scale))
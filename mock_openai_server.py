@@ -0,0 +1,340 @@
+#!/usr/bin/env python3
+"""
+Local stand-in for the OpenAI chat completions, files and batches endpoints
+
+Runs the pipeline end to end without an API key or quota, for offline
+benchmarks and load tests:
+
+    python mock_openai_server.py --port 8765 --latency 0.8 --jitter 0.4 --error-rate 0.02 --rpm 300
+    OPENAI_BASE_URL=http://127.0.0.1:8765/v1 streamlit run app_advanced.py
+
+Chat completions replay the responses recorded in `--responses` (JSONL of
+chat.completion objects or {"content": ...} lines) round-robin, or answer
+with the fields the regex pre-extractor finds in the prompt, "N/A" elsewhere.
+Latency, server errors and 429s (random or from an `--rpm` quota, with
+x-ratelimit headers) can be injected. Batches complete `--delay` seconds
+after creation. GET /mock/stats returns request counts and throughput.
+"""
+
+import argparse
+import email.parser
+import email.policy
+import json
+import random
+import threading
+import time
+import uuid
+from collections import deque
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from invoice_fields import INVOICE_FIELDS, pre_extract_fields
+
+_files = {}
+_batches = {}
+_lock = threading.RLock()
+_recorded = []
+_request_times = deque()
+_stats = {"started": time.time(), "requests": 0, "completed": 0, "errors": 0, "throttled": 0}
+
+
+def _new_id(prefix):
+    return f"{prefix}{uuid.uuid4().hex[:24]}"
+
+
+def _file_object(file_id):
+    stored = _files[file_id]
+    return {
+        "id": file_id,
+        "object": "file",
+        "bytes": len(stored["content"]),
+        "created_at": stored["created_at"],
+        "filename": stored["filename"],
+        "purpose": stored["purpose"],
+        "status": "processed",
+    }
+
+
+def _store_file(content, filename, purpose):
+    file_id = _new_id("file-")
+    with _lock:
+        _files[file_id] = {"content": content, "filename": filename, "purpose": purpose, "created_at": int(time.time())}
+    return file_id
+
+
+def load_recorded_responses(path):
+    """Chat completion bodies to replay, from a JSONL file of responses or {"content": ...} lines"""
+    responses = []
+    with open(path, encoding="utf-8") as f:
+        for line in f:
+            if line.strip():
+                responses.append(json.loads(line))
+    return responses
+
+
+def _replayed_completion(body):
+    with _lock:
+        recorded = _recorded[_stats["requests"] % len(_recorded)]
+    if "choices" in recorded:
+        completion = json.loads(json.dumps(recorded))
+        completion["id"] = _new_id("chatcmpl-")
+        completion["created"] = int(time.time())
+        return completion
+    completion = _generated_completion(body)
+    completion["choices"][0]["message"]["content"] = recorded.get("content", "")
+    return completion
+
+
+def mock_completion(body):
+    """A chat.completion object answering one extraction request"""
+    if _recorded:
+        return _replayed_completion(body)
+    return _generated_completion(body)
+
+
+def _generated_completion(body):
+    prompt = "\n".join(message.get("content", "") for message in body.get("messages", []))
+    # Fields come from the document only, not from the worked example in the instructions
+    document = "\n".join(
+        message.get("content", "") for message in body.get("messages", []) if message.get("role") != "system"
+    )
+    found = pre_extract_fields(document)
+    content = json.dumps({field: found.get(field, "N/A") for field in INVOICE_FIELDS})
+    prompt_tokens = len(prompt) // 4
+    completion_tokens = len(content) // 4
+    return {
+        "id": _new_id("chatcmpl-"),
+        "object": "chat.completion",
+        "created": int(time.time()),
+        "model": body.get("model", "mock"),
+        "choices": [{
+            "index": 0,
+            "message": {"role": "assistant", "content": content},
+            "finish_reason": "stop",
+        }],
+        "usage": {
+            "prompt_tokens": prompt_tokens,
+            "completion_tokens": completion_tokens,
+            "total_tokens": prompt_tokens + completion_tokens,
+            "prompt_tokens_details": {"cached_tokens": 0},
+        },
+    }
+
+
+def _run_batch(batch):
+    """Answer every request in the batch's input file and attach the output file"""
+    lines = _files[batch["input_file_id"]]["content"].decode("utf-8").splitlines()
+    output = []
+    for line in lines:
+        if not line.strip():
+            continue
+        request = json.loads(line)
+        output.append(json.dumps({
+            "id": _new_id("batch_req_"),
+            "custom_id": request["custom_id"],
+            "response": {"status_code": 200, "request_id": _new_id("req_"), "body": mock_completion(request["body"])},
+            "error": None,
+        }))
+    batch["output_file_id"] = _store_file(("\n".join(output) + "\n").encode("utf-8"), "batch_output.jsonl", "batch_output")
+    batch["request_counts"] = {"total": len(output), "completed": len(output), "failed": 0}
+    batch["status"] = "completed"
+    batch["completed_at"] = int(time.time())
+
+
+class MockOpenAIHandler(BaseHTTPRequestHandler):
+    delay = 5.0
+    latency = 0.0
+    jitter = 0.0
+    error_rate = 0.0
+    throttle_rate = 0.0
+    rpm = 0
+
+    def _send_json(self, payload, status=200, headers=None):
+        data = json.dumps(payload).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(data)))
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(data)
+
+    def _not_found(self):
+        self._send_json({"error": {"message": f"Unknown path {self.path}", "type": "invalid_request_error"}}, 404)
+
+    def _body(self):
+        return self.rfile.read(int(self.headers.get("Content-Length", 0)))
+
+    def _rate_limit_headers(self):
+        """Count the request against the --rpm quota; returns (headers, over_quota)"""
+        now = time.time()
+        with _lock:
+            _stats["requests"] += 1
+            while _request_times and now - _request_times[0] > 60:
+                _request_times.popleft()
+            _request_times.append(now)
+            used = len(_request_times)
+            window_start = _request_times[0]
+        if not self.rpm:
+            return {}, False
+        return {
+            "x-ratelimit-limit-requests": str(self.rpm),
+            "x-ratelimit-remaining-requests": str(max(0, self.rpm - used)),
+            "x-ratelimit-reset-requests": f"{max(0.0, 60 - (now - window_start)):.3f}s",
+        }, used > self.rpm
+
+    def _chat_completion(self, body):
+        headers, over_quota = self._rate_limit_headers()
+        if over_quota or random.random() < self.throttle_rate:
+            with _lock:
+                _stats["throttled"] += 1
+            headers["retry-after"] = "1"
+            return self._send_json(
+                {"error": {"message": "Rate limit reached (mock)", "type": "requests", "code": "rate_limit_exceeded"}},
+                429, headers
+            )
+
+        time.sleep(max(0.0, random.uniform(self.latency - self.jitter, self.latency + self.jitter)))
+        if random.random() < self.error_rate:
+            with _lock:
+                _stats["errors"] += 1
+            return self._send_json({"error": {"message": "Injected server error (mock)", "type": "server_error"}}, 500)
+
+        completion = mock_completion(body)
+        with _lock:
+            _stats["completed"] += 1
+        return self._send_json(completion, 200, headers)
+
+    def _batch(self, batch_id):
+        with _lock:
+            batch = _batches.get(batch_id)
+            if batch and batch["status"] in ("validating", "in_progress"):
+                if time.time() - batch["created_at"] >= self.delay:
+                    _run_batch(batch)
+                else:
+                    batch["status"] = "in_progress"
+            return batch
+
+    def do_POST(self):
+        path = self.path.split("?")[0].rstrip("/")
+        if path == "/v1/chat/completions":
+            return self._chat_completion(json.loads(self._body() or b"{}"))
+
+        if path == "/v1/files":
+            # Parse the multipart upload with the email parser (the cgi module is deprecated)
+            message = email.parser.BytesParser(policy=email.policy.HTTP).parsebytes(
+                f"Content-Type: {self.headers['Content-Type']}\r\n\r\n".encode("latin-1") + self._body()
+            )
+            fields = {part.get_param("name", header="content-disposition"): part for part in message.iter_parts()}
+            upload = fields.get("file")
+            if upload is None:
+                return self._send_json({"error": {"message": "file is required"}}, 400)
+            purpose = fields["purpose"].get_content().strip() if "purpose" in fields else "batch"
+            file_id = _store_file(upload.get_payload(decode=True), upload.get_filename() or "upload.jsonl", purpose)
+            return self._send_json(_file_object(file_id))
+
+        if path == "/v1/batches":
+            request = json.loads(self._body() or b"{}")
+            if request.get("input_file_id") not in _files:
+                return self._send_json({"error": {"message": "input_file_id not found"}}, 400)
+            batch_id = _new_id("batch_")
+            batch = {
+                "id": batch_id,
+                "object": "batch",
+                "endpoint": request.get("endpoint"),
+                "input_file_id": request["input_file_id"],
+                "completion_window": request.get("completion_window", "24h"),
+                "status": "validating",
+                "output_file_id": None,
+                "error_file_id": None,
+                "created_at": int(time.time()),
+                "completed_at": None,
+                "request_counts": {"total": 0, "completed": 0, "failed": 0},
+                "metadata": request.get("metadata"),
+            }
+            with _lock:
+                _batches[batch_id] = batch
+            return self._send_json(batch)
+
+        parts = path.split("/")
+        if len(parts) == 5 and parts[:3] == ["", "v1", "batches"] and parts[4] == "cancel":
+            batch = self._batch(parts[3])
+            if batch is None:
+                return self._not_found()
+            with _lock:
+                if batch["status"] not in ("completed", "failed", "expired"):
+                    batch["status"] = "cancelled"
+            return self._send_json(batch)
+
+        self._not_found()
+
+    def do_GET(self):
+        parts = self.path.split("?")[0].rstrip("/").split("/")
+        if parts == ["", "mock", "stats"]:
+            with _lock:
+                stats = dict(_stats)
+            elapsed = time.time() - stats["started"]
+            stats["completed_per_second"] = stats["completed"] / elapsed if elapsed > 0 else 0.0
+            return self._send_json(stats)
+
+        if parts == ["", "v1", "batches"]:
+            # Newest first, in one page
+            with _lock:
+                batch_ids = sorted(_batches, key=lambda batch_id: _batches[batch_id]["created_at"], reverse=True)
+            batches = [self._batch(batch_id) for batch_id in batch_ids]
+            return self._send_json({"object": "list", "data": batches, "has_more": False})
+
+        if len(parts) == 4 and parts[:3] == ["", "v1", "batches"]:
+            batch = self._batch(parts[3])
+            return self._send_json(batch) if batch else self._not_found()
+
+        if len(parts) >= 4 and parts[:3] == ["", "v1", "files"] and parts[3] in _files:
+            if len(parts) == 5 and parts[4] == "content":
+                content = _files[parts[3]]["content"]
+                self.send_response(200)
+                self.send_header("Content-Type", "application/octet-stream")
+                self.send_header("Content-Length", str(len(content)))
+                self.end_headers()
+                self.wfile.write(content)
+                return
+            if len(parts) == 4:
+                return self._send_json(_file_object(parts[3]))
+
+        self._not_found()
+
+    def log_message(self, format, *args):
+        pass
+
+
+def serve(host="127.0.0.1", port=8765, delay=5.0, latency=0.0, jitter=0.0, error_rate=0.0,
+          throttle_rate=0.0, rpm=0, responses=None):
+    MockOpenAIHandler.delay = delay
+    MockOpenAIHandler.latency = latency
+    MockOpenAIHandler.jitter = jitter
+    MockOpenAIHandler.error_rate = error_rate
+    MockOpenAIHandler.throttle_rate = throttle_rate
+    MockOpenAIHandler.rpm = rpm
+    if responses:
+        _recorded.extend(load_recorded_responses(responses))
+    server = ThreadingHTTPServer((host, port), MockOpenAIHandler)
+    print(
+        f"Mock OpenAI server on http://{host}:{port}/v1 "
+        f"(latency {latency:g}±{jitter:g}s, {error_rate:.0%} errors, {throttle_rate:.0%} throttled, "
+        f"{len(_recorded) or 'generated'} response(s), batches complete after {delay:g}s)"
+    )
+    server.serve_forever()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Local stand-in for the OpenAI chat, files and batch endpoints")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--delay", type=float, default=5.0, help="seconds before a batch completes")
+    parser.add_argument("--latency", type=float, default=0.0, help="mean seconds per chat completion")
+    parser.add_argument("--jitter", type=float, default=0.0, help="uniform +/- seconds around --latency")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="share of completions answered with HTTP 500")
+    parser.add_argument("--throttle-rate", type=float, default=0.0, help="share of completions answered with HTTP 429")
+    parser.add_argument("--rpm", type=int, default=0, help="requests per minute before 429s (0 = unlimited)")
+    parser.add_argument("--responses", help="JSONL file of recorded responses to replay")
+    args = parser.parse_args()
+    serve(args.host, args.port, args.delay, args.latency, args.jitter, args.error_rate,
+          args.throttle_rate, args.rpm, args.responses)
@@ -0,0 +1,256 @@
+#!/usr/bin/env python3
+"""
+Model routing - cheap model first, strong model only for what fails validation
+
+Every invoice goes to the cheap model. Its JSON is checked for schema,
+arithmetic consistency (quantity x unit price = line total, lines within the
+invoice total), coverage of the required fields and agreement with the regex
+pre-extractor. Unparseable or mostly-wrong results are redone by the strong
+model; otherwise only the failing fields are asked for again.
+"""
+
+import json
+import os
+import re
+import threading
+
+from field_values import is_missing, parse_amount
+from invoice_fields import COVERAGE_FIELDS, INVOICE_FIELDS, pre_extract_fields
+
+CHEAP_MODEL = os.getenv("OPENAI_CHEAP_MODEL", "gpt-3.5-turbo")
+STRONG_MODEL = os.getenv("OPENAI_STRONG_MODEL", "gpt-4o")
+
+# USD per million (prompt, completion) tokens, for the savings report
+MODEL_PRICES = {
+    "gpt-3.5-turbo": (0.50, 1.50),
+    "gpt-4o-mini": (0.15, 0.60),
+    "gpt-4o": (2.50, 10.00),
+    "gpt-4-turbo": (10.00, 30.00),
+    "gpt-4.1-mini": (0.40, 1.60),
+    "gpt-4.1": (2.00, 8.00),
+}
+# Most completion tokens each model will return in one reply; unknown models get the smallest
+MODEL_COMPLETION_LIMITS = {
+    "gpt-3.5-turbo": 4096,
+    "gpt-4o-mini": 16384,
+    "gpt-4o": 16384,
+    "gpt-4-turbo": 4096,
+    "gpt-4.1-mini": 32768,
+    "gpt-4.1": 32768,
+}
+DEFAULT_COMPLETION_LIMIT = 4096
+
+NUMERIC_FIELDS = ["Quantity", "Unit Price", "Total Price", "Total Amount of the Invoice", "Total VAT or Tax"]
+# Fields the regex pre-extractor reads reliably enough to cross-check
+CROSS_CHECK_FIELDS = ["Invoice No", "PO Number", "Currency"]
+# Share of the prompt price charged for tokens served from the provider's prefix cache
+CACHED_PROMPT_PRICE = 0.5
+# Relative tolerance for the arithmetic checks (rounding on printed invoices)
+AMOUNT_TOLERANCE = 0.01
+# Above this share of failing fields the whole document is redone
+FULL_ESCALATION_SHARE = 0.5
+
+
+def completion_limit(model):
+    return MODEL_COMPLETION_LIMITS.get(model, DEFAULT_COMPLETION_LIMIT)
+
+
+def parse_extraction(content):
+    """Decode the model's JSON reply, tolerating a ```json fence; None if it is not an object"""
+    if not content:
+        return None
+    content = content.strip()
+    if content.startswith("```"):
+        content = re.sub(r'^```(?:json)?\s*|\s*```$', '', content)
+    try:
+        data = json.loads(content)
+    except json.JSONDecodeError:
+        return None
+    return data if isinstance(data, dict) else None
+
+
+def _normalize_code(value):
+    return re.sub(r'[^A-Z0-9]', '', str(value).upper())
+
+
+def validate_extraction(data, text=""):
+    """Check an extraction; returns {"valid", "failed_fields", "problems"}"""
+    if data is None:
+        return {"valid": False, "failed_fields": list(INVOICE_FIELDS), "problems": ["reply is not a JSON object"]}
+
+    failed = []
+    problems = []
+
+    def fail(fields, problem):
+        for field in fields:
+            if field not in failed:
+                failed.append(field)
+        problems.append(problem)
+
+    # Schema: every field present, numeric fields numeric when given
+    absent = [field for field in INVOICE_FIELDS if field not in data]
+    if absent:
+        fail(absent, f"missing keys: {', '.join(absent)}")
+    for field in NUMERIC_FIELDS:
+        if field in data and not is_missing(data[field]) and parse_amount(data[field]) is None:
+            fail([field], f"{field} is not a number")
+
+    # Coverage of the fields every invoice has
+    uncovered = [field for field in COVERAGE_FIELDS if field in data and is_missing(data[field])]
+    if uncovered:
+        fail(uncovered, f"required fields not found: {', '.join(uncovered)}")
+
+    # Arithmetic consistency
+    quantity = parse_amount(data.get("Quantity"))
+    unit_price = parse_amount(data.get("Unit Price"))
+    line_total = parse_amount(data.get("Total Price"))
+    invoice_total = parse_amount(data.get("Total Amount of the Invoice"))
+    vat = parse_amount(data.get("Total VAT or Tax"))
+    if None not in (quantity, unit_price, line_total):
+        if abs(quantity * unit_price - line_total) > max(0.01, AMOUNT_TOLERANCE * abs(line_total)):
+            fail(["Quantity", "Unit Price", "Total Price"], "quantity x unit price does not match the line total")
+    if line_total is not None and invoice_total is not None and line_total > invoice_total * (1 + AMOUNT_TOLERANCE):
+        fail(["Total Price", "Total Amount of the Invoice"], "line total exceeds the invoice total")
+    if vat is not None and invoice_total is not None and vat > invoice_total:
+        fail(["Total VAT or Tax"], "VAT exceeds the invoice total")
+
+    # Agreement with the label-anchored regex pass
+    if text:
+        found = pre_extract_fields(text)
+        for field in CROSS_CHECK_FIELDS:
+            if field in found and not is_missing(data.get(field)):
+                if _normalize_code(found[field]) != _normalize_code(data[field]):
+                    fail([field], f"{field} disagrees with the document text ({found[field]})")
+
+    return {"valid": not failed, "failed_fields": failed, "problems": problems}
+
+
+def call_cost(model, prompt_tokens, completion_tokens, cached_tokens=0):
+    """USD cost of a call, or None for a model without a known price"""
+    prices = MODEL_PRICES.get(model)
+    if prices is None:
+        return None
+    prompt_cost = (prompt_tokens - cached_tokens + cached_tokens * CACHED_PROMPT_PRICE) * prices[0]
+    return (prompt_cost + completion_tokens * prices[1]) / 1e6
+
+
+class ModelRouter:
+    """Routes extractions cheap-first and keeps escalation, cost and latency statistics"""
+
+    def __init__(self, cheap_model=CHEAP_MODEL, strong_model=STRONG_MODEL, escalate=True):
+        self.cheap_model = cheap_model
+        self.strong_model = strong_model
+        self.escalate = escalate and strong_model and strong_model != cheap_model
+        self.documents = 0
+        self.escalated_documents = 0
+        self.escalated_fields = 0
+        self.still_invalid = 0
+        self.calls = []
+        self._lock = threading.Lock()
+
+    def extract(self, extract_fn, text=""):
+        """Run one document through the router
+
+        `extract_fn(model, fields, usage_log)` performs one extraction call and
+        returns the model's JSON text; `fields` is None for a full extraction or
+        the list of fields to redo. Usage dicts ({model, prompt_tokens,
+        completion_tokens, cached_tokens, latency}) are appended to `usage_log`.
+        """
+        usage_log = []
+        content = extract_fn(self.cheap_model, None, usage_log)
+        data = parse_extraction(content)
+        check = validate_extraction(data, text)
+
+        escalated_fields = 0
+        if not check["valid"] and self.escalate:
+            failed = check["failed_fields"]
+            if data is None or len(failed) > FULL_ESCALATION_SHARE * len(INVOICE_FIELDS):
+                strong_content = extract_fn(self.strong_model, None, usage_log)
+                strong_data = parse_extraction(strong_content)
+                if strong_data is not None:
+                    content, data = strong_content, strong_data
+                escalated_fields = len(INVOICE_FIELDS)
+            else:
+                strong_data = parse_extraction(extract_fn(self.strong_model, failed, usage_log))
+                if strong_data is not None:
+                    for field in failed:
+                        if not is_missing(strong_data.get(field)):
+                            data[field] = strong_data[field]
+                    content = json.dumps(data)
+                escalated_fields = len(failed)
+            check = validate_extraction(data, text)
+
+        with self._lock:
+            self.documents += 1
+            if escalated_fields:
+                self.escalated_documents += 1
+                self.escalated_fields += escalated_fields
+            if not check["valid"]:
+                self.still_invalid += 1
+            self.calls.extend(usage_log)
+        return content
+
+    def stats(self):
+        """Escalation rate plus cost and latency compared with sending everything to the strong model"""
+        with self._lock:
+            calls = list(self.calls)
+            documents = self.documents
+            escalated = self.escalated_documents
+            stats = {
+                "documents": documents,
+                "escalated_documents": escalated,
+                "escalated_fields": self.escalated_fields,
+                "escalation_rate": escalated / documents if documents else 0.0,
+                "still_invalid": self.still_invalid,
+            }
+
+        cheap_calls = [c for c in calls if c["model"] == self.cheap_model]
+        strong_calls = [c for c in calls if c["model"] == self.strong_model]
+
+        actual = [call_cost(c["model"], c["prompt_tokens"], c["completion_tokens"], c.get("cached_tokens", 0)) for c in calls]
+        # Baseline: every cheap call's tokens billed at the strong model's price
+        baseline = [call_cost(self.strong_model, c["prompt_tokens"], c["completion_tokens"]) for c in cheap_calls]
+        if calls and None not in actual and None not in baseline:
+            stats["cost"] = sum(actual)
+            stats["cost_saved"] = sum(baseline) - sum(actual)
+        else:
+            stats["cost"] = stats["cost_saved"] = None
+
+        # Prefix-cache hits, and what they did to latency
+        prompt_tokens = sum(c["prompt_tokens"] for c in calls)
+        stats["cached_tokens"] = sum(c.get("cached_tokens", 0) for c in calls)
+        stats["cache_rate"] = stats["cached_tokens"] / prompt_tokens if prompt_tokens else 0.0
+        cached_calls = [c["latency"] for c in calls if c.get("cached_tokens")]
+        uncached_calls = [c["latency"] for c in calls if not c.get("cached_tokens")]
+        stats["cached_latency"] = sum(cached_calls) / len(cached_calls) if cached_calls else None
+        stats["uncached_latency"] = sum(uncached_calls) / len(uncached_calls) if uncached_calls else None
+
+        # Latency saved is only known once both models have been observed
+        if cheap_calls and strong_calls:
+            cheap_latency = sum(c["latency"] for c in cheap_calls) / len(cheap_calls)
+            strong_latency = sum(c["latency"] for c in strong_calls) / len(strong_calls)
+            stats["latency_saved"] = (documents - escalated) * (strong_latency - cheap_latency)
+        else:
+            stats["latency_saved"] = None
+        return stats
+
+    def summary(self):
+        """One-line report for the processing log"""
+        stats = self.stats()
+        line = (
+            f"Model routing: {stats['escalated_documents']}/{stats['documents']} invoice(s) escalated to "
+            f"{self.strong_model} ({stats['escalation_rate']:.0%}, {stats['escalated_fields']} field(s))"
+            if self.escalate else
+            f"Model routing: {stats['documents']} invoice(s) on {self.cheap_model}, escalation off"
+        )
+        if stats["cost"] is not None:
+            line += f"; ${stats['cost']:.4f} spent, ${stats['cost_saved']:.4f} saved vs {self.strong_model} only"
+        if stats["latency_saved"] is not None:
+            line += f"; ~{stats['latency_saved']:.1f}s saved"
+        if stats["cached_tokens"]:
+            line += f"; {stats['cache_rate']:.0%} of prompt tokens from cache"
+            if stats["cached_latency"] is not None and stats["uncached_latency"] is not None:
+                line += f" ({stats['cached_latency']:.1f}s vs {stats['uncached_latency']:.1f}s per call)"
+        if stats["still_invalid"]:
+            line += f"; {stats['still_invalid']} still failing validation"
+        return line
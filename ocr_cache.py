@@ -0,0 +1,137 @@
+#!/usr/bin/env python3
+"""
+Page-level OCR cache - skips Tesseract for page images we have already read
+
+Entries are keyed by a hash of the page image bytes plus the OCR settings and
+stored as small text files, so the cache is shared across documents, sessions
+and runs. The directory is kept under a fixed number of entries by evicting
+the least recently used files.
+"""
+
+import hashlib
+import os
+import tempfile
+
+import fitz  # PyMuPDF
+
+from text_cleanup import strip_page_break
+
+OCR_CACHE_DIR = os.getenv("OCR_CACHE_DIR", ".ocr_cache")
+OCR_CACHE_MAX_ENTRIES = int(os.getenv("OCR_CACHE_MAX_ENTRIES", "5000"))
+
+# Bump when OCR post-processing changes so stale text is not served
+OCR_CACHE_VERSION = "1"
+
+# A page is treated as a plain scan when one image covers this much of it
+FULL_PAGE_IMAGE_COVERAGE = 0.9
+
+_tesseract_version = None
+_puts_since_prune = 0
+
+
+def _tesseract_version_string():
+    global _tesseract_version
+    if _tesseract_version is None:
+        try:
+            import pytesseract
+            _tesseract_version = str(pytesseract.get_tesseract_version())
+        except Exception:
+            _tesseract_version = "unknown"
+    return _tesseract_version
+
+
+def _embedded_scan_bytes(page):
+    """Raw stream of the image that makes up a scanned page, or None for other pages"""
+    try:
+        images = page.get_image_info(xrefs=True)
+        if len(images) != 1 or not images[0]["xref"] or page.get_text("text").strip():
+            return None
+        page_area = page.rect.width * page.rect.height
+        rect = fitz.Rect(images[0]["bbox"])
+        if page_area <= 0 or (rect.width * rect.height) / page_area < FULL_PAGE_IMAGE_COVERAGE:
+            return None
+        # Same scan placed differently renders differently, so include the placement
+        return page.parent.xref_stream_raw(images[0]["xref"]) + repr(tuple(rect)).encode()
+    except Exception:
+        return None
+
+
+def page_cache_key(page, settings=""):
+    """Hash of the page image (embedded scan bytes or a cheap render) plus OCR settings"""
+    digest = hashlib.sha256()
+    digest.update(f"v{OCR_CACHE_VERSION}|{_tesseract_version_string()}|{settings}|".encode())
+
+    image_bytes = _embedded_scan_bytes(page)
+    if image_bytes is None:
+        pix = page.get_pixmap(matrix=fitz.Matrix(1.0, 1.0), colorspace=fitz.csGRAY)
+        image_bytes = pix.samples
+    digest.update(image_bytes)
+    return digest.hexdigest()
+
+
+def _entry_path(key):
+    return os.path.join(OCR_CACHE_DIR, key[:2], key + ".txt")
+
+
+def get_cached_text(key):
+    """Return cached OCR text for a key, or None"""
+    path = _entry_path(key)
+    try:
+        with open(path, "r", encoding="utf-8") as f:
+            text = f.read()
+        os.utime(path, None)  # mark as recently used
+        # Entries written before form feeds were stripped still end with one
+        return strip_page_break(text)
+    except OSError:
+        return None
+
+
+def store_text(key, text):
+    """Store OCR text for a key, evicting old entries when the cache is full"""
+    global _puts_since_prune
+    path = _entry_path(key)
+    try:
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        # A private temp file per writer: sessions storing the same page must not share one
+        fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path), suffix=".tmp")
+        try:
+            with os.fdopen(fd, "w", encoding="utf-8") as f:
+                f.write(strip_page_break(text))
+            os.replace(tmp_path, path)
+        except OSError:
+            os.remove(tmp_path)
+            raise
+    except OSError:
+        return
+
+    # Listing the cache is the expensive part, so only prune every so often
+    _puts_since_prune += 1
+    if _puts_since_prune >= max(1, OCR_CACHE_MAX_ENTRIES // 20):
+        _puts_since_prune = 0
+        prune_cache()
+
+
+def prune_cache(max_entries=None):
+    """Delete least recently used entries beyond max_entries"""
+    max_entries = OCR_CACHE_MAX_ENTRIES if max_entries is None else max_entries
+    entries = []
+    try:
+        for root, _, files in os.walk(OCR_CACHE_DIR):
+            for name in files:
+                if name.endswith(".txt"):
+                    path = os.path.join(root, name)
+                    try:
+                        entries.append((os.path.getmtime(path), path))
+                    except OSError:
+                        continue
+    except OSError:
+        return
+
+    if len(entries) <= max_entries:
+        return
+    entries.sort()
+    for _, path in entries[:len(entries) - max_entries]:
+        try:
+            os.remove(path)
+        except OSError:
+            pass
@@ -0,0 +1,297 @@
+#!/usr/bin/env python3
+"""
+OCR helpers - adaptive zoom selection and page rendering for Tesseract
+"""
+
+import io
+import re
+import statistics
+import time
+
+import fitz  # PyMuPDF
+import numpy as np
+from PIL import Image
+
+from text_cleanup import strip_page_break
+
+# Tesseract is most accurate when capital letters are roughly 30-33 px tall.
+# Word boxes from image_to_data are close to the font body height, so we aim
+# for that and treat anything under MIN_TEXT_HEIGHT_PX as too small to read.
+TARGET_TEXT_HEIGHT_PX = 32
+MIN_TEXT_HEIGHT_PX = 20
+
+MIN_ZOOM = 1.0
+MAX_ZOOM = 5.0
+DEFAULT_ZOOM = 3.0
+
+# Cheap probe render used only to measure text height (no OCR is run on it)
+PROBE_ZOOM = 1.0
+# The probe measures ink rows per vertical strip, so side-by-side columns don't merge
+PROBE_STRIPS = 4
+# Ink rows shorter (rules, specks) or taller (table borders, photos) than this are not text, in points
+PROBE_MIN_ROW_PT = 3.0
+PROBE_MAX_ROW_PT = 48.0
+# Word boxes are about this share of the font size (cap height plus the odd descender)
+WORD_HEIGHT_PER_FONT_SIZE = 0.75
+
+# Rendering far above the scan resolution adds no detail, only pixels
+MAX_NATIVE_UPSAMPLE = 2.0
+
+# Tiered OCR: fast first pass, then re-OCR of weak lines only
+FAST_ZOOM = 2.0
+HIGH_ZOOM = 4.0
+LOW_CONFIDENCE = 60
+
+
+def _clamp_zoom(zoom):
+    return max(MIN_ZOOM, min(MAX_ZOOM, zoom))
+
+
+def render_page_image(page, zoom, clip=None):
+    """Render a page (or a clip rectangle of it) to a grayscale PIL image"""
+    mat = fitz.Matrix(zoom, zoom)
+    pix = page.get_pixmap(matrix=mat, clip=clip, colorspace=fitz.csGRAY)
+    return Image.open(io.BytesIO(pix.tobytes("png")))
+
+
+def native_image_zoom(page):
+    """Zoom at which the largest embedded image is rendered 1:1, or None"""
+    best_area = 0.0
+    best_zoom = None
+    try:
+        # One pass over the page; get_image_rects would re-parse it per image
+        for info in page.get_image_info():
+            x0, y0, x1, y1 = info["bbox"]
+            area = abs((x1 - x0) * (y1 - y0))
+            if area > best_area and x1 - x0 > 0:
+                best_area = area
+                best_zoom = info["width"] / (x1 - x0)
+    except Exception:
+        return None
+    return best_zoom
+
+
+def _text_layer_height(page):
+    """Word-box height implied by the median font size of the page's text layer, or None without one"""
+    sizes = [
+        span["size"]
+        for block in page.get_text("dict")["blocks"]
+        for line in block.get("lines", [])
+        for span in line["spans"]
+        if span["text"].strip()
+    ]
+    if len(sizes) < 3:
+        return None
+    return statistics.median(sizes) * WORD_HEIGHT_PER_FONT_SIZE
+
+
+def _rendered_text_height(page, zoom=PROBE_ZOOM):
+    """Median height of the ink rows (text lines) of a low-resolution render, in points"""
+    pix = page.get_pixmap(matrix=fitz.Matrix(zoom, zoom), colorspace=fitz.csGRAY)
+    pixels = np.frombuffer(pix.samples, dtype=np.uint8).reshape(pix.height, pix.stride)[:, :pix.width]
+    # Ink is clearly darker than the paper, whatever the scan's background tone
+    ink = pixels < min(160, 0.75 * float(np.median(pixels)))
+
+    heights = []
+    for strip in np.array_split(ink, PROBE_STRIPS, axis=1):
+        inked_rows = (strip.sum(axis=1) >= max(2, strip.shape[1] // 100)).astype(np.int8)
+        edges = np.flatnonzero(np.diff(np.concatenate(([0], inked_rows, [0]))))
+        runs = (edges[1::2] - edges[::2]) / zoom
+        heights.extend(runs[(runs >= PROBE_MIN_ROW_PT) & (runs <= PROBE_MAX_ROW_PT)])
+    if len(heights) < 3:
+        return None
+    return float(np.median(heights))
+
+
+def probe_text_height(page):
+    """Estimate the median text height of a page in points without running OCR
+
+    The text layer's font sizes are used when the page has one; otherwise the
+    height of the text lines is measured on a 1x render.
+    """
+    height = _text_layer_height(page)
+    if height is None:
+        height = _rendered_text_height(page)
+    return height
+
+
+def choose_ocr_zoom(page):
+    """Pick a single zoom that puts the page's glyphs in Tesseract's preferred size range"""
+    native = native_image_zoom(page)
+
+    try:
+        height_pt = probe_text_height(page)
+    except Exception:
+        height_pt = None
+
+    if height_pt:
+        zoom = TARGET_TEXT_HEIGHT_PX / height_pt
+    elif native:
+        zoom = native
+    else:
+        zoom = DEFAULT_ZOOM
+
+    if native:
+        zoom = min(zoom, native * MAX_NATIVE_UPSAMPLE)
+
+    return _clamp_zoom(zoom)
+
+
+def group_ocr_lines(data):
+    """Group image_to_data output into lines in reading order"""
+    lines = {}
+    order = []
+    for i, word in enumerate(data.get("text", [])):
+        if not word or not word.strip():
+            continue
+        key = (data["block_num"][i], data["par_num"][i], data["line_num"][i])
+        if key not in lines:
+            lines[key] = {"words": [], "confs": [], "boxes": []}
+            order.append(key)
+        try:
+            conf = float(data["conf"][i])
+        except (TypeError, ValueError):
+            conf = -1.0
+        lines[key]["words"].append(word)
+        lines[key]["confs"].append(conf)
+        lines[key]["boxes"].append((
+            data["left"][i], data["top"][i],
+            data["left"][i] + data["width"][i], data["top"][i] + data["height"][i]
+        ))
+
+    result = []
+    for key in order:
+        line = lines[key]
+        boxes = line["boxes"]
+        result.append({
+            "key": key,
+            "text": " ".join(line["words"]),
+            "conf": statistics.mean(line["confs"]) if line["confs"] else -1.0,
+            "height": statistics.median(b[3] - b[1] for b in boxes),
+            "bbox": (
+                min(b[0] for b in boxes), min(b[1] for b in boxes),
+                max(b[2] for b in boxes), max(b[3] for b in boxes)
+            ),
+        })
+    return result
+
+
+def join_ocr_lines(lines):
+    """Join grouped lines back into text, with a blank line between blocks"""
+    text = ""
+    previous_block = None
+    for line in lines:
+        block = line["key"][0]
+        if previous_block is not None and block != previous_block:
+            text += "\n"
+        text += line["text"] + "\n"
+        previous_block = block
+    return text
+
+
+def line_clip_rect(page, bbox, zoom, padding=2.0):
+    """Convert a pixel bounding box at `zoom` into a padded page-space clip rectangle"""
+    x0, y0, x1, y1 = bbox
+    rect = fitz.Rect(x0 / zoom - padding, y0 / zoom - padding,
+                     x1 / zoom + padding, y1 / zoom + padding)
+    return rect & page.rect
+
+
+def line_config(config):
+    """The page's Tesseract config for a single line: same options, page segmentation mode 7"""
+    return (re.sub(r'--psm\s+\d+', '', config).strip() + ' --psm 7').strip()
+
+
+def reocr_line(page, line, zoom, target_zoom, config='--psm 6', timeout=0):
+    """Re-render one line's region at `target_zoom` and OCR just that region with the page's config"""
+    import pytesseract
+
+    clip = line_clip_rect(page, line["bbox"], zoom)
+    if clip.is_empty:
+        return line["text"], 0.0
+    image = render_page_image(page, target_zoom, clip=clip)
+    text = pytesseract.image_to_string(image, config=line_config(config), timeout=timeout).strip()
+    return text, clip.width * clip.height
+
+
+def _reocr_lines(page, lines, zoom, is_weak, target_zoom, config='--psm 6', timeout=0):
+    """Re-OCR the lines selected by `is_weak` in place; returns (count, page area re-processed)"""
+    count = 0
+    area = 0.0
+    for line in lines:
+        if not is_weak(line):
+            continue
+        try:
+            text, clip_area = reocr_line(page, line, zoom, target_zoom(line), config, timeout)
+        except Exception:
+            continue
+        if text:
+            line["text"] = text
+        count += 1
+        area += clip_area
+    return count, area
+
+
+def ocr_page_text(page, config='--psm 6', zoom=None, image=None, timeout=0):
+    """OCR a page rendered once at an adaptive zoom, upscaling only lines whose glyphs are too small
+
+    `timeout` (seconds, 0 for none) bounds each Tesseract call.
+    """
+    import pytesseract
+
+    if zoom is None:
+        zoom = choose_ocr_zoom(page)
+    if image is None:
+        image = render_page_image(page, zoom)
+
+    data = pytesseract.image_to_data(image, config=config, output_type=pytesseract.Output.DICT, timeout=timeout)
+    lines = group_ocr_lines(data)
+
+    if zoom < MAX_ZOOM:
+        _reocr_lines(
+            page, lines, zoom,
+            lambda line: 0 < line["height"] < MIN_TEXT_HEIGHT_PX,
+            lambda line: _clamp_zoom(zoom * TARGET_TEXT_HEIGHT_PX / line["height"]),
+            config, timeout
+        )
+
+    return join_ocr_lines(lines)
+
+
+def tiered_ocr_page(page, config='--psm 6', fast_zoom=FAST_ZOOM, high_zoom=HIGH_ZOOM, min_conf=LOW_CONFIDENCE,
+                    timeout=0):
+    """Two-tier OCR: a fast pass at modest zoom, then high-zoom re-OCR of low-confidence lines only
+
+    Returns the page text (in reading order) and a stats dict with per-tier
+    timings and the fraction of the page area that was re-processed.
+    """
+    import pytesseract
+
+    stats = {"fast_time": 0.0, "reocr_time": 0.0, "lines": 0, "reocr_lines": 0, "reocr_area": 0.0,
+             "page_area": page.rect.width * page.rect.height}
+
+    start = time.perf_counter()
+    image = render_page_image(page, fast_zoom)
+    data = pytesseract.image_to_data(image, config=config, output_type=pytesseract.Output.DICT, timeout=timeout)
+    lines = group_ocr_lines(data)
+    stats["fast_time"] = time.perf_counter() - start
+    stats["lines"] = len(lines)
+
+    start = time.perf_counter()
+    if lines:
+        stats["reocr_lines"], stats["reocr_area"] = _reocr_lines(
+            page, lines, fast_zoom,
+            lambda line: line["conf"] < min_conf or line["height"] < MIN_TEXT_HEIGHT_PX,
+            lambda line: high_zoom,
+            config, timeout
+        )
+        text = join_ocr_lines(lines)
+    else:
+        # Nothing detected at low resolution - redo the whole page at high zoom
+        text = strip_page_break(
+            pytesseract.image_to_string(render_page_image(page, high_zoom), config=config, timeout=timeout)
+        )
+        stats["reocr_area"] = stats["page_area"]
+    stats["reocr_time"] = time.perf_counter() - start
+
+    return text, stats
@@ -0,0 +1,227 @@
+#!/usr/bin/env python3
+"""
+Layout-aware word storage - keeps word coordinates for table and key-value reconstruction
+
+Words are stored column-wise in numpy arrays (coordinates, page/block/line
+numbers and offsets into a single text buffer) rather than as one Python
+object per word, so large documents stay compact and row/column clustering
+can be done with vectorized operations.
+"""
+
+import numpy as np
+
+# Separator between reconstructed table cells in text output
+CELL_SEPARATOR = " | "
+
+# Row/cell tolerances as fractions of the median word height
+ROW_TOLERANCE = 0.5
+CELL_GAP = 1.0
+COLUMN_GAP = 1.5
+
+# Label words that are commonly followed by their value
+_LABEL_SUFFIXES = (":", "#", " No.", " No")
+
+
+class WordLayout:
+    """Words of a document stored as parallel arrays"""
+
+    __slots__ = ("x0", "y0", "x1", "y1", "page", "block", "line", "starts", "ends", "buffer")
+
+    def __init__(self, x0, y0, x1, y1, page, block, line, starts, ends, buffer):
+        self.x0 = x0
+        self.y0 = y0
+        self.x1 = x1
+        self.y1 = y1
+        self.page = page
+        self.block = block
+        self.line = line
+        self.starts = starts
+        self.ends = ends
+        self.buffer = buffer
+
+    @classmethod
+    def from_document(cls, pdf_document):
+        """Build the layout from every page of an open PyMuPDF document"""
+        coords, ints, texts = [], [], []
+        for page_num in range(pdf_document.page_count):
+            # (x0, y0, x1, y1, word, block_no, line_no, word_no)
+            words = pdf_document[page_num].get_text("words")
+            if not words:
+                continue
+            coords.append(np.array([w[:4] for w in words], dtype=np.float32))
+            ints.append(np.array([(page_num, w[5], w[6]) for w in words], dtype=np.int32))
+            texts.extend(w[4] for w in words)
+
+        if not texts:
+            empty_f = np.empty(0, dtype=np.float32)
+            empty_i = np.empty(0, dtype=np.int32)
+            return cls(empty_f, empty_f, empty_f, empty_f, empty_i, empty_i, empty_i,
+                       np.empty(0, dtype=np.int64), np.empty(0, dtype=np.int64), "")
+
+        coords = np.concatenate(coords)
+        ints = np.concatenate(ints)
+        lengths = np.fromiter((len(t) for t in texts), dtype=np.int64, count=len(texts))
+        ends = np.cumsum(lengths)
+        starts = ends - lengths
+        return cls(
+            np.ascontiguousarray(coords[:, 0]), np.ascontiguousarray(coords[:, 1]),
+            np.ascontiguousarray(coords[:, 2]), np.ascontiguousarray(coords[:, 3]),
+            np.ascontiguousarray(ints[:, 0]), np.ascontiguousarray(ints[:, 1]),
+            np.ascontiguousarray(ints[:, 2]),
+            starts, ends, "".join(texts)
+        )
+
+    def select_pages(self, first, last):
+        """Layout of pages first..last (inclusive), renumbered from 0"""
+        mask = (self.page >= first) & (self.page <= last)
+        starts, ends = self.starts[mask], self.ends[mask]
+        buffer = "".join(self.buffer[s:e] for s, e in zip(starts, ends))
+        lengths = ends - starts
+        new_ends = np.cumsum(lengths)
+        return WordLayout(
+            self.x0[mask], self.y0[mask], self.x1[mask], self.y1[mask],
+            self.page[mask] - first, self.block[mask], self.line[mask],
+            new_ends - lengths, new_ends, buffer
+        )
+
+    def __len__(self):
+        return len(self.starts)
+
+    def word(self, i):
+        """Text of word i"""
+        return self.buffer[self.starts[i]:self.ends[i]]
+
+    def words(self, indices):
+        return [self.buffer[s:e] for s, e in zip(self.starts[indices], self.ends[indices])]
+
+    def page_count(self):
+        return int(self.page.max()) + 1 if len(self) else 0
+
+    def _median_height(self, mask=None):
+        heights = (self.y1 - self.y0) if mask is None else (self.y1 - self.y0)[mask]
+        return float(np.median(heights)) if len(heights) else 0.0
+
+    def rows(self, tolerance=None):
+        """Row id per word, clustering words whose vertical centres are within tolerance"""
+        if not len(self):
+            return np.empty(0, dtype=np.int64)
+        if tolerance is None:
+            tolerance = self._median_height() * ROW_TOLERANCE
+
+        centre = (self.y0 + self.y1) / 2
+        order = np.lexsort((centre, self.page))
+        sorted_centre = centre[order]
+        sorted_page = self.page[order]
+
+        new_row = np.ones(len(order), dtype=bool)
+        new_row[1:] = (np.diff(sorted_centre) > tolerance) | (np.diff(sorted_page) != 0)
+
+        row_ids = np.empty(len(order), dtype=np.int64)
+        row_ids[order] = np.cumsum(new_row) - 1
+        return row_ids
+
+    def columns(self, mask=None, gap=None):
+        """Column id per word (within `mask`, a boolean mask or index array), clustering left edges separated by more than gap"""
+        x0 = self.x0 if mask is None else self.x0[mask]
+        if not len(x0):
+            return np.empty(0, dtype=np.int64)
+        if gap is None:
+            gap = self._median_height(mask) * COLUMN_GAP
+
+        xs = np.sort(x0)
+        breaks = np.flatnonzero(np.diff(xs) > gap)
+        column_starts = xs[np.concatenate(([0], breaks + 1))]
+        return np.searchsorted(column_starts, x0, side="right") - 1
+
+    def cells(self, gap=None):
+        """Split rows into cells wherever the horizontal gap between neighbouring words is large
+
+        Returns (order, row_ids, cell_ids) where `order` lists word indices in
+        reading order and the id arrays are aligned with it.
+        """
+        row_ids = self.rows()
+        if not len(row_ids):
+            empty = np.empty(0, dtype=np.int64)
+            return empty, empty, empty
+        if gap is None:
+            gap = self._median_height() * CELL_GAP
+
+        order = np.lexsort((self.x0, row_ids))
+        sorted_rows = row_ids[order]
+        same_row = np.zeros(len(order), dtype=bool)
+        same_row[1:] = sorted_rows[1:] == sorted_rows[:-1]
+        word_gap = np.zeros(len(order), dtype=np.float32)
+        word_gap[1:] = self.x0[order][1:] - self.x1[order][:-1]
+
+        new_cell = ~same_row | (word_gap > gap)
+        cell_ids = np.cumsum(new_cell) - 1
+        return order, sorted_rows, cell_ids
+
+    def _cell_columns(self, order, cell_ids):
+        """Page column of each cell's first word (aligned with `order`), -1 for the other words"""
+        word_pages = self.page[order]
+        first_word = np.ones(len(order), dtype=bool)
+        first_word[1:] = cell_ids[1:] != cell_ids[:-1]
+        cell_columns = np.full(len(order), -1, dtype=np.int64)
+        for page in np.unique(word_pages):
+            on_page = np.flatnonzero(first_word & (word_pages == page))
+            cell_columns[on_page] = self.columns(order[on_page])
+        return cell_columns
+
+    def table_rows(self):
+        """Reconstructed rows per page: {page_num: [[cell text, ...], ...]}
+
+        Cells are placed in the page's columns, counted from column 0, so a
+        row with an empty cell (its first one included) gets an empty string
+        there instead of shifting later values left.
+        """
+        order, row_ids, cell_ids = self.cells()
+        pages = {}
+        if not len(order):
+            return pages
+
+        words = self.words(order)
+        word_pages = self.page[order]
+        cell_columns = self._cell_columns(order, cell_ids)
+        current_row = current_cell = current_column = None
+        for word, page, row, cell, column in zip(words, word_pages, row_ids, cell_ids, cell_columns):
+            page_rows = pages.setdefault(int(page), [])
+            if row != current_row:
+                # Columns before the row's first cell are empty cells too
+                page_rows.append([""] * max(0, int(column)) + [word])
+                current_column = column
+            elif cell != current_cell:
+                # Skipped columns between two cells of the row are empty cells
+                page_rows[-1].extend([""] * max(0, int(column - current_column) - 1))
+                page_rows[-1].append(word)
+                current_column = max(column, current_column + 1)
+            else:
+                page_rows[-1][-1] += " " + word
+            current_row, current_cell = row, cell
+        return pages
+
+    def to_text(self, page_break="\n", cell_separator=CELL_SEPARATOR, pages=None):
+        """Text in reading order with table cells kept apart, one page per page_break
+
+        Pass the result of table_rows() as `pages` when it is already computed.
+        """
+        pages = self.table_rows() if pages is None else pages
+        return page_break.join(
+            "\n".join(cell_separator.join(row) for row in pages.get(page_num, []))
+            for page_num in range(self.page_count())
+        )
+
+    def key_values(self, pages=None):
+        """Pair label cells ('Invoice No:', 'PO #') with their value on the same row"""
+        pairs = []
+        pages = self.table_rows() if pages is None else pages
+        for rows in pages.values():
+            for row in rows:
+                for i, cell in enumerate(row):
+                    label, colon, value = cell.partition(":")
+                    if colon and value.strip():
+                        # "Invoice No: 12345" in a single cell
+                        pairs.append((label.strip(), value.strip()))
+                    elif cell.rstrip().endswith(_LABEL_SUFFIXES) and i + 1 < len(row) and row[i + 1].strip():
+                        pairs.append((cell.rstrip(" :#"), row[i + 1]))
+        return pairs
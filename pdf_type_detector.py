@@ -9,6 +9,214 @@ import pdfplumber
 import fitz  # PyMuPDF
 from PIL import Image
 import io
+import re
+import time
+
+# Page classes returned by classify_pdf
+PAGE_SEARCHABLE = "searchable"
+PAGE_SCANNED = "scanned"
+PAGE_MIXED = "mixed"
+PAGE_EMPTY = "empty"
+
+# A page is a scan when images cover at least this much of it
+SCAN_COVERAGE = 0.5
+
+# Below this confidence a "scanned" verdict is checked against the text layer before skipping it
+SKIP_TEXT_LAYER_CONFIDENCE = 0.8
+
+# Content stream operators, matched without interpreting the page
+_TEXT_SHOW_RE = re.compile(rb'T[jJ]\b')
+_INVISIBLE_TEXT_RE = re.compile(rb'\b3\s+Tr\b')
+# The operators that place images: "a b c d e f cm", then "/Name Do" or an inline "BI" (Q drops the cm).
+# Matching starts only at these keywords; the cm's numbers are read back from just before it
+_PLACEMENT_RE = re.compile(rb'\b(cm|BI|Q)\b|/([^\s/\[\]<>()]+)\s+Do\b')
+# "/Name 12 0 R" entries of an /XObject resource dictionary
+_XOBJECT_REF_RE = re.compile(r'/([^\s/<>\[\]()]+)\s*(\d+)\s+0\s+R')
+# Forms nested deeper than this are not followed
+MAX_FORM_DEPTH = 8
+
+def _scale(a, b, c, d):
+    try:
+        return abs(float(a) * float(d) - float(b) * float(c))
+    except ValueError:
+        return 0.0
+
+def _xobjects(pdf_document, xref):
+    """name -> xref of the XObjects in an object's /Resources (a page's may be inherited from the page tree)"""
+    for _ in range(MAX_FORM_DEPTH):
+        kind, value = pdf_document.xref_get_key(xref, "Resources/XObject")
+        if kind == "xref":
+            value = pdf_document.xref_object(int(value.split()[0]))
+        if kind in ("dict", "xref"):
+            return {name: int(ref) for name, ref in _XOBJECT_REF_RE.findall(value)}
+        if pdf_document.xref_get_key(xref, "Resources")[0] != "null":
+            return {}
+        kind, value = pdf_document.xref_get_key(xref, "Parent")
+        if kind != "xref":
+            return {}
+        xref = int(value.split()[0])
+    return {}
+
+def _form(pdf_document, xref, cache, depth):
+    """(image area in the drawing space, {xref: stream} of the form and its nested forms), cached per xref"""
+    if xref not in cache:
+        # Placeholder first, so a form that draws itself ends the recursion
+        cache[xref] = (0.0, {})
+        kind, value = pdf_document.xref_get_key(xref, "Matrix")
+        numbers = value.strip("[]").split() if kind == "array" else []
+        matrix_scale = _scale(*numbers[:4]) if len(numbers) >= 4 else 1.0
+        content = pdf_document.xref_stream(xref) or b""
+        area, streams = _placements(pdf_document, content, xref, cache, depth + 1)
+        streams[xref] = content
+        cache[xref] = (matrix_scale * area, streams)
+    return cache[xref]
+
+def _placements(pdf_document, content, owner, cache, depth=0):
+    """Image area placed by a content stream and the streams of the forms it draws
+
+    Only the last cm before each Do (or BI) is applied, so nothing is
+    interpreted; `owner` is the page or form whose resources name the
+    XObjects. Results are kept in `cache`, so forms shared by several pages
+    (letterheads) are read once per document.
+    """
+    names = cache.get(("names", owner))
+    if names is None:
+        names = cache[("names", owner)] = _xobjects(pdf_document, owner)
+    area = 0.0
+    streams = {}
+    scale = 1.0
+    for match in _PLACEMENT_RE.finditer(content):
+        operator, name = match.groups()
+        if operator == b"cm":
+            numbers = content[max(0, match.start() - 160):match.start()].split()[-6:]
+            scale = _scale(*numbers[:4]) if len(numbers) == 6 else 1.0
+            continue
+        if operator == b"Q":
+            # Q restores the state from before the cm
+            scale = 1.0
+            continue
+        placed, scale = scale, 1.0
+        if operator == b"BI":
+            area += placed
+            continue
+        xref = names.get(name.decode("latin-1"))
+        if xref is None:
+            continue
+        subtype = cache.get(("subtype", xref))
+        if subtype is None:
+            subtype = cache[("subtype", xref)] = pdf_document.xref_get_key(xref, "Subtype")[1]
+        if subtype == "/Image":
+            area += placed
+        elif subtype == "/Form" and depth < MAX_FORM_DEPTH:
+            form_area, form_streams = _form(pdf_document, xref, cache, depth)
+            area += placed * form_area
+            streams.update(form_streams)
+    return area, streams
+
+def _page_content(page, cache):
+    """The page's content streams (its own, then each form it draws once) and the share covered by images"""
+    page_area = abs(page.rect.width * page.rect.height) or 1.0
+    try:
+        content = page.read_contents()
+    except Exception:
+        return [b""], 0.0
+    try:
+        area, streams = _placements(page.parent, content, page.xref, cache)
+    except Exception:
+        return [content], 0.0
+    return [content] + [streams[xref] for xref in sorted(streams)], min(1.0, area / page_area)
+
+def classify_page(page, cache=None):
+    """Classify one page from its raw content streams - no text extraction or rendering
+
+    `cache` may be shared by the pages of one document (see classify_pdf).
+    """
+    streams, coverage = _page_content(page, {} if cache is None else cache)
+    content = b"\n".join(streams)
+    
+    text_ops = len(_TEXT_SHOW_RE.findall(content))
+    invisible_text = bool(_INVISIBLE_TEXT_RE.search(content))
+    
+    if text_ops and (coverage < SCAN_COVERAGE or invisible_text):
+        # Regular text page, or a scan that already carries an OCR text layer
+        kind = PAGE_SEARCHABLE
+        confidence = 0.8 + 0.2 * min(1.0, text_ops / 20)
+    elif text_ops:
+        # Mostly image with some real text on top (stamps, typed fields)
+        kind = PAGE_MIXED
+        confidence = 0.6 + 0.2 * coverage
+    elif coverage >= SCAN_COVERAGE:
+        kind = PAGE_SCANNED
+        confidence = 0.7 + 0.3 * coverage
+    elif coverage > 0:
+        # Small images and no text - probably a scan split into tiles or vector art
+        kind = PAGE_SCANNED
+        confidence = 0.5
+    else:
+        kind = PAGE_EMPTY
+        confidence = 0.5 if content else 0.9
+    
+    return {
+        "kind": kind,
+        "confidence": round(confidence, 2),
+        "text_ops": text_ops,
+        "image_coverage": round(coverage, 3),
+    }
+
+def classify_pdf(pdf_source):
+    """Classify a PDF (bytes or path) as searchable, scanned or mixed, page by page
+    
+    Only the page content streams are inspected, so this is cheap enough to
+    run in front of every extraction to pick the right pipeline.
+    """
+    start = time.perf_counter()
+    if isinstance(pdf_source, (bytes, bytearray)):
+        pdf_document = fitz.open(stream=pdf_source, filetype="pdf")
+    else:
+        pdf_document = fitz.open(pdf_source)
+    
+    pages = []
+    cache = {}
+    try:
+        for page_num in range(pdf_document.page_count):
+            result = classify_page(pdf_document[page_num], cache)
+            result["page"] = page_num
+            pages.append(result)
+    finally:
+        pdf_document.close()
+    
+    kinds = {p["kind"] for p in pages if p["kind"] != PAGE_EMPTY}
+    if not kinds:
+        kind = PAGE_EMPTY
+    elif len(kinds) == 1:
+        kind = kinds.pop()
+    else:
+        kind = PAGE_MIXED
+    confidence = min((p["confidence"] for p in pages), default=0.0)
+    
+    return {
+        "kind": kind,
+        "confidence": confidence,
+        "pages": pages,
+        "elapsed_ms": (time.perf_counter() - start) * 1000,
+    }
+
+def has_text_layer(pdf_source):
+    """Whether any page yields text from PyMuPDF"""
+    if isinstance(pdf_source, (bytes, bytearray)):
+        pdf_document = fitz.open(stream=pdf_source, filetype="pdf")
+    else:
+        pdf_document = fitz.open(pdf_source)
+    try:
+        return any(page.get_text().strip() for page in pdf_document)
+    finally:
+        pdf_document.close()
+
+def should_skip_text_layer(classification, pdf_source):
+    """Skip the text strategies only for a confident scan, or a scan with no text layer at all"""
+    if classification["kind"] != PAGE_SCANNED:
+        return False
+    return classification["confidence"] >= SKIP_TEXT_LAYER_CONFIDENCE or not has_text_layer(pdf_source)
 
 def detect_pdf_type(pdf_file):
     """Detect if PDF is searchable or scanned"""
@@ -23,6 +231,25 @@ def detect_pdf_type(pdf_file):
         st.info(f"📁 File: {pdf_file.name}")
         st.info(f"📏 Size: {file_size:,} bytes ({file_size/1024/1024:.2f} MB)")
         
+        # Test 0: Fast structural classification
+        st.markdown("### Test 0: Fast Classification")
+        try:
+            classification = classify_pdf(pdf_file.read())
+            pdf_file.seek(0)
+            st.success(
+                f"✅ {classification['kind'].title()} PDF "
+                f"(confidence {classification['confidence']:.0%}, {classification['elapsed_ms']:.0f} ms)"
+            )
+            with st.expander("Per-page classification"):
+                for page in classification["pages"]:
+                    st.text(
+                        f"Page {page['page'] + 1}: {page['kind']} ({page['confidence']:.0%}) - "
+                        f"{page['text_ops']} text ops, {page['image_coverage']:.0%} image coverage"
+                    )
+        except Exception as e:
+            pdf_file.seek(0)
+            st.error(f"❌ Fast classification failed: {str(e)}")
+        
         # Test 1: PyPDF2 text extraction
         st.markdown("### Test 1: PyPDF2 Text Extraction")
         try:
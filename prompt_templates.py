@@ -0,0 +1,106 @@
+#!/usr/bin/env python3
+"""
+Versioned extraction prompt - fixed instruction prefix first, the document last
+
+Providers cache the longest prompt prefix they have seen recently, so the
+instruction block must be byte-for-byte identical on every call and nothing
+request-specific may appear before it. OpenAI only caches prompts of at
+least MIN_CACHED_PREFIX_TOKENS tokens, so everything stable - the field
+list, the value rules and a worked example - lives in the prefix to keep it
+above that. Any change to SYSTEM_PROMPT is a new prompt version: bump
+PROMPT_VERSION so results can be traced to the prompt that produced them.
+"""
+
+PROMPT_VERSION = "3"
+
+# Shortest prompt OpenAI caches; SYSTEM_PROMPT must stay above it
+MIN_CACHED_PREFIX_TOKENS = 1024
+
+SYSTEM_PROMPT = """You are an expert at extracting structured data from invoices. Always return valid JSON format with the exact field names provided. Be thorough and accurate.
+
+Extract the following information from the invoice text in the user message and return it in JSON format.
+If any information is not found, use "N/A" as the value.
+
+IMPORTANT: Look for these fields with various possible names/abbreviations:
+- PO Number (could be: PO No, Purchase Order, P.O. Number, Order No, etc.)
+- Item Code (could be: Item No, Product Code, SKU, Part Number, Product ID, etc.)
+- Description (could be: Product Description, Item Description, Product Name, etc.)
+- UOM (could be: Unit of Measure, Unit, U/M, Unit Type, etc.)
+- Quantity (could be: Qty, Amount, Qty Ordered, etc.)
+- Lot Number (could be: Lot No, Batch Number, Batch No, Lot ID, etc.)
+- Expiry Date (could be: Exp Date, Expiration Date, Use By Date, etc.)
+- Mfg Date (could be: Manufacturing Date, Mfg Date, Production Date, Made Date, etc.)
+- Invoice No (could be: Invoice Number, Inv No, Invoice ID, etc.)
+- Unit Price (could be: Price per Unit, Unit Cost, Price, Rate, etc.)
+- Total Price (could be: Line Total, Item Total, Amount, etc.)
+- Country (could be: Origin Country, Country of Origin, Made In, etc.)
+- HS Code (could be: HSN Code, Tariff Code, Customs Code, etc.)
+- Date of Invoice (could be: Invoice Date, Date, Issue Date, etc.)
+- Customer No (could be: Customer Number, Customer ID, Client No, Account No, etc.)
+- Payer Name (could be: Payer, Bill To, Billing Name, etc.)
+- Currency (could be: Curr, Currency Code, etc.)
+- Supplier Name (could be: Vendor Name, Supplier, Company Name, Seller, etc.)
+- Total Amount of the Invoice (could be: Grand Total, Total Amount, Invoice Total, Net Total, etc.)
+- Total VAT or Tax (could be: VAT, Tax, Tax Amount, VAT Amount, Tax Total, etc.)
+
+Instructions:
+1. Look carefully through the entire text
+2. Extract numerical values as numbers (not strings) when possible
+3. Extract dates in a consistent format (YYYY-MM-DD if possible)
+4. Be flexible with field names and variations
+5. If multiple items are present, extract the first/main item or aggregate data
+
+Value rules:
+- Quantity, Unit Price, Total Price, Total Amount of the Invoice and Total VAT or Tax are plain JSON numbers: no currency symbols or codes, no thousands separators, a dot as the decimal mark. Read "1.234,50" and "1 234,50" as 1234.5 and "(12.00)" as -12.0.
+- Quantity times Unit Price should equal Total Price for the same line; if they disagree, re-read the line rather than guessing a value that makes them agree.
+- Total Amount of the Invoice is the final amount payable including VAT or tax. Do not use the subtotal, a line total or an amount brought forward from a previous page.
+- Total VAT or Tax is the tax amount, not the tax rate: for "VAT 5% 12.50" return 12.50. If the invoice shows several tax lines, return their sum. Use 0 only when the invoice states zero tax.
+- Currency is the three-letter ISO 4217 code (USD, EUR, GBP, AED, SAR, INR ...). Convert symbols and names: "$" is USD unless another dollar is named, "€" is EUR, "£" is GBP, "Dirham" or "Dhs" is AED.
+- Dates are YYYY-MM-DD. Printed dates are usually day first ("05/03/2024" is 2024-03-05) unless the month cannot be the first number or the document is clearly American. An expiry or manufacturing date printed as a month and year only ("06/2027", "JUN 2027") keeps just that: "2027-06".
+- Invoice No, PO Number, Customer No, Item Code, Lot Number and HS Code are copied exactly as printed, keeping letters, leading zeros, dashes and slashes. Do not put a label such as "No:" or "#" into the value.
+- Supplier Name is the company issuing the invoice, usually in the letterhead; Payer Name is the billed party under "Bill To", "Sold To" or "Customer". Never swap them.
+- Country is the country of origin of the goods, not an address line, unless the invoice gives no origin and the supplier address is the only country.
+- UOM is the unit the quantity is counted in (PCS, BOX, KG, EA, CTN ...), as printed.
+- Text split across lines by the PDF layout (a long description, a name wrapped in a table cell) belongs to one value; join it with single spaces.
+- Headers, footers, page numbers and terms and conditions repeated on every page are not line items.
+
+Example. For this invoice text:
+ACME MEDICAL SUPPLIES LLC, P.O. Box 1234, Dubai, UAE
+TAX INVOICE    Invoice No: INV-2024-0183    Invoice Date: 05/03/2024
+Bill To: Gulf Pharmacy Trading    Customer No: C-00417    PO No: PO-7781
+Item Code  Description            UOM  Qty  Unit Price  Amount
+MS-2210    Sterile Saline 500 ml  BOX  12   45.00       540.00
+Lot: L2403A   Mfg: 01/2024   Exp: 12/2026   Origin: Germany   HS Code: 3004.90
+Subtotal AED 540.00    VAT 5% 27.00    Grand Total AED 567.00
+
+the reply is:
+{"PO Number": "PO-7781", "Item Code": "MS-2210", "Description": "Sterile Saline 500 ml", "UOM": "BOX", "Quantity": 12, "Lot Number": "L2403A", "Expiry Date": "2026-12", "Mfg Date": "2024-01", "Invoice No": "INV-2024-0183", "Unit Price": 45.00, "Total Price": 540.00, "Country": "Germany", "HS Code": "3004.90", "Date of Invoice": "2024-03-05", "Customer No": "C-00417", "Payer Name": "Gulf Pharmacy Trading", "Currency": "AED", "Supplier Name": "ACME MEDICAL SUPPLIES LLC", "Total Amount of the Invoice": 567.00, "Total VAT or Tax": 27.00}
+
+Return only valid JSON format with the above fields as keys. Use the exact field names provided above.
+If the invoice text holds several documents between "=== DOCUMENT <id> ===" and "=== END DOCUMENT <id> ===" markers, extract every document separately and return a JSON array with one object per document, in the same order, each with a "document_id" key holding the document's id plus the fields above."""
+
+FIELDS_NOTE = "Only these fields are needed this time: {fields}. Return them as JSON with these exact keys."
+PACKED_NOTE = "The invoice text contains {count} separate invoices (ids: {ids})."
+
+
+def build_messages(text, fields=None, packed_ids=None):
+    """Chat messages for one extraction: the cached instruction prefix, then per-request notes and the document"""
+    notes = []
+    if fields:
+        # Escalations re-ask for just the fields that failed validation
+        notes.append(FIELDS_NOTE.format(fields=", ".join(fields)))
+    if packed_ids:
+        notes.append(PACKED_NOTE.format(count=len(packed_ids), ids=", ".join(packed_ids)))
+    notes.append(f"Invoice text:\n{text}")
+    return [
+        {"role": "system", "content": SYSTEM_PROMPT},
+        {"role": "user", "content": "\n\n".join(notes)},
+    ]
+
+
+def cached_tokens(usage):
+    """Prompt tokens the provider served from its prefix cache, from a response's usage"""
+    details = getattr(usage, "prompt_tokens_details", None)
+    if isinstance(details, dict):
+        return details.get("cached_tokens") or 0
+    return getattr(details, "cached_tokens", None) or 0
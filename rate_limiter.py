@@ -0,0 +1,172 @@
+#!/usr/bin/env python3
+"""
+Adaptive concurrency for OpenAI calls - AIMD driven by rate-limit headers and latency
+
+The OpenAI quota is shared with other services, so no fixed concurrency is
+right for long. The limiter grows the number of in-flight requests by one per
+window of successful calls, halves it when the x-ratelimit-remaining headers
+show little headroom, latency climbs, or a 429 comes back, and holds every
+worker back until the advertised reset time after a throttle.
+"""
+
+import re
+import threading
+import time
+
+MIN_CONCURRENCY = 1
+# Headroom (remaining / limit) below which we back off before hitting a 429
+LOW_HEADROOM = 0.1
+DECREASE_FACTOR = 0.5
+# A call slower than this multiple of the running average counts as congestion
+LATENCY_FACTOR = 2.0
+LATENCY_SAMPLES = 5
+# Wait after a 429 when the response does not say how long
+DEFAULT_RETRY_SECONDS = 1.0
+# Throttled requests are requeued at most this many times before the item fails
+MAX_REQUEUES = 5
+
+_DURATION_RE = re.compile(r'(\d+(?:\.\d+)?)(ms|h|m|s)')
+_UNIT_SECONDS = {"ms": 0.001, "s": 1.0, "m": 60.0, "h": 3600.0}
+
+
+def parse_reset(value):
+    """Seconds from an OpenAI reset header such as '20ms', '1s' or '6m0s', or None"""
+    if not value:
+        return None
+    value = str(value).strip()
+    try:
+        return float(value)
+    except ValueError:
+        pass
+    parts = _DURATION_RE.findall(value)
+    if not parts:
+        return None
+    return sum(float(amount) * _UNIT_SECONDS[unit] for amount, unit in parts)
+
+
+def _header_float(headers, name):
+    try:
+        return float(headers.get(name))
+    except (TypeError, ValueError):
+        return None
+
+
+def rate_limit_info(headers):
+    """Remaining/limit/reset for requests and tokens from response headers"""
+    headers = headers or {}
+    info = {}
+    for kind in ("requests", "tokens"):
+        info[kind] = {
+            "limit": _header_float(headers, f"x-ratelimit-limit-{kind}"),
+            "remaining": _header_float(headers, f"x-ratelimit-remaining-{kind}"),
+            "reset": parse_reset(headers.get(f"x-ratelimit-reset-{kind}")),
+        }
+    return info
+
+
+def retry_after_seconds(headers):
+    """How long a 429 response asks us to wait"""
+    headers = headers or {}
+    retry_ms = _header_float(headers, "retry-after-ms")
+    if retry_ms is not None:
+        return retry_ms / 1000
+    retry = _header_float(headers, "retry-after")
+    if retry is not None:
+        return retry
+    resets = [v["reset"] for v in rate_limit_info(headers).values() if v["reset"] is not None]
+    return max(resets) if resets else DEFAULT_RETRY_SECONDS
+
+
+class AIMDLimiter:
+    """Caps in-flight requests with additive-increase / multiplicative-decrease"""
+
+    def __init__(self, max_concurrency, initial=None, min_concurrency=MIN_CONCURRENCY):
+        self.max_concurrency = max_concurrency
+        self.min_concurrency = min_concurrency
+        self.limit = float(initial or max(min_concurrency, max_concurrency // 2))
+        self.in_flight = 0
+        self.paused_until = 0.0
+        self.avg_latency = None
+        self.samples = 0
+        self.throttles = 0
+        self.decreases = 0
+        self.peak = int(self.limit)
+        self._last_decrease = 0.0
+        self._cond = threading.Condition()
+
+    def acquire(self):
+        """Block until a slot is free and no throttle pause is in force"""
+        with self._cond:
+            while True:
+                wait = self.paused_until - time.monotonic()
+                if wait <= 0 and self.in_flight < int(self.limit):
+                    self.in_flight += 1
+                    return
+                self._cond.wait(timeout=wait if wait > 0 else None)
+
+    def release(self):
+        with self._cond:
+            self.in_flight -= 1
+            self._cond.notify_all()
+
+    def __enter__(self):
+        self.acquire()
+        return self
+
+    def __exit__(self, *exc):
+        self.release()
+        return False
+
+    def _decrease(self, now):
+        # One decrease per round trip: the calls already in flight saw the same congestion
+        if now - self._last_decrease < (self.avg_latency or 0.0):
+            return
+        self.limit = max(self.min_concurrency, self.limit * DECREASE_FACTOR)
+        self.decreases += 1
+        self._last_decrease = now
+
+    def on_success(self, latency, headers=None):
+        """Adjust the limit after a successful call from its latency and rate-limit headers"""
+        now = time.monotonic()
+        info = rate_limit_info(headers)
+        with self._cond:
+            slow = (
+                self.samples >= LATENCY_SAMPLES
+                and latency > LATENCY_FACTOR * self.avg_latency
+            )
+            self.avg_latency = latency if self.avg_latency is None else 0.8 * self.avg_latency + 0.2 * latency
+            self.samples += 1
+
+            headroom = [
+                v["remaining"] / v["limit"] for v in info.values()
+                if v["remaining"] is not None and v["limit"]
+            ]
+            exhausted = [v["reset"] for v in info.values() if v["remaining"] == 0 and v["reset"]]
+            if exhausted:
+                # Out of quota for this window: stop sending until it resets
+                self.paused_until = max(self.paused_until, now + max(exhausted))
+                self._decrease(now)
+            elif slow or (headroom and min(headroom) < LOW_HEADROOM):
+                self._decrease(now)
+            else:
+                self.limit = min(self.max_concurrency, self.limit + 1.0 / max(1.0, self.limit))
+                self.peak = max(self.peak, int(self.limit))
+            self._cond.notify_all()
+
+    def on_throttle(self, headers=None):
+        """Back off after a 429 and hold all workers until the advertised reset"""
+        now = time.monotonic()
+        with self._cond:
+            self.throttles += 1
+            self.paused_until = max(self.paused_until, now + retry_after_seconds(headers))
+            self._decrease(now)
+            self._cond.notify_all()
+
+    def stats(self):
+        return {
+            "limit": int(self.limit),
+            "peak": self.peak,
+            "throttles": self.throttles,
+            "decreases": self.decreases,
+            "avg_latency": self.avg_latency,
+        }
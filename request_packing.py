@@ -0,0 +1,110 @@
+#!/usr/bin/env python3
+"""
+Request packing - several short invoices share one LLM request
+
+The 20-field instruction prompt costs the same for a one-page invoice as for
+a long one. Short documents are grouped, delimited with their document IDs,
+and extracted in one call that returns a keyed JSON array. Each unpacked
+result is validated; anything missing or failing is redone on its own.
+"""
+
+import json
+import re
+import threading
+
+from text_cleanup import CHARS_PER_TOKEN, strip_boilerplate
+
+# Documents above this many (estimated) tokens are always sent on their own
+MAX_PACK_DOC_TOKENS = 1500
+DEFAULT_PACK_SIZE = 5
+# Rough size of the instruction prompt, for the tokens-saved estimate
+PROMPT_OVERHEAD_TOKENS = 450
+# Completion tokens reserved for each document's JSON in a packed reply
+COMPLETION_TOKENS_PER_DOC = 600
+
+DOCUMENT_START = "=== DOCUMENT {doc_id} ==="
+DOCUMENT_END = "=== END DOCUMENT {doc_id} ==="
+
+
+def estimate_tokens(text):
+    return len(text) // CHARS_PER_TOKEN
+
+
+def plan_packs(texts, pack_size=DEFAULT_PACK_SIZE, max_doc_tokens=MAX_PACK_DOC_TOKENS):
+    """Group document indices into requests: short documents in packs of up to pack_size, the rest alone"""
+    short = [i for i, text in enumerate(texts) if estimate_tokens(text) <= max_doc_tokens]
+    long = [i for i, text in enumerate(texts) if estimate_tokens(text) > max_doc_tokens]
+    groups = [short[start:start + pack_size] for start in range(0, len(short), pack_size)] if pack_size > 1 else [[i] for i in short]
+    groups += [[i] for i in long]
+    return sorted(groups, key=lambda group: group[0])
+
+
+def build_packed_text(documents):
+    """Join (doc_id, text) pairs with ID markers; boilerplate is stripped per document first
+
+    Stripping the packed text as a whole would treat a supplier's letterhead,
+    repeated across its invoices, as a running header and remove it.
+    """
+    parts = []
+    for doc_id, text in documents:
+        text, _ = strip_boilerplate(text)
+        parts.append(f"{DOCUMENT_START.format(doc_id=doc_id)}\n{text.strip()}\n{DOCUMENT_END.format(doc_id=doc_id)}")
+    return "\n\n".join(parts)
+
+
+def unpack_results(content, doc_ids):
+    """Map the model's JSON array back to document IDs; documents without a usable object are left out"""
+    if not content:
+        return {}
+    content = content.strip()
+    if content.startswith("```"):
+        content = re.sub(r'^```(?:json)?\s*|\s*```$', '', content)
+    try:
+        data = json.loads(content)
+    except json.JSONDecodeError:
+        return {}
+
+    # Tolerate the array being wrapped in an object, e.g. {"documents": [...]}
+    if isinstance(data, dict):
+        data = next((value for value in data.values() if isinstance(value, list)), [])
+    if not isinstance(data, list):
+        return {}
+
+    doc_ids = [str(doc_id) for doc_id in doc_ids]
+    results = {}
+    for position, item in enumerate(data):
+        if not isinstance(item, dict):
+            continue
+        doc_id = item.pop("document_id", None)
+        doc_id = str(doc_id).strip() if doc_id is not None else None
+        if doc_id not in doc_ids:
+            # Fall back to position only when the reply has exactly one object per document
+            if len(data) != len(doc_ids):
+                continue
+            doc_id = doc_ids[position]
+        results.setdefault(doc_id, item)
+    return results
+
+
+class PackingStats:
+    """Counts packed requests and fallbacks to single-document calls"""
+
+    def __init__(self):
+        self.packs = 0
+        self.packed_documents = 0
+        self.fallbacks = 0
+        self._lock = threading.Lock()
+
+    def record(self, documents, fallbacks):
+        with self._lock:
+            self.packs += 1
+            self.packed_documents += documents
+            self.fallbacks += fallbacks
+
+    def summary(self):
+        with self._lock:
+            saved = (self.packed_documents - self.packs) * PROMPT_OVERHEAD_TOKENS
+            return (
+                f"Request packing: {self.packed_documents} invoice(s) in {self.packs} request(s), "
+                f"{self.fallbacks} redone individually, ~{saved:,} prompt tokens saved"
+            )
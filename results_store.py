@@ -0,0 +1,282 @@
+#!/usr/bin/env python3
+"""
+Results store - every extracted invoice row in one local SQLite database
+
+Each run's rows are written under a run id, one column per invoice field
+plus the source file, pages and processing time, with the complete row kept
+as JSON so nothing the extraction returned is lost. Invoice No, PO Number,
+Supplier Name, Lot Number and the dates are indexed (case-insensitively for
+the codes and names), so "have we booked invoice X" and "all lines for PO Y"
+are index lookups. Excel exports are produced from query results.
+
+Date columns hold the ISO date (YYYY-MM-DD) read from whatever format the
+model returned, so date ranges compare correctly; the value as extracted
+stays in the JSON.
+
+Every row also carries a normalized supplier name, invoice number and
+numeric total under one composite index, so checking a new invoice against
+the whole history for a double booking is a single index probe however many
+rows are stored.
+"""
+
+import json
+import os
+import re
+import sqlite3
+import threading
+import uuid
+from datetime import datetime
+
+import pandas as pd
+
+from field_values import is_missing, parse_amount
+from invoice_fields import DATE_FIELDS, INVOICE_FIELDS, SOURCE_FIELDS, column_name
+from invoice_records import normalize_dates
+from model_router import AMOUNT_TOLERANCE
+
+RESULTS_DB = os.getenv("RESULTS_DB", "invoice_results.sqlite3")
+# PRAGMA user_version of an up-to-date database; 1: date columns hold ISO dates
+SCHEMA_VERSION = 1
+
+INDEXED_FIELDS = ["Invoice No", "PO Number", "Supplier Name", "Lot Number", "Date of Invoice", "Expiry Date"]
+# Looked up by code or name, so matched case-insensitively
+NOCASE_FIELDS = ["Invoice No", "PO Number", "Supplier Name", "Lot Number"]
+
+
+# Legal-form and filler words dropped when comparing supplier names
+_SUPPLIER_NOISE = {
+    "the", "and", "co", "company", "corp", "corporation", "inc", "incorporated", "ltd", "limited", "llc",
+    "plc", "gmbh", "ag", "sa", "sas", "srl", "spa", "bv", "nv", "pvt", "pte", "fze", "fzco", "wll", "est", "trading",
+}
+
+
+def supplier_key(name):
+    """Supplier name without case, punctuation or legal form: 'ACME Co., Ltd.' -> 'acme'"""
+    if is_missing(name):
+        return ""
+    words = re.findall(r'[a-z0-9]+', str(name).lower().replace("&", " and "))
+    return " ".join(word for word in words if word not in _SUPPLIER_NOISE) or " ".join(words)
+
+
+def invoice_key(invoice_no):
+    """Invoice number without case, spaces or punctuation: 'inv 2024/001' -> 'INV2024001'"""
+    if is_missing(invoice_no):
+        return ""
+    return re.sub(r'[^A-Z0-9]', '', str(invoice_no).upper())
+
+
+def _booking_keys(row):
+    return (
+        supplier_key(row.get("Supplier Name")),
+        invoice_key(row.get("Invoice No")),
+        parse_amount(row.get("Total Amount of the Invoice")),
+    )
+
+
+def _same_total(a, b):
+    # An unreadable total on either side does not rule the match out
+    if a is None or b is None:
+        return True
+    return abs(a - b) <= max(0.01, AMOUNT_TOLERANCE * max(abs(a), abs(b)))
+
+
+def iso_dates(values):
+    """ISO date text (YYYY-MM-DD) for each value, None where it does not read as a date"""
+    dates = normalize_dates(pd.Series(list(values), dtype=object))
+    return [None if pd.isna(date) else date for date in dates.dt.strftime("%Y-%m-%d")]
+
+
+def _sql_value(value):
+    # Nested values (a list of line items, say) are kept as JSON text
+    if value is None or isinstance(value, (str, int, float)):
+        return value
+    return json.dumps(value)
+
+
+class ResultsStore:
+    """SQLite store of extracted rows with indexed lookups"""
+
+    def __init__(self, path=RESULTS_DB):
+        self._lock = threading.Lock()
+        self._db = sqlite3.connect(path, check_same_thread=False)
+        self._db.row_factory = sqlite3.Row
+        self._db.execute("PRAGMA journal_mode=WAL")
+
+        columns = []
+        for field in INVOICE_FIELDS + SOURCE_FIELDS:
+            collate = " COLLATE NOCASE" if field in NOCASE_FIELDS else ""
+            columns.append(f"{column_name(field)}{collate}")
+        self._db.executescript(f"""
+            CREATE TABLE IF NOT EXISTS runs (
+                run_id TEXT PRIMARY KEY,
+                created TEXT NOT NULL,
+                source TEXT
+            );
+            CREATE TABLE IF NOT EXISTS extractions (
+                id INTEGER PRIMARY KEY,
+                run_id TEXT NOT NULL REFERENCES runs (run_id),
+                {", ".join(columns)},
+                data TEXT NOT NULL
+            );
+            CREATE INDEX IF NOT EXISTS extractions_run ON extractions (run_id);
+        """)
+        self._add_missing_columns(columns)
+        for field in INDEXED_FIELDS + ["Processing Time"]:
+            column = column_name(field)
+            self._db.execute(f"CREATE INDEX IF NOT EXISTS extractions_{column} ON extractions ({column})")
+        self._db.commit()
+
+    def _add_missing_columns(self, columns):
+        """Bring a database from an older version up to date, filling in the double-booking keys"""
+        existing = {row["name"] for row in self._db.execute("PRAGMA table_info(extractions)")}
+        for column in columns + ["supplier_key TEXT", "invoice_key TEXT", "total_amount REAL"]:
+            if column.split()[0] not in existing:
+                self._db.execute(f"ALTER TABLE extractions ADD COLUMN {column}")
+        self._db.execute("CREATE INDEX IF NOT EXISTS extractions_booking ON extractions (invoice_key, supplier_key)")
+        missing = self._db.execute("SELECT id, data FROM extractions WHERE invoice_key IS NULL").fetchall()
+        self._db.executemany(
+            "UPDATE extractions SET supplier_key = ?, invoice_key = ?, total_amount = ? WHERE id = ?",
+            [(*_booking_keys(json.loads(row["data"])), row["id"]) for row in missing]
+        )
+        if self._db.execute("PRAGMA user_version").fetchone()[0] < 1:
+            # Older versions stored dates as the model wrote them
+            stored = self._db.execute("SELECT id, data FROM extractions").fetchall()
+            rows = [json.loads(row["data"]) for row in stored]
+            dates = [iso_dates(row.get(field) for row in rows) for field in DATE_FIELDS]
+            assignments = ", ".join(f"{column_name(field)} = ?" for field in DATE_FIELDS)
+            self._db.executemany(
+                f"UPDATE extractions SET {assignments} WHERE id = ?",
+                [(*values, row["id"]) for row, *values in zip(stored, *dates)]
+            )
+        self._db.execute(f"PRAGMA user_version = {SCHEMA_VERSION}")
+
+    def save_results(self, rows, run_id=None, source="upload"):
+        """Store a run's rows, replacing any rows already stored under the same run id; returns the run id"""
+        run_id = run_id or f"{datetime.now().strftime('%Y%m%d_%H%M%S')}_{uuid.uuid4().hex[:6]}"
+        fields = INVOICE_FIELDS + SOURCE_FIELDS
+        columns = ", ".join(column_name(field) for field in fields)
+        placeholders = ", ".join("?" for _ in fields)
+        dates = {field: iso_dates(row.get(field) for row in rows) for field in DATE_FIELDS}
+        values = [
+            [dates[field][n] if field in dates else _sql_value(row.get(field)) for field in fields]
+            for n, row in enumerate(rows)
+        ]
+        with self._lock, self._db:
+            self._db.execute("DELETE FROM extractions WHERE run_id = ?", (run_id,))
+            self._db.execute(
+                "INSERT OR REPLACE INTO runs (run_id, created, source) VALUES (?, ?, ?)",
+                (run_id, datetime.now().isoformat(timespec="seconds"), source)
+            )
+            self._db.executemany(
+                f"INSERT INTO extractions (run_id, {columns}, supplier_key, invoice_key, total_amount, data) "
+                f"VALUES (?, {placeholders}, ?, ?, ?, ?)",
+                [
+                    (run_id, *row_values, *_booking_keys(row), json.dumps(row, default=str))
+                    for row, row_values in zip(rows, values)
+                ]
+            )
+        return run_id
+
+    def has_run(self, run_id):
+        with self._lock:
+            return self._db.execute("SELECT 1 FROM runs WHERE run_id = ?", (run_id,)).fetchone() is not None
+
+    def query(self, invoice_no=None, po_number=None, supplier=None, lot_number=None,
+              date_from=None, date_to=None, run_id=None, limit=None, newest_first=True):
+        """Stored rows matching every given filter, newest first unless newest_first is False
+
+        Codes and the supplier match exactly but case-insensitively; a
+        supplier ending in '*' matches as a prefix. Dates may be given in
+        any format the extraction reads and are compared as ISO dates on
+        the Date of Invoice.
+        """
+        clauses, params = [], []
+        for field, value in (("Invoice No", invoice_no), ("PO Number", po_number), ("Lot Number", lot_number)):
+            if value:
+                clauses.append(f"{column_name(field)} = ?")
+                params.append(value.strip())
+        if supplier:
+            supplier = supplier.strip()
+            if supplier.endswith("*"):
+                # A range on the NOCASE column is a prefix search that uses its index
+                clauses.append(f"{column_name('Supplier Name')} >= ? AND {column_name('Supplier Name')} < ?")
+                params.extend([supplier[:-1], supplier[:-1] + "\U0010ffff"])
+            else:
+                clauses.append(f"{column_name('Supplier Name')} = ?")
+                params.append(supplier)
+        for value, operator in ((date_from, ">="), (date_to, "<=")):
+            if value:
+                clauses.append(f"{column_name('Date of Invoice')} {operator} ?")
+                params.append(iso_dates([str(value)])[0] or str(value))
+        if run_id:
+            clauses.append("run_id = ?")
+            params.append(run_id)
+
+        sql = "SELECT run_id, data FROM extractions"
+        if clauses:
+            sql += " WHERE " + " AND ".join(clauses)
+        sql += " ORDER BY id DESC" if newest_first else " ORDER BY id"
+        if limit:
+            sql += f" LIMIT {int(limit)}"
+        with self._lock:
+            rows = self._db.execute(sql, params).fetchall()
+        return [dict(json.loads(row["data"]), **{"Run": row["run_id"]}) for row in rows]
+
+    def find_invoice(self, invoice_no, supplier=None):
+        """Rows already stored for an invoice number (and supplier, when given)"""
+        return self.query(invoice_no=invoice_no, supplier=supplier)
+
+    def lines_for_po(self, po_number):
+        return self.query(po_number=po_number)
+
+    def find_bookings(self, row, exclude_run=None):
+        """Stored rows for the same supplier and invoice number with the same total (within tolerance)"""
+        supplier, invoice, total = _booking_keys(row)
+        if not invoice:
+            return []
+        with self._lock:
+            matches = self._db.execute(
+                "SELECT run_id, total_amount, data FROM extractions WHERE invoice_key = ? AND supplier_key = ?",
+                (invoice, supplier)
+            ).fetchall()
+        return [
+            dict(json.loads(match["data"]), **{"Run": match["run_id"]})
+            for match in matches
+            if match["run_id"] != exclude_run and _same_total(total, match["total_amount"])
+        ]
+
+    def flag_double_bookings(self, rows):
+        """Set 'Possible Double Booking' on rows already stored, or repeated earlier in `rows`; returns the flagged rows"""
+        flagged = []
+        seen = {}
+        for row in rows:
+            supplier, invoice, total = _booking_keys(row)
+            if not invoice:
+                continue
+            earlier = [
+                f"{match.get('Source File', '?')} (run {match['Run']})" for match in self.find_bookings(row)
+            ] + [
+                f"{other.get('Source File', '?')} (this run)"
+                for other in seen.get((supplier, invoice), [])
+                if _same_total(total, parse_amount(other.get("Total Amount of the Invoice")))
+            ]
+            if earlier:
+                more = f" and {len(earlier) - 3} more" if len(earlier) > 3 else ""
+                row["Possible Double Booking"] = "; ".join(earlier[:3]) + more
+                flagged.append(row)
+            seen.setdefault((supplier, invoice), []).append(row)
+        return flagged
+
+    def runs(self):
+        """Stored runs with their row counts, newest first"""
+        with self._lock:
+            rows = self._db.execute("""
+                SELECT runs.run_id, runs.created, runs.source, COUNT(extractions.id) AS row_count
+                FROM runs LEFT JOIN extractions ON extractions.run_id = runs.run_id
+                GROUP BY runs.run_id ORDER BY runs.created DESC
+            """).fetchall()
+        return [dict(row) for row in rows]
+
+    def close(self):
+        with self._lock:
+            self._db.close()
@@ -13,6 +13,7 @@ import re
 from datetime import datetime
 import openpyxl
 from openpyxl.styles import Font, PatternFill, Alignment
+from upload_spool import InFlightQuota, SESSION_INFLIGHT_MB, UploadQuotaExceeded, spool_upload
 
 # Load environment variables
 load_dotenv()
@@ -38,8 +39,11 @@ def extract_text_from_pdf(pdf_file):
     text = ""
     
     try:
+        # The upload is spooled to disk once; every backend opens it by path
+        pdf_path = pdf_file.path
+        
         # First try with pdfplumber (better for searchable PDFs)
-        with pdfplumber.open(pdf_file) as pdf:
+        with pdfplumber.open(pdf_path) as pdf:
             for page in pdf.pages:
                 page_text = page.extract_text()
                 if page_text:
@@ -47,7 +51,7 @@ def extract_text_from_pdf(pdf_file):
         
         # If no text extracted, try OCR with PyMuPDF
         if not text.strip():
-            pdf_document = fitz.open(stream=pdf_file.read(), filetype="pdf")
+            pdf_document = fitz.open(pdf_path)
             for page_num in range(pdf_document.page_count):
                 page = pdf_document[page_num]
                 # Convert page to image
@@ -185,12 +189,19 @@ def main():
             status_text = st.empty()
             
             all_extracted_data = []
+            upload_quota = st.session_state.setdefault("upload_quota", InFlightQuota(SESSION_INFLIGHT_MB))
             
             for i, uploaded_file in enumerate(uploaded_files):
                 status_text.text(f"Processing {uploaded_file.name}...")
                 
-                # Extract text from PDF
-                text = extract_text_from_pdf(uploaded_file)
+                # Extract text from PDF, spooled to disk once
+                try:
+                    with spool_upload(uploaded_file, upload_quota) as spooled:
+                        text = extract_text_from_pdf(spooled)
+                except UploadQuotaExceeded as e:
+                    st.warning(f"Skipped {uploaded_file.name}: {str(e)}")
+                    progress_bar.progress((i + 1) / len(uploaded_files))
+                    continue
                 
                 if text.strip():
                     # Extract data using OpenAI
@@ -0,0 +1,428 @@
+#!/usr/bin/env python3
+"""
+Supplier templates - deterministic extraction for layouts we have seen before
+
+A document's layout is fingerprinted from the positions of its label words
+("Invoice No:", "Lot", "Qty") on the first page. Every validated LLM
+extraction of a layout is an observation: each field value is located among
+the words and recorded as a box relative to its nearest label, and values
+that never appear in the text (supplier, currency) are recorded as constants.
+Once every field has been confirmed MIN_CONFIRMATIONS times the template
+extracts matching documents on its own; its results still go through
+validation, and a template that keeps failing is relearned.
+"""
+
+import json
+import os
+import re
+import tempfile
+import threading
+from collections import Counter
+from datetime import datetime
+
+import fitz  # PyMuPDF
+import numpy as np
+
+from field_values import is_missing, parse_amount
+from invoice_fields import DATE_FIELDS, DATE_FORMATS, INVOICE_FIELDS
+from model_router import NUMERIC_FIELDS, validate_extraction
+from pdf_layout import CELL_GAP, WordLayout
+
+SUPPLIER_TEMPLATES_FILE = os.getenv("SUPPLIER_TEMPLATES_FILE", "supplier_templates.json")
+
+# Observations that must agree before a field (and so a template) is trusted
+MIN_CONFIRMATIONS = 3
+# Failed validations in a row before a template's fields are relearned
+MAX_FAILURES = 2
+# Share of first-page label positions two documents must share to be one layout
+MATCH_THRESHOLD = 0.75
+# Label positions are compared on a grid of this many points
+GRID_POINTS = 12
+# Longest run of words tried when locating a value on a row
+MAX_VALUE_WORDS = 8
+
+# Label words each field is usually printed under or next to
+FIELD_LABELS = {
+    "PO Number": {"po", "p.o", "purchase", "order"},
+    "Item Code": {"item", "code", "sku", "part", "product"},
+    "Description": {"description", "product", "name"},
+    "UOM": {"uom", "unit", "u/m"},
+    "Quantity": {"qty", "quantity"},
+    "Lot Number": {"lot", "batch"},
+    "Expiry Date": {"expiry", "exp", "expiration"},
+    "Mfg Date": {"mfg", "manufacturing", "production"},
+    "Invoice No": {"invoice", "inv"},
+    "Unit Price": {"price", "rate", "cost"},
+    "Total Price": {"total", "amount"},
+    "Country": {"country", "origin"},
+    "HS Code": {"hs", "hsn", "tariff", "customs"},
+    "Date of Invoice": {"date"},
+    "Customer No": {"customer", "client", "account"},
+    "Payer Name": {"payer", "bill", "billing"},
+    "Currency": {"currency", "curr"},
+    "Supplier Name": {"supplier", "vendor", "seller"},
+    "Total Amount of the Invoice": {"total", "grand", "due"},
+    "Total VAT or Tax": {"vat", "tax"},
+}
+ANCHOR_WORDS = set().union(*FIELD_LABELS.values()) | {"no", "number", "date", "net", "subtotal"}
+
+
+def read_layout(path):
+    """Word layout of a PDF, or None when it has no text layer (scans have no stable word boxes)"""
+    try:
+        with fitz.open(path) as pdf_document:
+            layout = WordLayout.from_document(pdf_document)
+    except Exception:
+        return None
+    return layout if len(layout) else None
+
+
+def _label(word):
+    return word.lower().strip(":#.,()")
+
+
+def _norm(value):
+    return re.sub(r'[^a-z0-9]', '', str(value).lower())
+
+
+def _date_readings(text):
+    """(format, ISO date) for every format the text parses with"""
+    readings = []
+    for date_format in DATE_FORMATS:
+        try:
+            readings.append((date_format, datetime.strptime(text.strip(), date_format).strftime("%Y-%m-%d")))
+        except ValueError:
+            continue
+    return readings
+
+
+class _Words:
+    """Reading-order view of a layout: rows of word indices plus the label anchors"""
+
+    def __init__(self, layout):
+        self.layout = layout
+        self.text = layout.words(np.arange(len(layout)))
+        self.normalized = [_norm(word) for word in self.text]
+        self.height = layout._median_height() or 1.0
+        row_ids = layout.rows()
+        order = np.lexsort((layout.x0, row_ids))
+        self.rows = [list(group) for group in np.split(order, np.flatnonzero(np.diff(row_ids[order])) + 1)]
+
+        # Anchors are keyed by label and occurrence on the page ("total@1" is the second "Total")
+        self.anchors = {}
+        seen = Counter()
+        for row in self.rows:
+            for i in row:
+                word = self.text[i]
+                label = _label(word)
+                if label in ANCHOR_WORDS or (word.endswith(":") and label):
+                    page = int(layout.page[i])
+                    key = f"{label}@{seen[page, label]}"
+                    seen[page, label] += 1
+                    self.anchors[page, key] = i
+        self.labels = set(self.anchors.values())
+
+    def fingerprint(self):
+        """First-page label positions on a coarse grid"""
+        return {
+            (key.split("@")[0], int(self.layout.x0[i] // GRID_POINTS), int(self.layout.y0[i] // GRID_POINTS))
+            for (page, key), i in self.anchors.items() if page == 0
+        }
+
+    def box(self, indices):
+        layout = self.layout
+        return (float(layout.x0[indices].min()), float(layout.y0[indices].min()),
+                float(layout.x1[indices].max()), float(layout.y1[indices].max()))
+
+    def spans(self, value, field):
+        """Runs of words on one row that read as the value: [(indices, date format or None)]"""
+        target = _norm(value)
+        amount = parse_amount(value) if field in NUMERIC_FIELDS else None
+        iso_date = str(value).strip() if field in DATE_FIELDS else None
+        if not target:
+            return []
+
+        found = []
+        for row in self.rows:
+            for start in range(len(row)):
+                joined = ""
+                for end in range(start + 1, min(len(row), start + MAX_VALUE_WORDS) + 1):
+                    joined += self.normalized[row[end - 1]]
+                    if len(joined) > len(target) + 8:
+                        break
+                    if joined == target:
+                        found.append((row[start:end], None))
+                        continue
+                    # Printed amounts and dates are short ("USD 1,250.00", "15 Jan 2024") and carry no label
+                    if end - start > 3 or not any(ch.isdigit() for ch in joined) or self.labels & set(row[start:end]):
+                        continue
+                    candidate = " ".join(self.text[i] for i in row[start:end])
+                    if amount is not None and parse_amount(candidate) == amount:
+                        found.append((row[start:end], None))
+                    elif iso_date:
+                        formats = [fmt for fmt, iso in _date_readings(candidate) if iso == iso_date]
+                        if formats:
+                            found.append((row[start:end], formats[0]))
+        # A run holding a shorter match ("Saline 3" around "3") only adds words that are not the value
+        return [
+            (indices, date_format) for indices, date_format in found
+            if not any(len(other) < len(indices) and set(other) <= set(indices) for other, _ in found)
+        ]
+
+    def nearest_anchor(self, indices, field):
+        """Closest label above or to the left of the words, preferring the field's own labels"""
+        layout = self.layout
+        page = int(layout.page[indices[0]])
+        x0, y0, x1, y1 = self.box(indices)
+        tolerance = self.height / 2
+
+        best = None
+        for (anchor_page, key), i in self.anchors.items():
+            if anchor_page != page or i in indices:
+                continue
+            if layout.y0[i] > y1 + tolerance or layout.x0[i] > x1 + tolerance:
+                continue
+            distance = abs((layout.x0[i] + layout.x1[i]) / 2 - (x0 + x1) / 2) + abs(layout.y0[i] - y0)
+            preferred = key.split("@")[0] in FIELD_LABELS.get(field, ())
+            rank = (not preferred, distance)
+            if best is None or rank < best[0]:
+                best = (rank, key, i)
+        return best
+
+    def read(self, page, anchor_key, box):
+        """Text in the box relative to the anchor, extended along its row while the words stay in the cell
+
+        A value starts at the box's left edge, or (right-aligned) ends at its
+        right edge. Longer values may run up to CELL_GAP heights past the
+        learned box, but never into a label or the next column.
+        """
+        anchor = self.anchors.get((page, anchor_key))
+        if anchor is None:
+            return None
+        layout = self.layout
+        ax, ay = float(layout.x0[anchor]), float(layout.y0[anchor])
+        x0, y0, x1, y1 = ax + box[0], ay + box[1], ax + box[2], ay + box[3]
+        tolerance = self.height / 2
+        overrun = self.height * CELL_GAP
+
+        def same_cell(left, right):
+            return layout.x0[right] - layout.x1[left] <= overrun
+
+        for row in self.rows:
+            if int(layout.page[row[0]]) != page:
+                continue
+            centre = (layout.y0[row[0]] + layout.y1[row[0]]) / 2
+            if not y0 - tolerance <= centre <= y1 + tolerance:
+                continue
+            starts = [p for p, i in enumerate(row) if i != anchor and abs(layout.x0[i] - x0) <= tolerance]
+            if starts:
+                first = last = starts[0]
+                while (last + 1 < len(row) and row[last + 1] not in self.labels and same_cell(row[last], row[last + 1])
+                       and layout.x1[row[last + 1]] <= x1 + overrun):
+                    last += 1
+            else:
+                ends = [p for p, i in enumerate(row) if i != anchor and abs(layout.x1[i] - x1) <= tolerance]
+                if not ends:
+                    continue
+                first = last = ends[-1]
+                while (first > 0 and row[first - 1] not in self.labels and same_cell(row[first - 1], row[first])
+                       and layout.x0[row[first - 1]] >= x0 - overrun):
+                    first -= 1
+            return " ".join(self.text[i] for i in row[first:last + 1])
+        return None
+
+
+def _jaccard(a, b):
+    return len(a & b) / len(a | b) if a or b else 0.0
+
+
+def _new_field():
+    return {"regions": [], "absent": 0, "constants": {}}
+
+
+def _same_region(a, b, tolerance):
+    """Same anchor and top edge, and the same left (left-aligned) or right (right-aligned) edge"""
+    if a["page"] != b["page"] or a["anchor"] != b["anchor"] or abs(a["box"][1] - b["box"][1]) > tolerance:
+        return False
+    return abs(a["box"][0] - b["box"][0]) <= tolerance or abs(a["box"][2] - b["box"][2]) <= tolerance
+
+
+def _resolve(field_stats):
+    """How a field is extracted: ("region", region), ("constant", value), ("absent", None) or None if unsettled"""
+    regions = sorted(field_stats["regions"], key=lambda region: region["count"], reverse=True)
+    if regions and regions[0]["count"] >= MIN_CONFIRMATIONS:
+        return "region", regions[0]
+    constants = field_stats["constants"]
+    if len(constants) == 1 and not regions and not field_stats["absent"]:
+        value, count = next(iter(constants.items()))
+        if count >= MIN_CONFIRMATIONS:
+            return "constant", json.loads(value)
+    if field_stats["absent"] >= MIN_CONFIRMATIONS and not regions and not constants:
+        return "absent", None
+    return None
+
+
+def _typed(field, text, date_format=None):
+    if text is None:
+        return "N/A"
+    if field in NUMERIC_FIELDS:
+        amount = parse_amount(text)
+        if amount is not None:
+            return int(amount) if amount.is_integer() else amount
+    if field in DATE_FIELDS and date_format:
+        try:
+            return datetime.strptime(text.strip(), date_format).strftime("%Y-%m-%d")
+        except ValueError:
+            pass
+    return text
+
+
+class TemplateStore:
+    """Learned supplier layouts, persisted as JSON"""
+
+    def __init__(self, path=SUPPLIER_TEMPLATES_FILE):
+        self.path = path
+        self.templates = []
+        self.hits = 0
+        self.failures = 0
+        self.observations = 0
+        self._lock = threading.Lock()
+        try:
+            with open(path, encoding="utf-8") as f:
+                self.templates = json.load(f).get("templates", [])
+        except (OSError, ValueError):
+            self.templates = []
+
+    def save(self):
+        """Write the templates through a private temp file; raises OSError when that fails"""
+        with self._lock:
+            payload = {"version": 1, "templates": self.templates}
+        # Sessions saving at the same time must not share one temp file
+        fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(os.path.abspath(self.path)), suffix=".tmp")
+        try:
+            with os.fdopen(fd, "w", encoding="utf-8") as f:
+                json.dump(payload, f, indent=1)
+            os.replace(tmp_path, self.path)
+        except Exception:
+            os.remove(tmp_path)
+            raise
+
+    def _match(self, fingerprint):
+        best, best_score = None, MATCH_THRESHOLD
+        for template in self.templates:
+            score = _jaccard(fingerprint, {tuple(entry) for entry in template["fingerprint"]})
+            if score >= best_score:
+                best, best_score = template, score
+        return best
+
+    def extract(self, layout, text=""):
+        """Fields of a document whose layout has a settled template, or None to use the LLM"""
+        words = _Words(layout)
+        with self._lock:
+            template = self._match(words.fingerprint())
+            if template is None:
+                return None
+            plan = {field: _resolve(template["fields"].get(field, _new_field())) for field in INVOICE_FIELDS}
+        if any(resolution is None for resolution in plan.values()):
+            return None
+
+        data = {}
+        for field, (kind, detail) in plan.items():
+            if kind == "region":
+                data[field] = _typed(field, words.read(detail["page"], detail["anchor"], detail["box"]), detail.get("date_format"))
+            elif kind == "constant":
+                data[field] = detail
+            else:
+                data[field] = "N/A"
+
+        with self._lock:
+            if not validate_extraction(data, text)["valid"]:
+                self.failures += 1
+                template["failures"] = template.get("failures", 0) + 1
+                if template["failures"] >= MAX_FAILURES:
+                    # The supplier changed its layout: start learning it again
+                    template["fields"] = {}
+                    template["failures"] = 0
+                return None
+            self.hits += 1
+            template["failures"] = 0
+            template["hits"] = template.get("hits", 0) + 1
+        return data
+
+    def learn(self, layout, data, text=""):
+        """Record a validated extraction as an observation of the document's layout"""
+        if data is None or not validate_extraction(data, text)["valid"]:
+            return
+        words = _Words(layout)
+        fingerprint = words.fingerprint()
+        if not fingerprint:
+            return
+
+        observed = {}
+        for field in INVOICE_FIELDS:
+            value = data.get(field)
+            if is_missing(value):
+                observed[field] = ("absent", None)
+                continue
+            spans = words.spans(value, field)
+            anchored = [(indices, date_format, words.nearest_anchor(indices, field)) for indices, date_format in spans]
+            anchored = [entry for entry in anchored if entry[2] is not None]
+            # A value found in several places is only trusted next to one of its field's labels
+            preferred = [entry for entry in anchored if not entry[2][0][0]]
+            if len(preferred) == 1 or (len(anchored) == 1 and not preferred):
+                indices, date_format, (_, key, anchor) = (preferred or anchored)[0]
+                ax, ay = float(layout.x0[anchor]), float(layout.y0[anchor])
+                x0, y0, x1, y1 = words.box(indices)
+                observed[field] = ("region", {
+                    "page": int(layout.page[indices[0]]),
+                    "anchor": key,
+                    "box": [x0 - ax, y0 - ay, x1 - ax, y1 - ay],
+                    "date_format": date_format,
+                })
+            else:
+                observed[field] = ("constant", json.dumps(value))
+
+        with self._lock:
+            template = self._match(fingerprint)
+            if template is None:
+                template = {
+                    "id": len(self.templates) + 1,
+                    "fingerprint": sorted(list(entry) for entry in fingerprint),
+                    "supplier": None,
+                    "observations": 0,
+                    "hits": 0,
+                    "failures": 0,
+                    "fields": {},
+                }
+                self.templates.append(template)
+            template["observations"] += 1
+            if not is_missing(data.get("Supplier Name")):
+                template["supplier"] = data["Supplier Name"]
+            self.observations += 1
+
+            for field, (kind, detail) in observed.items():
+                field_stats = template["fields"].setdefault(field, _new_field())
+                if kind == "absent":
+                    field_stats["absent"] += 1
+                elif kind == "constant":
+                    field_stats["constants"][detail] = field_stats["constants"].get(detail, 0) + 1
+                else:
+                    for region in field_stats["regions"]:
+                        if _same_region(region, detail, words.height):
+                            region["count"] += 1
+                            break
+                    else:
+                        field_stats["regions"].append(dict(detail, count=1))
+
+    def summary(self, documents):
+        """One-line report for the processing log"""
+        with self._lock:
+            settled = sum(
+                1 for template in self.templates
+                if all(_resolve(template["fields"].get(field, _new_field())) for field in INVOICE_FIELDS)
+            )
+            return (
+                f"Supplier templates: {self.hits}/{documents} invoice(s) extracted without the LLM, "
+                f"{self.failures} template result(s) failed validation, {self.observations} layout(s) observed; "
+                f"{settled} of {len(self.templates)} template(s) ready"
+            )
@@ -1,9 +1,14 @@
 #!/usr/bin/env python3
 """
 Test script to verify the setup without OCR dependencies
+
+Set LLM_CASSETTE_MODE=replay to run the extraction check from a recording
+(made once with LLM_CASSETTE_MODE=record) instead of the live API.
 """
 
+import os
 import sys
+import json
 import importlib
 
 def test_imports():
@@ -43,11 +48,15 @@ def test_openai_key():
     """Test if OpenAI API key is configured"""
     try:
         from dotenv import load_dotenv
-        import os
         
+        # Before llm_backend reads its settings
         load_dotenv()
+        from llm_backend import needs_api_key
         api_key = os.getenv("OPENAI_API_KEY")
         
+        if not needs_api_key():
+            print("✅ No OpenAI API key needed (custom base URL or cassette replay)")
+            return True
         if api_key and api_key != "your_openai_api_key_here":
             print("✅ OpenAI API key is configured")
             return True
@@ -109,8 +118,9 @@ def test_excel_creation():
 def test_data_extraction():
     """Test data extraction with sample text"""
     try:
-        import openai
-        openai.api_key = os.getenv("OPENAI_API_KEY")
+        from llm_backend import create_client
+        # Honors OPENAI_BASE_URL and LLM_CASSETTE_MODE, so this can run against the mock or a recording
+        client = create_client(os.getenv("OPENAI_API_KEY"))
         
         # Sample invoice text
         sample_text = """
@@ -164,7 +174,7 @@ def test_data_extraction():
         Return only valid JSON format with the above fields as keys.
         """
         
-        response = openai.chat.completions.create(
+        response = client.chat.completions.create(
             model="gpt-3.5-turbo",
             messages=[
                 {"role": "system", "content": "You are an expert at extracting structured data from invoices. Return only valid JSON."},
@@ -0,0 +1,97 @@
+#!/usr/bin/env python3
+"""
+Check that learned supplier templates read only their own value
+
+Builds invoices in one tightly set layout, where labels and table columns
+sit close to the values ("Invoice No: INV-1005", "Lot: L523 Expiry: ...",
+"Country: Germany HS Code: 3004.90"), learns a template from three of them
+and extracts a fourth without the LLM. Needs only PyMuPDF and numpy.
+"""
+
+import os
+import sys
+import tempfile
+
+import fitz  # PyMuPDF
+
+from invoice_fields import INVOICE_FIELDS
+from supplier_templates import TemplateStore, read_layout
+
+def make_invoice(path, n, qty, price):
+    """Write one invoice in the test layout and return the extraction it should give"""
+    pdf_document = fitz.open()
+    page = pdf_document.new_page()
+    
+    def put(x, y, text):
+        page.insert_text((x, y), text, fontsize=10)
+    
+    vat = round(qty * price * 0.19, 2)
+    put(50, 60, "Nordpharm Supplies GmbH")
+    put(50, 90, f"Invoice No: INV-{1000 + n}")
+    put(50, 105, f"Date: {n:02d}/03/2024")
+    put(300, 90, "Customer No: C-1001")
+    put(50, 150, "Item"); put(100, 150, "Description"); put(196, 150, "Qty"); put(214, 150, "Price"); put(250, 150, "Total")
+    put(50, 165, f"A-{100 + n}"); put(100, 165, "Saline"); put(200, 165, str(qty))
+    put(214, 165, f"{price:.2f}"); put(250, 165, f"{qty * price:.2f}")
+    put(50, 190, f"Lot: L{520 + n} Expiry: {n:02d}/12/2026 Mfg: {n:02d}/12/2024")
+    put(50, 205, "Country: Germany HS Code: 3004.90")
+    put(300, 240, f"VAT: {vat:.2f}")
+    put(300, 255, f"Grand Total: {qty * price + vat:.2f}")
+    pdf_document.save(path)
+    pdf_document.close()
+    
+    data = {field: "N/A" for field in INVOICE_FIELDS}
+    data.update({
+        "Invoice No": f"INV-{1000 + n}",
+        "Date of Invoice": f"2024-03-{n:02d}",
+        "Customer No": "C-1001",
+        "Item Code": f"A-{100 + n}",
+        "Description": "Saline",
+        "Quantity": qty,
+        "Unit Price": price,
+        "Total Price": round(qty * price, 2),
+        "Lot Number": f"L{520 + n}",
+        "Expiry Date": f"2026-12-{n:02d}",
+        "Mfg Date": f"2024-12-{n:02d}",
+        "Country": "Germany",
+        "HS Code": "3004.90",
+        "Supplier Name": "Nordpharm Supplies GmbH",
+        "Total Amount of the Invoice": round(qty * price + vat, 2),
+        "Total VAT or Tax": vat,
+    })
+    return data
+
+def test_values_stop_at_labels():
+    """A template learned from three invoices reads the fourth field for field"""
+    with tempfile.TemporaryDirectory() as folder:
+        store = TemplateStore(os.path.join(folder, "templates.json"))
+        for n in range(1, 4):
+            path = os.path.join(folder, f"invoice_{n}.pdf")
+            data = make_invoice(path, n, 2 + n, 10.0 * n)
+            store.learn(read_layout(path), data)
+        
+        path = os.path.join(folder, "invoice_5.pdf")
+        expected = make_invoice(path, 5, 3, 20.0)
+        extracted = store.extract(read_layout(path))
+    
+    assert extracted is not None, "the template did not settle or failed validation"
+    
+    wrong = {field: extracted[field] for field in INVOICE_FIELDS if extracted[field] != expected[field]}
+    assert not wrong, "; ".join(f"{field}: read {value!r}, expected {expected[field]!r}" for field, value in wrong.items())
+    
+    print("✅ Every field read from its own cell")
+
+def main():
+    """Run all checks"""
+    print("🔍 Testing supplier templates\n")
+    
+    try:
+        test_values_stop_at_labels()
+    except AssertionError as e:
+        print(f"❌ {e}")
+        print("\n❌ Some checks failed.")
+        sys.exit(1)
+    print("\n🎉 All checks passed!")
+
+if __name__ == "__main__":
+    main()
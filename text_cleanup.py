@@ -0,0 +1,168 @@
+#!/usr/bin/env python3
+"""
+Text cleanup before the LLM call - strips repeated headers/footers and known supplier boilerplate
+"""
+
+import json
+import os
+import re
+
+# Pages are separated by a form feed, the same marker Tesseract ends each page with
+PAGE_BREAK = "\f"
+
+# Headers and footers live at the edges of a page
+HEADER_FOOTER_LINES = 8
+
+# Rough OpenAI tokenizer ratio for English/number-heavy invoice text
+CHARS_PER_TOKEN = 4
+
+BOILERPLATE_FILE = os.getenv("BOILERPLATE_FILE", "boilerplate.json")
+
+# "Page 2 of 5", "Page 2/5", "Page 2": labelled, so a page number wherever it sits in the margins
+_PAGE_NUMBER_RE = re.compile(r'^page\s*#(\s*(of|/)\s*#)?$')
+# "2/5", "2 of 5": also dates ("06/2027") and quantities ("1/2") unless it counts up across pages
+_PAGE_COUNTER_RE = re.compile(r'^(\d+)\s*(?:of|/)\s*(\d+)$')
+
+_supplier_boilerplate = None
+
+
+def _normalize_line(line):
+    """Case- and whitespace-insensitive form of a line"""
+    return re.sub(r'\s+', ' ', line.lower()).strip()
+
+
+def _is_page_number(normalized):
+    """True for 'Page 2 of 5', 'Page 2/5' and 'Page 2'"""
+    return bool(_PAGE_NUMBER_RE.match(re.sub(r'\d+', '#', normalized)))
+
+
+def _edge_lines(page):
+    """Indexes (into page.splitlines()) of the first and last HEADER_FOOTER_LINES non-empty lines"""
+    filled = [i for i, line in enumerate(page.splitlines()) if line.strip()]
+    return set(filled[:HEADER_FOOTER_LINES]) | set(filled[-HEADER_FOOTER_LINES:])
+
+
+def find_page_counters(pages):
+    """(page index, line index) of bare 'n/N' or 'n of N' lines that count the pages
+
+    A counter is only taken as one when it sits in the header/footer zone
+    and the same total appears on at least two pages with `n` going up by
+    one per page; a lone "1/2" or "06/2027" stays in the text.
+    """
+    runs = {}
+    for page_index, page in enumerate(pages):
+        lines = page.splitlines()
+        for line_index in _edge_lines(page):
+            match = _PAGE_COUNTER_RE.match(_normalize_line(lines[line_index]))
+            if match:
+                number, total = int(match.group(1)), int(match.group(2))
+                if number <= total:
+                    runs.setdefault((total, number - page_index), []).append((page_index, line_index))
+
+    counters = set()
+    for positions in runs.values():
+        if len({page_index for page_index, _ in positions}) >= 2:
+            counters.update(positions)
+    return counters
+
+
+def strip_page_break(page_text):
+    """One page's OCR text without Tesseract's form feeds, which would otherwise read as extra pages"""
+    return (page_text or "").rstrip(PAGE_BREAK).replace(PAGE_BREAK, "\n")
+
+
+def split_pages(text):
+    """Split extracted text into pages on the page-break marker"""
+    return text.split(PAGE_BREAK)
+
+
+def load_supplier_boilerplate(path=None):
+    """Load {supplier keyword: [boilerplate regex, ...]} from the boilerplate file"""
+    global _supplier_boilerplate
+    if _supplier_boilerplate is not None and path is None:
+        return _supplier_boilerplate
+
+    patterns = {}
+    try:
+        with open(path or BOILERPLATE_FILE, "r", encoding="utf-8") as f:
+            for supplier, entries in json.load(f).items():
+                patterns[supplier.lower()] = [re.compile(entry, re.IGNORECASE) for entry in entries]
+    except (OSError, ValueError, re.error):
+        patterns = {}
+
+    if path is None:
+        _supplier_boilerplate = patterns
+    return patterns
+
+
+def find_repeated_lines(pages):
+    """Normalized lines that appear in the header/footer zone of at least half the pages (min. 2)"""
+    pages = [page for page in pages if page.strip()]
+    if len(pages) < 2:
+        return set()
+
+    page_counts = {}
+    for page in pages:
+        lines = [_normalize_line(l) for l in page.splitlines() if l.strip()]
+        edges = set(lines[:HEADER_FOOTER_LINES]) | set(lines[-HEADER_FOOTER_LINES:])
+        for line in edges:
+            if line:
+                page_counts[line] = page_counts.get(line, 0) + 1
+
+    threshold = max(2, (len(pages) + 1) // 2)
+    return {line for line, count in page_counts.items() if count >= threshold}
+
+
+def strip_boilerplate(text, supplier_boilerplate=None):
+    """Remove repeated page headers/footers and known supplier boilerplate
+
+    The first occurrence of a repeated header is kept because it usually
+    carries the supplier name and address the LLM needs. Returns the cleaned
+    text and a stats dict with removed lines/characters and estimated tokens saved.
+    """
+    pages = split_pages(text)
+    repeated = find_repeated_lines(pages)
+    counters = find_page_counters(pages)
+
+    if supplier_boilerplate is None:
+        supplier_boilerplate = load_supplier_boilerplate()
+    lowered = text.lower()
+    known_patterns = [
+        pattern
+        for supplier, patterns in supplier_boilerplate.items() if supplier in lowered
+        for pattern in patterns
+    ]
+
+    seen = set()
+    removed_lines = 0
+    removed_chars = 0
+    cleaned_pages = []
+    for page_index, page in enumerate(pages):
+        kept = []
+        edges = _edge_lines(page)
+        for line_index, line in enumerate(page.splitlines()):
+            normalized = _normalize_line(line)
+            drop = False
+            if (page_index, line_index) in counters:
+                drop = True
+            elif normalized and line_index in edges and _is_page_number(normalized):
+                drop = True
+            elif normalized in repeated:
+                drop = normalized in seen
+                seen.add(normalized)
+            elif known_patterns and any(p.search(line) for p in known_patterns):
+                drop = True
+
+            if drop:
+                removed_lines += 1
+                removed_chars += len(line) + 1
+            else:
+                kept.append(line)
+        cleaned_pages.append("\n".join(kept))
+
+    stats = {
+        "removed_lines": removed_lines,
+        "removed_chars": removed_chars,
+        "tokens_saved": removed_chars // CHARS_PER_TOKEN,
+    }
+    return PAGE_BREAK.join(cleaned_pages), stats
@@ -0,0 +1,134 @@
+#!/usr/bin/env python3
+"""
+Text-layer quality scoring - catches garbage text layers before they reach the LLM
+
+Broken PDFs (CID fonts without a ToUnicode map, ligature soup) still return
+non-empty text. These pages score low on character classes, dictionary hits
+and numeric density, and should be OCRed instead. Arabic text (bilingual
+UAE and GCC invoices) and the main Western European languages are scored
+like English, and a page whose words hit almost nothing in the vocabulary
+fails whatever its digits look like.
+"""
+
+import re
+import unicodedata
+
+# Pages scoring below this are sent to OCR
+QUALITY_THRESHOLD = 0.5
+
+# Pages with at least MIN_DICTIONARY_WORDS words must hit the vocabulary this often to pass
+MIN_DICTIONARY_HITS = 0.05
+MIN_DICTIONARY_WORDS = 5
+
+# Common English, Arabic and European invoice vocabulary used for the dictionary hit rate
+COMMON_WORDS = frozenset("""
+a about above account after all amount and any are as at bank batch be bill billing box by
+certificate charge charges city code company contact country credit currency customer date
+day days delivery description details discount document due each email end exp expiry for
+freight from goods gross have hs in including invoice is it item items its lot ltd mfg net
+no not number of on or order origin our packing page paid pay payable payer payment per
+phone please po price product purchase qty quantity rate received reference remarks sale
+sales ship shipment shipping sold subtotal supplier tax tel terms than that the this to
+total transfer unit uom use value vat vendor via we will with you your
+kg pcs pc box ea each carton cartons pack net weight llc inc co limited trading street road
+""".split()) | frozenset("""
+فاتورة ضريبية ضريبة الضريبة الضريبي ضريبي رقم تاريخ التاريخ مبلغ المبلغ اجمالي الاجمالي مجموع المجموع
+قيمة القيمة المضافة كمية الكمية سعر السعر الوحدة وحدة العميل عميل المورد مورد درهم ريال دينار شركة
+الصافي صافي خصم الخصم البند الوصف وصف طلب الشراء شراء امر دولة الامارات العربية المتحدة دبي ابوظبي
+الشارقة هاتف فاكس المستحق الدفع دفع حساب البنك بنك المنتج منتج رمز الكود التشغيلة الانتهاء الصنع
+""".split()) | frozenset("""
+eur usd gbp chf aed sar iban bic swift
+rechnung rechnungsnummer rechnungsdatum datum kunde kundennummer lieferant lieferung lieferschein
+menge einheit preis einzelpreis gesamtpreis betrag gesamtbetrag summe zwischensumme netto brutto
+mwst ust steuer bestellung bestellnummer artikel artikelnummer beschreibung bezeichnung stück
+zahlung zahlbar zahlungsbedingungen fällig bis tage bank konto der die das und für mit von zum zur
+facture numéro date client fournisseur livraison quantité prix unitaire montant total sous tva
+taxe commande article désignation référence paiement échéance jours pour les des une sur avec
+factura número fecha cliente proveedor entrega cantidad precio importe base iva impuesto pedido
+artículo descripción pago vencimiento días para del los las con por
+fattura numero data cliente fornitore consegna quantità prezzo importo totale imponibile ordine
+articolo descrizione pagamento scadenza giorni per della con
+factuur factuurnummer factuurdatum datum klant leverancier levering aantal prijs bedrag totaal
+btw bestelling artikel omschrijving betaling vervaldatum dagen voor van het een
+fatura número data cliente fornecedor entrega quantidade preço valor total encomenda artigo
+descrição pagamento vencimento dias para com
+""".split())
+
+# Artefacts of a text layer without a usable Unicode mapping
+_CID_RE = re.compile(r'\(cid:\d+\)')
+_WORD_RE = re.compile(r'[A-Za-zÀ-ÖØ-öø-ÿ]{3,}|[\u0621-\u064A]{2,}')
+_TOKEN_RE = re.compile(r'\S+')
+
+# Characters real invoice text is made of, listed explicitly: isalnum() would also
+# accept Latin-1 mojibake such as ÿþ¼½ and private-use glyphs
+_OK_CHARS_RE = re.compile(
+    r'[\x20-\x7e\t\n\r'
+    r'\u0600-\u06ff\u0750-\u077f\ufb50-\ufdff\ufe70-\ufeff'   # Arabic, incl. presentation forms
+    r'àáâäçèéêëìíîïñòóôöùúûüßÀÁÄÇÈÉÊËÌÍÎÏÑÒÓÔÖÙÚÛÜ'             # accented Latin letters
+    r'€£¥₹°–—‘’“”•·×\u00a0]'
+)
+# Arabic diacritics and tatweel, dropped before the vocabulary lookup
+_ARABIC_MARKS_RE = re.compile(r'[\u064b-\u065f\u0670\u0640]')
+_ALEF_FORMS = str.maketrans("أإآ", "ااا")
+
+
+def _char_class_ratio(text):
+    """Share of characters in the printable ASCII, Arabic and accented-Latin ranges"""
+    if not text:
+        return 0.0
+    return len(_OK_CHARS_RE.findall(text)) / len(text)
+
+
+def _vocabulary_form(word):
+    return _ARABIC_MARKS_RE.sub("", word.lower()).translate(_ALEF_FORMS)
+
+
+def _is_known_word(word):
+    # Arabic may come out of a PDF in visual (reversed) order
+    return word in COMMON_WORDS or word[::-1] in COMMON_WORDS
+
+
+def score_text(text):
+    """Score extracted page text from 0 (garbage) to 1 (clean), with the component signals"""
+    text = text or ""
+    stripped = text.strip()
+    if not stripped:
+        return {"score": 0.0, "char_ratio": 0.0, "dictionary_hits": 0.0, "numeric_density": 0.0, "cid_glyphs": 0}
+
+    cid_glyphs = len(_CID_RE.findall(stripped))
+    cleaned = _CID_RE.sub(" ", stripped)
+
+    char_ratio = _char_class_ratio(cleaned)
+
+    # NFKC folds Arabic presentation forms back to plain letters for the lookup
+    words = [_vocabulary_form(w) for w in _WORD_RE.findall(unicodedata.normalize("NFKC", cleaned))]
+    dictionary_hits = sum(1 for w in words if _is_known_word(w)) / len(words) if words else 0.0
+
+    tokens = _TOKEN_RE.findall(cleaned)
+    numeric_density = sum(1 for t in tokens if any(c.isdigit() for c in t)) / len(tokens) if tokens else 0.0
+
+    # Invoice text typically hits the common vocabulary for 20%+ of its words
+    # and has numbers in at least a few percent of its tokens
+    score = (
+        0.4 * char_ratio
+        + 0.4 * min(1.0, dictionary_hits / 0.2)
+        + 0.2 * min(1.0, numeric_density / 0.05)
+    )
+    if cid_glyphs:
+        score *= max(0.0, 1.0 - cid_glyphs / max(1, len(tokens)))
+    # Digits and clean characters alone don't make text readable (shifted-cipher fonts)
+    if len(words) >= MIN_DICTIONARY_WORDS and dictionary_hits < MIN_DICTIONARY_HITS:
+        score = min(score, QUALITY_THRESHOLD * dictionary_hits / MIN_DICTIONARY_HITS)
+
+    return {
+        "score": round(score, 3),
+        "char_ratio": round(char_ratio, 3),
+        "dictionary_hits": round(dictionary_hits, 3),
+        "numeric_density": round(numeric_density, 3),
+        "cid_glyphs": cid_glyphs,
+    }
+
+
+def is_low_quality(text, threshold=QUALITY_THRESHOLD):
+    """True if a page's text layer is too poor to send to the LLM"""
+    return score_text(text)["score"] < threshold
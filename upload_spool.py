@@ -0,0 +1,101 @@
+#!/usr/bin/env python3
+"""
+Upload spooling - writes each upload to disk once so every PDF backend opens it by path
+
+Reading an upload into a bytes object per backend multiplies memory use by
+the number of backends (and users). Instead the upload is streamed to a
+spool file, all backends open that path, and the file is deleted as soon as
+extraction is done. A per-session quota caps the
+bytes that may be spooled at the same time.
+"""
+
+import os
+import shutil
+import tempfile
+import threading
+import uuid
+
+UPLOAD_SPOOL_DIR = os.getenv("UPLOAD_SPOOL_DIR") or os.path.join(tempfile.gettempdir(), "invoice_uploads")
+SESSION_INFLIGHT_MB = float(os.getenv("SESSION_INFLIGHT_MB", "200"))
+
+_COPY_CHUNK = 1024 * 1024
+
+
+class UploadQuotaExceeded(Exception):
+    """Raised when spooling an upload would exceed the session's in-flight byte cap"""
+
+
+class InFlightQuota:
+    """Bytes currently spooled for one session, capped at max_bytes"""
+
+    def __init__(self, max_mb=SESSION_INFLIGHT_MB):
+        self.max_bytes = int(max_mb * 1024 * 1024)
+        self.in_flight = 0
+        self._lock = threading.Lock()
+
+    def acquire(self, nbytes):
+        with self._lock:
+            if self.in_flight + nbytes > self.max_bytes:
+                raise UploadQuotaExceeded(
+                    f"{(self.in_flight + nbytes) / 1024 / 1024:.1f} MB in flight "
+                    f"would exceed the {self.max_bytes / 1024 / 1024:.0f} MB session limit"
+                )
+            self.in_flight += nbytes
+
+    def release(self, nbytes):
+        with self._lock:
+            self.in_flight = max(0, self.in_flight - nbytes)
+
+
+class SpooledUpload:
+    """An uploaded PDF spooled to disk; use as a context manager to release it promptly"""
+
+    def __init__(self, name, path, size, quota=None):
+        self.name = name
+        self.path = path
+        self.size = size
+        self._quota = quota
+
+    def release(self):
+        """Delete the spool file and return its bytes to the session quota"""
+        if self.path:
+            try:
+                os.remove(self.path)
+            except OSError:
+                pass
+            self.path = None
+            if self._quota is not None:
+                self._quota.release(self.size)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.release()
+        return False
+
+
+def spool_upload(uploaded_file, quota=None):
+    """Stream an uploaded file to the spool directory without loading it into a new bytes object"""
+    size = getattr(uploaded_file, "size", None)
+    if size is None:
+        uploaded_file.seek(0, os.SEEK_END)
+        size = uploaded_file.tell()
+
+    if quota is not None:
+        quota.acquire(size)
+
+    path = os.path.join(UPLOAD_SPOOL_DIR, f"{uuid.uuid4().hex}.pdf")
+    try:
+        os.makedirs(UPLOAD_SPOOL_DIR, exist_ok=True)
+        uploaded_file.seek(0)
+        with open(path, "wb") as f:
+            shutil.copyfileobj(uploaded_file, f, _COPY_CHUNK)
+    except Exception:
+        if os.path.exists(path):
+            os.remove(path)
+        if quota is not None:
+            quota.release(size)
+        raise
+
+    return SpooledUpload(getattr(uploaded_file, "name", os.path.basename(path)), path, size, quota)